@@ -3,13 +3,51 @@
 """
 import logging
 import os
-import subprocess
-from shutil import which
 import numpy as np
+from parflow.subset.utils.io import write_text_rows
 
+# patch codes
+# 0 = land border
+# 1 = ocean border
+# 3 = regular overland boundary
+# 4 = Lake
+# 5 = Sink
+# 6 = bottom
+# 8 = Stream
+# 9 = Reservoir
+SIDE_PATCH = 0
+OCEAN_PATCH = 1
+TOP_PATCH = 3
+LAKE_PATCH = 4
+SINK_PATCH = 5
+BOTTOM_PATCH = 6
+STREAM_PATCH = 8
+RESERVOIR_PATCH = 9
 
-def make_solid_file(clipped_mask, out_name, dx=1000, dz=1000):
-    """Make a solid file and vtk file from a clipped mask, write to out_name, requires pfmask-to-sol from pftools
+# domain inputs marking special top patches, with the code of the patch, the first listed wins where they overlap,
+# no CONUS2 input marks streams so the stream patch comes from the CHANNELS input
+SPECIAL_TOP_PATCHES = (('RESERVOIRS', RESERVOIR_PATCH),
+                       ('SINKS', SINK_PATCH),
+                       ('LAKE_MASK', LAKE_PATCH),
+                       ('LAKE_BORDER', LAKE_PATCH),
+                       ('CHANNELS', STREAM_PATCH))
+# domain input marking the cells on an ocean border, and its value for them
+BORDER_CELL_TYPES = 'CELL_TYPES'
+OCEAN_CELL_TYPE = 1
+SPECIAL_LAYERS = tuple(key for key, _ in SPECIAL_TOP_PATCHES) + (BORDER_CELL_TYPES,)
+
+# corners of the face of a cell on each side, as (x, y, z) offsets from the cell's lower corner, ordered
+# counter-clockwise seen from outside the cell so every triangle's normal points out of the solid
+FACE_CORNERS = {'top': ((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)),
+                'bottom': ((0, 0, 0), (0, 1, 0), (1, 1, 0), (1, 0, 0)),
+                'left': ((0, 0, 0), (0, 0, 1), (0, 1, 1), (0, 1, 0)),
+                'right': ((1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1)),
+                'front': ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1)),
+                'back': ((0, 1, 0), (0, 1, 1), (1, 1, 1), (1, 1, 0))}
+
+
+def make_solid_file(clipped_mask, out_name, dx=1000, dz=1000, vtk=True, special_layers=None):
+    """Make a solid file and vtk file from a clipped mask, write to out_name
 
     Parameters
     ----------
@@ -21,129 +59,204 @@ def make_solid_file(clipped_mask, out_name, dx=1000, dz=1000):
         horizontal cell size (Default value = 1000)
     dz : int, optional
         vertical cell size (Default value = 1000)
+    vtk : bool, optional
+        also write the .vtk file (Default value = True)
+    special_layers : dict, optional
+        domain inputs clipped the same as clipped_mask, keyed by their name in SPECIAL_LAYERS, marking the special
+        patches of the solid, see `solid_patch_mats` (Default value = None)
 
     Returns
     -------
     batches : list
-        list of batches (patches?) located
+        sorted patch codes in the solid file
     """
-    # TODO Add ability to buid features as patches on top layer of mask
-    pf_mask_to_sol_path = find_mask_to_sol_exe()
-    if pf_mask_to_sol_path is None:
-        msg = 'Could not locate pfmask-to-pfsol utility needed to generate solid file (.pfsol)' \
-              ' ensure PARFLOW_DIR environment variable is set'
-        logging.exception(msg)
-        raise Exception(msg)
-    # TODO: Should not have to flip this mask. Find why it is upside down
-    mask_mat = np.flip(clipped_mask, axis=1)
-    #
-
-    if len(mask_mat.shape) == 3:
-        mask_mat = np.squeeze(mask_mat, axis=0)
-    # create back borders
-    # Back borders occur where mask[y+1]-mask[y] is negative
-    # (i.e. the cell above is a zero and the cell is inside the mask, i.e. a 1)
-    back_mat = np.zeros(mask_mat.shape)
-
-    # create front borders
-    # Front borders occur where mask[y-1]-mask[y] is negative
-    # (i.e. the cell above is a zero and the cell is inside the mask, i.e. a 1)
-    front_mat = np.zeros(mask_mat.shape)
-
-    # create left borders
-    # Left borders occur where mask[x-1]-mask[x] is negative
-    left_mat = np.zeros(mask_mat.shape)
-
-    # create right borders
-    # Right borders occur where mask[x+1]-mask[x] is negative
-    right_mat = np.zeros(mask_mat.shape)
-
-    # deal with top and bottom patches
-    # 3 = regular overland boundary
-    # 4 = Lake
-    # 5 = Sink
-    # 6 = bottom
-    # 8 = Stream
-    # 9 = Reservoir
-
-    top_mat = mask_mat * 3
-
-    bottom_mat = mask_mat * 6
-
-    # create header and write ascii files
-    header = 'ncols ' + str(mask_mat.shape[1]) + '\n'
-    header += 'nrows ' + str(mask_mat.shape[0]) + '\n'
-    header += 'xllcorner 0.0\n'
-    header += 'yllcorner 0.0\n'
-    header += 'cellsize ' + str(dx) + '\n'
-    header += 'NODATA_value 0.0\n'
-
-    patches = {os.path.join(os.path.dirname(out_name), 'Back_Border.asc'): back_mat,
-               os.path.join(os.path.dirname(out_name), 'Front_Border.asc'): front_mat,
-               os.path.join(os.path.dirname(out_name), 'Right_Border.asc'): right_mat,
-               os.path.join(os.path.dirname(out_name), 'Left_Border.asc'): left_mat,
-               os.path.join(os.path.dirname(out_name), 'Bottom_Border.asc'): bottom_mat,
-               os.path.join(os.path.dirname(out_name), 'Top_Border.asc'): top_mat}
-
-    list_patches = list(patches.keys())
-    for patch in patches:
-        with open(patch, 'w') as fo:
-            fo.write(header)
-            np.savetxt(fo, patches[patch].reshape([-1, 1]), '%.3f', ' ')
-
-    # Create solid domain file
-    # This part assumes that you have installed pf-mask-utilities or ParFlow with PARFLOW_DIR set
-    out_vtk = out_name + '.vtk'
-    out_pfsol = out_name + '.pfsol'
-
-    if os.path.isfile(out_vtk):
-        os.remove(out_vtk)
-
-    if os.path.isfile(out_pfsol):
-        os.remove(out_pfsol)
-
-    sub_cmd_str = [pf_mask_to_sol_path[0],
-                   '--mask-back', list_patches[0],
-                   '--mask-front', list_patches[1],
-                   '--mask-right', list_patches[2],
-                   '--mask-left ' + list_patches[3],
-                   '--mask-bottom ' + list_patches[4],
-                   '--mask-top ' + list_patches[5],
-                   '--vtk', out_vtk,
-                   '--pfsol', out_pfsol,
-                   pf_mask_to_sol_path[1], str(dz)]
-    logging.info(f'begin mask_to_sol subprocess, command executed: {sub_cmd_str}')
-    create_sub = subprocess.run(sub_cmd_str, stdout=subprocess.PIPE)
-    temp_list = create_sub.stdout.decode('utf-8').split('\n')
-    batches = ''
-    for line in temp_list:
-        if 'Number of triangles in patch' in line:
-            line = line.strip()
-            batches += line.split()[-3] + ' '
-    logging.info(f'identified batches in domain {batches}')
+    patch_mats = solid_patch_mats(clipped_mask, special_layers=special_layers)
+    points, triangles, patches = build_solid(patch_mats, dx=dx, dz=dz)
+    write_pfsol(f'{out_name}.pfsol', points, triangles, patches)
+    if vtk:
+        write_vtk(f'{out_name}.vtk', points, triangles, patches)
+    batches = sorted(patches)
+    logging.info(f'identified batches in domain {batches}, '
+                 f'triangles per batch {[len(patches[batch]) for batch in batches]}')
     return batches
 
 
-def find_mask_to_sol_exe():
-    """find the pf_mask_to_pfsol or mask-to-pfsol utility on the system
+def solid_patch_mats(clipped_mask, special_layers=None):
+    """get the patch code of each face of each cell of a mask
+
+    Top faces are overland (3) unless a special layer marks the cell (value > 0) as a reservoir (9), sink (5),
+    lake (4) or stream (8, from the CHANNELS input). Side faces are land borders (0), or ocean borders (1) where
+    the CELL_TYPES layer marks the cell as one.
+
+    Parameters
+    ----------
+    clipped_mask : ndarray
+        the mask array cropped to the inner shape, with 1's in the mask, 0's outside
+    special_layers : dict, optional
+        arrays the shape of clipped_mask, keyed by their name in SPECIAL_LAYERS (Default value = None)
+
+    Returns
+    -------
+    patch_mats : dict
+        (ny, nx) array of patch codes for the 'top', 'bottom', 'left', 'right', 'front' and 'back' face of
+        every cell, -1 where the cell has no face on that side
+    """
+    if special_layers is None:
+        special_layers = {}
+    mask_mat = _layer_2d(clipped_mask) == 1
+    top_keys = [(key, code) for key, code in SPECIAL_TOP_PATCHES if special_layers.get(key) is not None]
+    top_mat = np.full(mask_mat.shape, TOP_PATCH)
+    if top_keys:
+        top_mat = np.select([_layer_2d(special_layers[key]) > 0 for key, _ in top_keys],
+                            [code for _, code in top_keys], default=TOP_PATCH)
+    patch_mats = {'top': np.where(mask_mat, top_mat, -1), 'bottom': np.where(mask_mat, BOTTOM_PATCH, -1)}
+    side_mat = np.full(mask_mat.shape, SIDE_PATCH)
+    if special_layers.get(BORDER_CELL_TYPES) is not None:
+        cell_types = _layer_2d(special_layers[BORDER_CELL_TYPES])
+        side_mat[cell_types == OCEAN_CELL_TYPE] = OCEAN_PATCH
+    for side, outside in _border_faces(mask_mat).items():
+        patch_mats[side] = np.where(outside, side_mat, -1)
+    logging.info(f'assigned solid patches from {[key for key, _ in top_keys]} '
+                 f'{"and " + BORDER_CELL_TYPES if special_layers.get(BORDER_CELL_TYPES) is not None else ""}')
+    return patch_mats
+
+
+def _layer_2d(layer):
+    """the (ny, nx) top layer of a 2d or single layer 3d array"""
+    layer = np.asarray(layer)
+    if layer.ndim == 3:
+        layer = layer[-1]
+    return layer
+
+
+def _border_faces(mask_mat):
+    """find the cells of a 2d mask with a face on the border of the mask on each side
+
+    A cell has a border face on a side when it is in the mask and its neighbor on that side is not, found by
+    comparing the mask with itself shifted by one cell.
+
+    Parameters
+    ----------
+    mask_mat : ndarray
+        (ny, nx) boolean mask, y axis 0 at bottom
+
+    Returns
+    -------
+    dict
+        (ny, nx) boolean arrays of the cells with a 'left', 'right', 'front' and 'back' border face
+    """
+    padded = np.pad(mask_mat, 1, mode='constant', constant_values=False)
+    inner = padded[1:-1, 1:-1]
+    return {'left': inner & ~padded[1:-1, :-2],
+            'right': inner & ~padded[1:-1, 2:],
+            'front': inner & ~padded[:-2, 1:-1],
+            'back': inner & ~padded[2:, 1:-1]}
+
+
+def build_solid(patch_mats, dx=1000, dz=1000):
+    """triangulate the faces of a single layer of cells into a closed surface
+
+    Parameters
+    ----------
+    patch_mats : dict
+        (ny, nx) array of patch codes for each side of each cell, -1 where there is no face, see `solid_patch_mats`
+    dx : int, optional
+        horizontal cell size (Default value = 1000)
+    dz : int, optional
+        vertical cell size (Default value = 1000)
+
+    Returns
+    -------
+    points : ndarray
+        (n, 3) x, y, z of the surface vertices, y axis 0 at bottom
+    triangles : ndarray
+        (m, 3) point indices of each triangle
+    patches : dict
+        indices of the triangles in each patch, keyed by patch code
+    """
+    ny, nx = patch_mats['top'].shape
+    corners = []
+    codes = []
+    for side, offsets in FACE_CORNERS.items():
+        cell_y, cell_x = np.nonzero(patch_mats[side] >= 0)
+        # corner ids on the (nz=2, ny + 1, nx + 1) grid of cell corners, one row of 4 per face
+        offsets = np.array(offsets)
+        corners.append(((offsets[:, 2] * (ny + 1) + cell_y[:, np.newaxis] + offsets[:, 1]) * (nx + 1) +
+                        cell_x[:, np.newaxis] + offsets[:, 0]))
+        codes.append(patch_mats[side][cell_y, cell_x])
+    corners = np.concatenate(corners)
+    codes = np.concatenate(codes)
+    # only the corners used by a face become points
+    used, quads = np.unique(corners, return_inverse=True)
+    quads = quads.reshape(corners.shape)
+    # each quad splits into two triangles along its 0-2 diagonal
+    triangles = np.stack((quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]), axis=1).reshape(-1, 3)
+    codes = np.repeat(codes, 2)
+    corner_z, corner_y, corner_x = np.unravel_index(used, (2, ny + 1, nx + 1))
+    points = np.stack((corner_x * dx, corner_y * dx, corner_z * dz), axis=1)
+    patches = {int(code): np.flatnonzero(codes == code) for code in np.unique(codes)}
+    logging.info(f'built solid with {len(points)} points and {len(triangles)} triangles')
+    return points, triangles, patches
+
+
+def write_pfsol(out_file, points, triangles, patches):
+    """write a single solid to a ParFlow .pfsol file
+
+    Parameters
+    ----------
+    out_file : str
+        path and name of the .pfsol file
+    points : ndarray
+        (n, 3) x, y, z of the vertices
+    triangles : ndarray
+        (m, 3) point indices of each triangle
+    patches : dict
+        indices of the triangles in each patch, keyed by patch code
+
+    Returns
+    -------
+    None
+    """
+    with open(out_file, 'w') as fo:
+        # file version, then the points, then one solid
+        fo.write(f'1\n{len(points)}\n')
+        write_text_rows(fo, points, '%.17g')
+        fo.write(f'1\n{len(triangles)}\n')
+        write_text_rows(fo, triangles, '%d')
+        fo.write(f'{len(patches)}\n')
+        for code in sorted(patches):
+            fo.write(f'{len(patches[code])}\n')
+            write_text_rows(fo, patches[code], '%d')
+    logging.info(f'wrote solid file {out_file}')
+
+
+def write_vtk(out_file, points, triangles, patches):
+    """write a solid's surface to a legacy .vtk file, with the patch code of each triangle
+
+    Parameters
+    ----------
+    out_file : str
+        path and name of the .vtk file
+    points : ndarray
+        (n, 3) x, y, z of the vertices
+    triangles : ndarray
+        (m, 3) point indices of each triangle
+    patches : dict
+        indices of the triangles in each patch, keyed by patch code
 
     Returns
     -------
-    pf_mask_to_sol_path : tuple
-        tuple of (path to executable, depth/z-bottom flag for argument) or None if no executable was found
+    None
     """
-    pf_mask_to_sol_path = None
-    possible_paths = {('mask-to-pfsol', '--depth'): [os.environ.get('PFMASKUTILS'), which('mask-to-pfsol')],
-                      ('pfmask-to-pfsol', '--z-bottom'):
-                          [f'{os.environ.get("PARFLOW_DIR")}/bin', which('pfmask-to-pfsol')]}
-    for executable, possible_paths in possible_paths.items():
-        executable_path = next((path for path in possible_paths if path is not None), None)
-        if executable_path is not None:
-            if os.path.isfile(os.path.join(executable_path, executable[0])):
-                pf_mask_to_sol_path = (os.path.join(executable_path, executable[0]), executable[1])
-                break
-    if pf_mask_to_sol_path is None:
-        logging.exception('Could not locate mask to solid utility!')
-    else:
-        logging.info(f'searching for mask_to_sol executable resulted in: {pf_mask_to_sol_path[0]}')
-    return pf_mask_to_sol_path
+    triangle_codes = np.empty(len(triangles), dtype=np.int64)
+    for code, indices in patches.items():
+        triangle_codes[indices] = code
+    with open(out_file, 'w') as fo:
+        fo.write(f'# vtk DataFile Version 2.0\n{os.path.basename(out_file)}\nASCII\nDATASET POLYDATA\n')
+        fo.write(f'POINTS {len(points)} float\n')
+        write_text_rows(fo, points, '%.17g')
+        fo.write(f'POLYGONS {len(triangles)} {len(triangles) * 4}\n')
+        write_text_rows(fo, np.column_stack((np.full(len(triangles), 3), triangles)), '%d')
+        fo.write(f'CELL_DATA {len(triangles)}\nSCALARS patch_index int 1\nLOOKUP_TABLE default\n')
+        write_text_rows(fo, triangle_codes, '%d')
+    logging.info(f'wrote vtk file {out_file}')
@@ -9,6 +9,115 @@ import logging
 import parflow.subset.utils.io as file_io_tools
 
 
+# critical information
+CRITICAL_KEYS = ['runname', 'Process.Topology.P', 'Process.Topology.Q', 'Process.Topology.R',
+                 'file copy -force', 'ComputationalGrid.NX', 'ComputationalGrid.NY',
+                 'ComputationalGrid.NZ', 'ComputationalGrid.DX', 'ComputationalGrid.DY',
+                 'ComputationalGrid.DZ', 'GeomInput.domaininput.FileName', 'Geom.domain.Patches',
+                 'dzScale.nzListNumber', 'Cell.0.dzScale.Value', 'Cell.1.dzScale.Value',
+                 'Cell.2.dzScale.Value', 'Cell.3.dzScale.Value', 'Cell.4.dzScale.Value',
+                 'Geom.domain.Perm.Value', 'TimingInfo.BaseUnit', 'TimingInfo.StartTime',
+                 'TimingInfo.StopTime', 'TimingInfo.DumpInterval', 'TimeStep.Value',
+                 'Geom.domain.Porosity.Value', 'BCPressure.PatchNames',
+                 'Patch.top.BCPressure.Type', 'Patch.top.BCPressure.Cycle',
+                 'Patch.top.BCPressure.rain.Value', 'Patch.top.BCPressure.rec.Value',
+                 'Patch.top.BCPressure.alltime.Value', 'Solver.EvapTransFile',
+                 'Solver.EvapTrans.FileName', 'TopoSlopesX.FileName', 'TopoSlopesY.FileName',
+                 'pfdist', 'Geom.domain.ICPressure.Value', 'Geom.domain.ICPressure.RefPatch']
+# special solid file patches, with the patch whose boundary conditions they copy from the template
+SPECIAL_PATCH_BCS = {'ocean': 'land', 'lake': 'top', 'sink': 'top', 'stream': 'top', 'reservoir': 'top'}
+# longest command prefix indexed, for keys of several words such as 'file copy -force'
+MAX_KEY_WORDS = 3
+
+_template_cache = {}
+
+
+class TclTemplate:
+    """A ParFlow .tcl template, parsed once into an index from each word of its lines to the lines using it
+
+    Keys match whole words (or the first words of a line), so Cell.1.dzScale.Value does not match
+    Cell.10.dzScale.Value and runname does not match $runname.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(infile:{self.infile!r}, lines:{len(self.lines)!r}, " \
+               f"keys:{len(self.index)!r})"
+
+    def __init__(self, infile):
+        """
+
+        Parameters
+        ----------
+        infile : str
+            template input file to build from
+
+        Returns
+        -------
+        TclTemplate
+        """
+        self.infile = os.fspath(infile)
+        with open(self.infile, 'r') as fi:
+            self.lines = fi.read().split('\n')
+        self.index = {}
+        # filter out commented, empty lines
+        for ii, line in enumerate(self.lines):
+            if line and line[0] != '#':
+                words = line.split()
+                keys = set(words)
+                keys.update(' '.join(words[:n]) for n in range(2, MAX_KEY_WORDS + 1))
+                for key in keys:
+                    self.index.setdefault(key, []).append(ii)
+
+    def locate(self, key):
+        """line numbers of the lines setting or using key, in file order"""
+        return self.index.get(key, [])
+
+    def results(self, keys=None):
+        """split the lines of each key into words, ready to be edited and written back
+
+        Parameters
+        ----------
+        keys : list, optional
+            the keys to look up (Default value = CRITICAL_KEYS)
+
+        Returns
+        -------
+        results : dictionary
+            {key: {'locs': line numbers, 'vals': words of each line}} for the keys found in the template
+        """
+        if keys is None:
+            keys = CRITICAL_KEYS
+        results = {}
+        for key in keys:
+            locs = self.locate(key)
+            if locs:
+                results[key] = {'locs': list(locs),
+                                'vals': [[x.strip() for x in self.lines[loc].split(' ') if x] for loc in locs]}
+        return results
+
+
+def get_template(infile):
+    """get the parsed template for infile, reparsing it only when the file has changed
+
+    Parameters
+    ----------
+    infile : str
+        template input file
+
+    Returns
+    -------
+    TclTemplate
+    """
+    stat = os.stat(infile)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cache_key = os.path.abspath(infile)
+    cached = _template_cache.get(cache_key)
+    if cached is None or cached[0] != stamp:
+        logging.info(f'parsing tcl template {infile}')
+        cached = (stamp, TclTemplate(infile))
+        _template_cache[cache_key] = cached
+    return cached[1]
+
 
 def read_infile(infile):
     """
@@ -25,43 +134,42 @@ def read_infile(infile):
     content : list
         list of `infile` contents
     """
-    # critical information
-    crit_info = ['runname', 'Process.Topology.P', 'Process.Topology.Q', 'Process.Topology.R',
-                 'file copy -force', 'ComputationalGrid.NX', 'ComputationalGrid.NY',
-                 'ComputationalGrid.NZ', 'ComputationalGrid.DX', 'ComputationalGrid.DY',
-                 'ComputationalGrid.DZ', 'GeomInput.domaininput.FileName', 'Geom.domain.Patches',
-                 'dzScale.nzListNumber', 'Cell.0.dzScale.Value', 'Cell.1.dzScale.Value',
-                 'Cell.2.dzScale.Value', 'Cell.3.dzScale.Value', 'Cell.4.dzScale.Value',
-                 'Geom.domain.Perm.Value', 'TimingInfo.BaseUnit', 'TimingInfo.StartTime',
-                 'TimingInfo.StopTime', 'TimingInfo.DumpInterval', 'TimeStep.Value',
-                 'Geom.domain.Porosity.Value', 'BCPressure.PatchNames',
-                 'Patch.top.BCPressure.Type', 'Patch.top.BCPressure.Cycle',
-                 'Patch.top.BCPressure.rain.Value', 'Patch.top.BCPressure.rec.Value',
-                 'Patch.top.BCPressure.alltime.Value', 'Solver.EvapTransFile',
-                 'Solver.EvapTrans.FileName', 'TopoSlopesX.FileName', 'TopoSlopesY.FileName',
-                 'pfdist', 'Geom.domain.ICPressure.Value', 'Geom.domain.ICPressure.RefPatch']
+    template = get_template(infile)
+    return template.results(), list(template.lines)
+
 
-    with open(infile, 'r') as fi:
-        content = fi.read()
+def add_patch_bcs(content, patch_names):
+    """add boundary conditions for the special patches of a solid file the template has none for
 
-    results = {}
+    Each special patch copies the (already edited) boundary condition lines of the patch named for it in
+    SPECIAL_PATCH_BCS, so lakes, sinks, streams and reservoirs get the top boundary condition and ocean borders
+    the land one. The new lines are placed after the last patch boundary condition of the template.
 
-    content = content.split('\n')
-    # filter out commented, empty lines
-    for ii, line in enumerate(content):
-        if line:
-            if line[0] != '#':
-                for info in crit_info:
-                    if info in line:
-                        if info not in results.keys():
-                            results[info] = {}
-                            results[info]['locs'] = []
-                            results[info]['vals'] = []
-                        line = [x.strip() for x in line.split(' ') if x]
-                        results[info]['locs'].append(ii)
-                        results[info]['vals'].append(line)
+    Parameters
+    ----------
+    content : list
+        lines of the tcl file
+    patch_names : list
+        names of the patches in the solid file
 
-    return results, content
+    Returns
+    -------
+    content : list
+        lines of the tcl file with the added boundary conditions
+    """
+    bc_lines = [ii for ii, line in enumerate(content) if line.lstrip('#').startswith('pfset Patch.')
+                and '.BCPressure.' in line]
+    if not bc_lines:
+        return content
+    added = []
+    for name in dict.fromkeys(patch_names):
+        source = SPECIAL_PATCH_BCS.get(name)
+        if source is None or any(f'Patch.{name}.BCPressure.' in content[ii] for ii in bc_lines):
+            continue
+        added += ['', f'# {name.upper()}']
+        added += [content[ii].replace(f'Patch.{source}.BCPressure.', f'Patch.{name}.BCPressure.') for ii in bc_lines
+                  if f'Patch.{source}.BCPressure.' in content[ii]]
+    return content[:bc_lines[-1] + 1] + added + content[bc_lines[-1] + 1:]
 
 
 def parse_args(args):
@@ -136,6 +244,8 @@ def parse_args(args):
     parser.add_argument('--dz_scales', nargs='+', help='dz scale to be multiplied with dz (optional). Default is 0.5',
                         required=False)
     parser.add_argument('--batches', nargs='+', help='batches in domain (required)', required=True)
+    parser.add_argument('--no_pfdist', dest='pfdist', action='store_false',
+                        help='skip pfdist, the inputs already have .pfb.dist files for the P Q R topology (optional)')
 
     return parser.parse_args(args)
 
@@ -144,7 +254,7 @@ def build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, e
               evap_choice=0, k=0.02849, poros=0.39738, rain=-0.05,
               rec=0.0, constant=0, init=0.0, initw='bottom', flow='OverlandFlow', start_time=0.0, baseu=1, timestep=1,
               dump=1, dx=1000., dy=1000., dz=1000., nz=1,
-              dz_scales=None):
+              dz_scales=None, pfdist=True):
     """Build a tcl control file based on a template
 
     Parameters
@@ -207,6 +317,9 @@ def build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, e
         (Default value = 1)
     dz_scales : int, optional
         (Default value = None)
+    pfdist : bool, optional
+        run pfdist on the slope and PME files, False if their .pfb.dist files were already written for the
+        p, q, r topology (Default value = True)
 
     Returns
     -------
@@ -314,12 +427,15 @@ def build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, e
 
     if evap_choice == 1:
         results['pfdist']['vals'][2][-1] = os.path.basename(evap_file)
-    else:
+    if not pfdist:
+        # the inputs were written with their .pfb.dist files, distributing them again is not needed
+        for vals in results['pfdist']['vals'][:2]:
+            vals[0] = '#' + vals[0]
+    if evap_choice != 1 or not pfdist:
         results['pfdist']['vals'][2][0] = '#' + results['pfdist']['vals'][2][0]
 
-    # read slope file x into array
-    slope_x = file_io_tools.read_file(slope_file_x)
-    nz0, ny0, nx0 = slope_x.shape
+    # get the grid size from the slope file x header
+    nz0, ny0, nx0 = file_io_tools.probe_file(slope_file_x).shape
 
     results['ComputationalGrid.NX']['vals'][0][-1] = str(nx0)
     results['ComputationalGrid.NY']['vals'][0][-1] = str(ny0)
@@ -339,7 +455,9 @@ def build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, e
                   5: 'sink', 6: 'bottom', 8: 'stream', 9: 'reservoir'}
 
     patch_str = '\"'
-    for batch in batches.rstrip(' ').split(' '):
+    if isinstance(batches, str):
+        batches = batches.split()
+    for batch in batches:
         patch_str += batch_dict.get(int(batch), '') + ' '
 
     patch_str += '\"'
@@ -354,6 +472,8 @@ def build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, e
         for ix, loci in enumerate(locs):
             content[loci] = ' '.join(vals[ix])
 
+    content = add_patch_bcs(content, [batch_dict.get(int(batch)) for batch in batches])
+
     with open(out_file, 'w') as fo:
         for line in content:
             fo.write(line + '\n')
@@ -425,7 +545,7 @@ def main():
     build_tcl(out_file, temp_file, runname, slope_file, solid_file, evap_file, end_time, batches, p, q, r, evap_choice,
               k, poros, rain,
               rec, constant, init, initw, flow, start_time, baseu, timestep, dump, dx, dy, dz, nz,
-              dz_scales)
+              dz_scales, args.pfdist)
 
     end_date = datetime.utcnow()
     logging.info(f'completed process at {end_date} for a runtime of {end_date-start_date}')
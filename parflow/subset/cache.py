@@ -0,0 +1,206 @@
+"""Content-addressed on-disk cache of rasterized masks and the clippers derived from them
+
+An entry is keyed by a hash of everything the mask depends on: the shapefile parts, the attribute filter, the
+padding and the reference grid. It holds the mask values inside the bounding box, the bbox edges, the clipped
+geometry and the clipped mask, in one compressed .npz file, from which the mask and clipper are rebuilt without
+searching the mask again. Entries are evicted least recently used first once the cache grows past its size limit.
+"""
+import os
+import logging
+import hashlib
+from pathlib import Path
+import numpy as np
+from parflow.subset.mask import SubsetMask
+from parflow.subset.clipper import MaskClipper
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+SHAPEFILE_PARTS = ['shp', 'dbf', 'prj', 'shx']
+
+
+class MaskCache:
+    """Store and look up subset masks and mask clippers by the inputs they were made from"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cache_path:{self.cache_path!r}, max_bytes:{self.max_bytes!r})"
+
+    def __init__(self, cache_path, max_bytes=DEFAULT_CACHE_SIZE):
+        """
+
+        Parameters
+        ----------
+        cache_path : str
+            folder holding the cache entries, created if missing
+        max_bytes : int, optional
+            total size of the entries to keep, the least recently used are removed past it
+            (Default value = DEFAULT_CACHE_SIZE)
+
+        Returns
+        -------
+        MaskCache
+        """
+        self.cache_path = os.fspath(cache_path)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    def key(self, input_path, shapefile_name, reference_dataset, attribute_name='OBJECTID', attribute_ids=None,
+            padding=(0, 0, 0, 0), no_data=-999, no_data_threshold=-1):
+        """hash the inputs of a rasterized mask
+
+        Parameters
+        ----------
+        input_path : str
+            path to the shapefile parts
+        shapefile_name : str
+            name of the shapefile dataset
+        reference_dataset : gdal.dataset
+            gdal dataset defining the overall domain
+        attribute_name : str, optional
+            field in the shapefile to select on (Default value = 'OBJECTID')
+        attribute_ids : list, optional
+            attribute ID values selected (Default value = None)
+        padding : tuple, optional
+            padding added around the mask (Default value = (0,0,0,0))
+        no_data : int, optional
+            no_data value of the mask (Default value = -999)
+        no_data_threshold : int, optional
+            no_data_threshold of the clipper (Default value = -1)
+
+        Returns
+        -------
+        str
+            hex digest naming the cache entry
+        """
+        digest = hashlib.sha256()
+        for ext in SHAPEFILE_PARTS:
+            part = os.path.join(input_path, '.'.join((shapefile_name, ext)))
+            digest.update(ext.encode())
+            if os.path.isfile(part):
+                with open(part, 'rb') as part_file:
+                    for chunk in iter(lambda: part_file.read(1024 * 1024), b''):
+                        digest.update(chunk)
+        if attribute_ids is None:
+            attribute_ids = [1]
+        settings = (attribute_name, [str(i) for i in attribute_ids], [int(p) for p in padding], no_data,
+                    no_data_threshold, reference_dataset.GetGeoTransform(), reference_dataset.GetProjection(),
+                    reference_dataset.RasterXSize, reference_dataset.RasterYSize)
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def entry_file(self, key):
+        """path of the cache entry for key"""
+        return os.path.join(self.cache_path, f'{key}.npz')
+
+    def get(self, key, reference_dataset, no_data_threshold=-1):
+        """load a cached mask and its clipper
+
+        The mask and clipper are built straight from the stored bbox values, edges, geometry and clipped mask,
+        none of them are searched for or computed again.
+
+        Parameters
+        ----------
+        key : str
+            the entry's key, from `key`
+        reference_dataset : gdal.dataset
+            gdal dataset defining the overall domain
+        no_data_threshold : int, optional
+            no_data_threshold of the clipper, part of the key (Default value = -1)
+
+        Returns
+        -------
+        tuple
+            (SubsetMask, MaskClipper) or None if the entry is missing or does not match
+        """
+        entry_file = self.entry_file(key)
+        if not os.path.isfile(entry_file):
+            logging.info(f'mask cache miss {key}')
+            return None
+        with np.load(entry_file) as entry:
+            window = entry['window']
+            bbox_edges = tuple(int(edge) for edge in entry['bbox_edges'])
+            inner_mask_edges = tuple(int(edge) for edge in entry['inner_mask_edges'])
+            clipped_geom = tuple(float(value) for value in entry['clipped_geom'])
+            clipped_mask = self._unpack(entry['clipped_mask'], window.shape)
+            bbox_valid = self._unpack(entry['bbox_valid'], window.shape)
+            no_data = entry['no_data'].item() if entry['has_no_data'] else None
+            outer_value = entry['outer_value'] if entry['has_outer_value'] else None
+        min_y, max_y, min_x, max_x = bbox_edges
+        if window.shape != (1, max_y - min_y + 1, max_x - min_x + 1):
+            logging.warning(f'mask cache entry {entry_file} does not match the mask it holds, ignoring it')
+            return None
+        if outer_value is not None and not outer_value.ndim:
+            outer_value = outer_value.item()
+        subset_mask = SubsetMask.from_window(window, bbox_edges,
+                                             (1, reference_dataset.RasterYSize, reference_dataset.RasterXSize),
+                                             reference_dataset.GetGeoTransform(), reference_dataset.GetProjection(),
+                                             no_data_value=no_data, outer_value=outer_value, bbox_edges=bbox_edges,
+                                             inner_mask_edges=inner_mask_edges)
+        clipper = MaskClipper.from_arrays(subset_mask, clipped_geom, clipped_mask, bbox_valid)
+        # mark the entry as recently used
+        os.utime(entry_file)
+        logging.info(f'mask cache hit {key}, bbox_edges={bbox_edges}')
+        return subset_mask, clipper
+
+    @staticmethod
+    def _unpack(bits, shape):
+        """unpack a bit-packed boolean array of the given shape"""
+        return np.unpackbits(bits, count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+    def put(self, key, subset_mask, clipper):
+        """store a mask and its clipper, then evict old entries if the cache is over its size
+
+        Parameters
+        ----------
+        key : str
+            the entry's key, from `key`
+        subset_mask : SubsetMask
+            the mask, with any padding added
+        clipper : MaskClipper
+            the clipper made from subset_mask
+
+        Returns
+        -------
+        str
+            path of the entry written
+        """
+        min_y, max_y, min_x, max_x = subset_mask.bbox_edges
+        entry_file = self.entry_file(key)
+        no_data = subset_mask.no_data_value
+        outer_value = subset_mask._outer_value
+        # written under a temporary name so readers never see a partial entry
+        tmp_file = os.path.join(self.cache_path, f'{key}.{os.getpid()}.tmp.npz')
+        np.savez_compressed(tmp_file,
+                            window=subset_mask._window_values(min_y, max_y, min_x, max_x),
+                            bbox_edges=np.array([min_y, max_y, min_x, max_x]),
+                            inner_mask_edges=np.array(subset_mask.inner_mask_edges),
+                            clipped_geom=np.array(clipper.clipped_geom, dtype=np.float64),
+                            clipped_mask=np.packbits(clipper.clipped_mask),
+                            bbox_valid=np.packbits(clipper.bbox_valid),
+                            no_data=np.float64(0 if no_data is None else no_data),
+                            has_no_data=no_data is not None,
+                            outer_value=np.asarray(0 if outer_value is None else outer_value),
+                            has_outer_value=outer_value is not None)
+        os.replace(tmp_file, entry_file)
+        logging.info(f'mask cache stored {key} in {entry_file}')
+        self.evict()
+        return entry_file
+
+    def evict(self):
+        """remove the least recently used entries until the cache fits in max_bytes
+
+        Returns
+        -------
+        list
+            paths of the entries removed
+        """
+        entries = sorted(Path(self.cache_path).glob('*.npz'), key=lambda entry: entry.stat().st_mtime_ns)
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            entry.unlink()
+            removed.append(os.fspath(entry))
+        if removed:
+            logging.info(f'mask cache evicted {len(removed)} entries from {self.cache_path}')
+        return removed
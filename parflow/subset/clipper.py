@@ -6,19 +6,24 @@ import numpy.ma as ma
 from parflow.subset import TIF_NO_DATA_VALUE_OUT as NO_DATA
 from parflow.subset.utils import io as file_io_tools
 
+# lat/lon text output, up to 3 integer digits and the 6 decimal places of the CONUS lat/lon files
+LATLON_FMT = '%.9g'
+
 
 class Clipper(ABC):
 
     """Abstract Clipper Class"""
 
     @abstractmethod
-    def subset(self, data_array):
+    def subset(self, data_array, windowed=False):
         """Clip the data_array
 
         Parameters
         ----------
         data_array : ndarray
             3d array of data to be clipped
+        windowed : bool, optional
+            True if data_array was already read through the clipper's window (see `get_window`)
 
         Returns
         -------
@@ -27,6 +32,84 @@ class Clipper(ABC):
         """
         pass
 
+    def get_window(self):
+        """get the region of the full domain the clipper needs to read from its inputs
+
+        Returns
+        -------
+        tuple
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive extents, None for the full extent of an axis
+        """
+        return (None,) * 6
+
+    def subset_file(self, infile, reader=None, **kwargs):
+        """read only the clipper's window from infile and clip it
+
+        Parameters
+        ----------
+        infile : str
+            path to the file to clip (.pfb, .sa, .tif)
+        reader : callable, optional
+            reader(infile, window) returning the window of infile, such as a domain's tile reader,
+            None to read the file directly (Default value = None)
+        kwargs
+            additional keyword arguments for `subset`
+
+        Returns
+        -------
+        tuple
+            the results of `subset` for the data in infile
+        """
+        if reader is None:
+            reader = file_io_tools.read_file
+        data_array = reader(infile, window=self.get_window())
+        return self.subset(data_array, windowed=True, **kwargs)
+
+    def get_slab_windows(self, nz, slab_size):
+        """split the clipper's window into blocks of z layers
+
+        Parameters
+        ----------
+        nz : int
+            number of z layers in the inputs
+        slab_size : int
+            maximum number of z layers in a block
+
+        Returns
+        -------
+        list of tuples
+            (z_0, z_end, y_0, y_end, x_0, x_end) window of each block, in z order
+        """
+        z_0, z_end, y_0, y_end, x_0, x_end = self.get_window()
+        z_0 = 0 if z_0 is None else z_0
+        z_end = nz if z_end is None else min(z_end, nz)
+        return [(z, min(z + slab_size, z_end), y_0, y_end, x_0, x_end) for z in range(z_0, z_end, slab_size)]
+
+    def subset_file_slabs(self, infile, slab_size, reader=None, **kwargs):
+        """read and clip infile a block of z layers at a time, so only one block is in memory at once
+
+        Parameters
+        ----------
+        infile : str
+            path to the file to clip (.pfb, .sa, .tif)
+        slab_size : int
+            maximum number of z layers to read and clip at a time
+        reader : callable, optional
+            reader(infile, window) returning the window of infile, None to read the file directly
+            (Default value = None)
+        kwargs
+            additional keyword arguments for `subset`
+
+        Yields
+        ------
+        tuple
+            the results of `subset` for each block of layers, in z order
+        """
+        if reader is None:
+            reader = file_io_tools.read_file
+        for window in self.get_slab_windows(file_io_tools.probe_file(infile).shape[0], slab_size):
+            yield self.subset(reader(infile, window=window), windowed=True, **kwargs)
+
 
 class BoxClipper(Clipper):
     """Clip a rectangular data region specified by a bounding box
@@ -54,7 +137,8 @@ class BoxClipper(Clipper):
         Parameters
         ----------
         ref_array : ndarray
-            the full extent array identical in dimension to the data that will be clipped
+            the full extent array identical in dimension to the data that will be clipped,
+            may be None when nx, ny and nz are all given
         x : int, optional
             the starting x value (1 based index)
         y : int, optional
@@ -94,6 +178,12 @@ class BoxClipper(Clipper):
             raise Exception("Error: invalid dimension, x,y,z nx, ny, nz must be >=1")
         self.update_bbox(x, y, z, nx, ny, nz, padding)
 
+    def __getstate__(self):
+        """drop the full extent ref_array when pickling, pickled clippers must be passed the data to subset"""
+        state = self.__dict__.copy()
+        state['ref_array'] = None
+        return state
+
     def update_bbox(self, x=None, y=None, z=None, nx=None, ny=None, nz=None, padding=(0, 0, 0, 0)):
         """update the x,y,z, nx, ny, nz and padding values
 
@@ -136,13 +226,25 @@ class BoxClipper(Clipper):
             self.y_end = self.y_0 + ny
         self.padding = padding
 
-    def subset(self, data_array=None):
+    def get_window(self):
+        """get the region of the full domain covered by the bounding box
+
+        Returns
+        -------
+        tuple
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive extents of the bounding box
+        """
+        return self.z_0, self.z_end, self.y_0, self.y_end, self.x_0, self.x_end
+
+    def subset(self, data_array=None, windowed=False):
         """ Clip the data_array to the region specified by the bounding box
 
         Parameters
         ----------
         data_array : ndarray, optional
             a 3d array of data to clip, if no array passed return clip of the initialization array
+        windowed : bool, optional
+            True if data_array was already read through the clipper's window (see `get_window`)
 
         Returns
         -------
@@ -152,17 +254,21 @@ class BoxClipper(Clipper):
         """
         if data_array is None:
             data_array = self.ref_array
+        if windowed:
+            data_slice = data_array[:self.nz, :self.ny, :self.nx]
+        else:
+            data_slice = data_array[self.z_0:self.z_end, self.y_0:self.y_end, self.x_0:self.x_end]
         if any(self.padding):
             # create a full dimensioned array of no_data_values
-            ret_array = np.full(shape=(self.nz,
+            ret_array = np.full(shape=(data_slice.shape[0],
                                 self.ny + self.padding[0] + self.padding[2],
-                                self.nx + self.padding[1] + self.padding[3]), fill_value=self.no_data, dtype=np.float64)
+                                self.nx + self.padding[1] + self.padding[3]), fill_value=self.no_data,
+                                dtype=file_io_tools.output_dtype(data_slice.dtype, self.no_data))
             # assign values from the data_array into the return array, mind the padding
-            ret_array[self.z_0:self.z_end, self.padding[2]:self.ny + self.padding[2],
-            self.padding[3]:self.nx + self.padding[3]] = data_array[self.z_0:self.z_end, self.y_0:self.y_end,
-                                                                    self.x_0:self.x_end]
+            ret_array[:, self.padding[2]:self.ny + self.padding[2], self.padding[3]:self.nx + self.padding[3]] = \
+                data_slice
         else:
-            ret_array = data_array[self.z_0:self.z_end, self.y_0:self.y_end, self.x_0:self.x_end]
+            ret_array = data_slice
         return ret_array, None, None, None
 
 
@@ -193,12 +299,64 @@ class MaskClipper(Clipper):
         min_y, max_y, min_x, max_x = self.subset_mask.bbox_edges
         self.bbox = [min_y, max_y + 1, min_x, max_x + 1]
         self.clipped_geom = self.subset_mask.calculate_new_geom(min_x, min_y,
-                                                                self.subset_mask.mask_tif.GetGeoTransform())
-        self.clipped_mask = (self.subset_mask.bbox_mask.filled(fill_value=no_data_threshold) == 1)[:,
-                            self.bbox[0]:self.bbox[1],
-                            self.bbox[2]:self.bbox[3]]
+                                                                self.subset_mask.geo_transform)
+        bbox_mask = self.subset_mask.crop_bbox_mask((min_y, max_y, min_x, max_x))
+        self.clipped_mask = bbox_mask.filled(fill_value=no_data_threshold) == 1
+        # cells inside the bounding box which are not no_data in the mask
+        self.bbox_valid = ~ma.getmaskarray(bbox_mask)
+        # flat (y,x) indices of the cells each subset copies, the same for every layer of every input
+        self.inner_indices = np.flatnonzero(self.clipped_mask)
+        self.bbox_indices = np.flatnonzero(self.bbox_valid)
+        self.human_bbox = self.subset_mask.get_human_bbox()
+
+    @classmethod
+    def from_arrays(cls, subset_mask, clipped_geom, clipped_mask, bbox_valid):
+        """Create a MaskClipper from its precomputed geometry and bbox arrays, without cropping the mask again
+
+        Parameters
+        ----------
+        subset_mask : SubsetMask
+            instantiated mask object
+        clipped_geom : tuple
+            gdal geotransform of the bbox
+        clipped_mask : ndarray
+            (1, bbox ny, bbox nx) boolean array, True in the mask
+        bbox_valid : ndarray
+            (1, bbox ny, bbox nx) boolean array, True where the mask is not no_data
 
-    def subset(self, data_array, no_data=NO_DATA, crop_inner=1):
+        Returns
+        -------
+        MaskClipper
+        """
+        clipper = cls.__new__(cls)
+        clipper.subset_mask = subset_mask
+        min_y, max_y, min_x, max_x = subset_mask.bbox_edges
+        clipper.bbox = [min_y, max_y + 1, min_x, max_x + 1]
+        clipper.clipped_geom = tuple(clipped_geom)
+        clipper.clipped_mask = clipped_mask
+        clipper.bbox_valid = bbox_valid
+        clipper.inner_indices = np.flatnonzero(clipped_mask)
+        clipper.bbox_indices = np.flatnonzero(bbox_valid)
+        clipper.human_bbox = subset_mask.get_human_bbox()
+        return clipper
+
+    def __getstate__(self):
+        """drop the subset_mask (and its gdal dataset) when pickling, everything subset needs is precomputed"""
+        state = self.__dict__.copy()
+        state['subset_mask'] = None
+        return state
+
+    def get_window(self):
+        """get the region of the full domain covered by the mask bounding box
+
+        Returns
+        -------
+        tuple
+            (None, None, y_0, y_end, x_0, x_end) 0-based, end-exclusive extents of the bounding box, all z layers
+        """
+        return None, None, self.bbox[0], self.bbox[1], self.bbox[2], self.bbox[3]
+
+    def subset(self, data_array, no_data=NO_DATA, crop_inner=1, windowed=False, out=None):
         """subset the data from data_array in the shape and extents of the clipper's clipped subset_mask
 
         Parameters
@@ -209,6 +367,11 @@ class MaskClipper(Clipper):
             no data value for outputs (Default = NO_DATA)
         crop_inner : int
             crop the data to the bbox(0) or the mask(1) (default = 1)
+        windowed : bool, optional
+            True if data_array was already read through the clipper's window (see `get_window`)
+        out : numpy.ndarray, optional
+            array to write the subset into, such as the result of the previous subset once it has been written,
+            a new array is allocated if it is None or is not a contiguous array of the subset shape and dtype
 
         Returns
         -------
@@ -222,34 +385,98 @@ class MaskClipper(Clipper):
             x, y, nx, ny values indicating region clipped
 
         """
-        full_mask = self.subset_mask.bbox_mask.mask
-        clip_mask = ~self.clipped_mask
-        # Handle multi-layered files, such as subsurface or forcings
-        if data_array.shape[0] > 1:
-            full_mask = np.broadcast_to(full_mask, data_array.shape)
-            clip_mask = np.broadcast_to(clip_mask, (data_array.shape[0], clip_mask.shape[1], clip_mask.shape[2]))
-            logging.info(f'clipper: broadcast subset_mask to match input data z layers: {data_array.shape[0]}')
-        # full_dim_mask the input data using numpy masked array module (True=InvalidData, False=ValidData)
-        masked_data = ma.masked_array(data=data_array, mask=full_mask)
-
+        if not windowed:
+            data_array = data_array[:, self.bbox[0]: self.bbox[1], self.bbox[2]: self.bbox[3]]
         if crop_inner:
-            # return an array that includes all of the z data, and x and y no_data outside of the full_dim_mask area
-            return_arr = ma.masked_array(masked_data[:,
-                                         self.bbox[0]: self.bbox[1],
-                                         self.bbox[2]: self.bbox[3]].filled(fill_value=no_data),
-                                         mask=clip_mask).filled(fill_value=no_data)
-            # logging.info(f'clipped data with (z,y,x) shape {data_array.shape} to {return_arr.shape} '
-            #              f'using bbox (top, bot, left, right) {self.printable_bbox}')
+            # keep all of the z data, and x and y no_data outside of the full_dim_mask area
+            keep = self.inner_indices
         else:
-            # return an array that includes all of the z data, and x and y inside the bounding box
-            return_arr = ma.masked_array(masked_data[:,
-                                         self.bbox[0]: self.bbox[1],
-                                         self.bbox[2]: self.bbox[3]],
-                                         mask=np.zeros(clip_mask.shape)).filled()
-            # logging.info(f'clipped data with (z,y,x) shape {data_array.shape} to {return_arr.shape} '
-            #              f'using bbox (top, bot, left, right) {self.printable_bbox}')
+            # keep all of the z data, and x and y inside the bounding box
+            keep = self.bbox_indices
+        dtype = file_io_tools.output_dtype(data_array.dtype, no_data)
+        if out is None or out.shape != data_array.shape or out.dtype != dtype or not out.flags.c_contiguous:
+            out = np.empty(data_array.shape, dtype=dtype)
+        out.fill(no_data)
+        # the (y,x) indices are shared by the layers of multi-layered files, such as subsurface or forcings,
+        # so the kept cells of every layer are gathered and scattered in one pass
+        nz = data_array.shape[0]
+        out.reshape(nz, -1)[:, keep] = np.take(data_array.reshape(nz, -1), keep, axis=1)
+        return out, self.clipped_geom, self.clipped_mask, self.human_bbox
+
+
+class MultiClipper(Clipper):
+    """Clip one input with many clippers from a single read of the region covering all of them"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(clippers:{self.clippers!r}"
 
-        return return_arr, self.clipped_geom, self.clipped_mask, self.subset_mask.get_human_bbox()
+    def __init__(self, clippers, no_data_threshold=NO_DATA):
+        """Combine clippers (or masks) so each input file is read once for all of them
+
+        Parameters
+        ----------
+        clippers : list
+            list of Clipper or SubsetMask objects, masks are wrapped in a MaskClipper
+        no_data_threshold : int
+            upper bound to which all values are no_data, used when wrapping SubsetMask objects
+
+        Returns
+        -------
+        MultiClipper
+        """
+        if len(clippers) < 1:
+            raise Exception('MultiClipper: at least one clipper or mask is required')
+        self.clippers = [clipper if isinstance(clipper, Clipper) else
+                         MaskClipper(subset_mask=clipper, no_data_threshold=no_data_threshold)
+                         for clipper in clippers]
+
+    def get_window(self):
+        """get the smallest region of the full domain covering the windows of all clippers
+
+        Returns
+        -------
+        tuple
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive extents, None for the full extent of an axis
+        """
+        windows = [clipper.get_window() for clipper in self.clippers]
+        union = []
+        for i in range(6):
+            values = [window[i] for window in windows]
+            if any(value is None for value in values):
+                union.append(None)
+            else:
+                union.append(min(values) if i % 2 == 0 else max(values))
+        return tuple(union)
+
+    def subset(self, data_array, windowed=False, **kwargs):
+        """clip data_array with every clipper
+
+        Parameters
+        ----------
+        data_array : ndarray
+            3d array of data to clip
+        windowed : bool, optional
+            True if data_array was already read through the combined window (see `get_window`)
+        kwargs
+            additional keyword arguments for each clipper's `subset`
+
+        Returns
+        -------
+        list
+            the `subset` results of each clipper, in the order the clippers were given
+        """
+        union = self.get_window() if windowed else (None,) * 6
+        results = []
+        for clipper in self.clippers:
+            window = clipper.get_window()
+            local_slices = []
+            for axis in range(3):
+                offset = union[2 * axis] or 0
+                start = (window[2 * axis] or 0) - offset
+                end = data_array.shape[axis] if window[2 * axis + 1] is None else window[2 * axis + 1] - offset
+                local_slices.append(slice(start, end))
+            results.append(clipper.subset(data_array[tuple(local_slices)], windowed=True, **kwargs))
+        return results
 
 
 class ClmClipper:
@@ -267,37 +494,42 @@ class ClmClipper:
         self.clipper = BoxClipper(ref_array=None, x=self.bbox[0], y=self.bbox[1], nx=self.bbox[2], ny=self.bbox[3],
                                   nz=1)
 
-    def clip_latlon(self, lat_lon_file):
+    def clip_latlon(self, lat_lon_file, reader=None):
         """Clip the domain lat/lon data to the bounding box of the mask
 
         Parameters
         ----------
         lat_lon_file : str
             lat/lon data for the domain
+        reader : callable, optional
+            reader(infile, window) for the file, None to read it directly (Default value = None)
 
         Returns
         -------
-        sa_formatted : numpy.ndarray
-            the clipped data formatted in a 1d output arrray for writing to a .sa file
-        clipped_data : numpy.ndarray
-            the raw clipped data (3d) read from 'lat_lon_file'
+        lat : numpy.ndarray
+            the clipped latitudes (3d float array)
+        lon : numpy.ndarray
+            the clipped longitudes (3d float array)
 
         """
-        data = file_io_tools.read_file(lat_lon_file)
-        clipped_data, _, clipped_mask, bbox = self.clipper.subset(data_array=data)
-        #sa_formatted = np.flip(clipped_data, axis=1).flatten()
-        sa_formatted = clipped_data.flatten()
-        return sa_formatted, clipped_data
+        clipped_data, _, clipped_mask, bbox = self.clipper.subset_file(lat_lon_file, reader=reader)
+        # the "lat lon" pairs are parsed once here, everything after works with the numbers
+        lat, lon = split_latlon(clipped_data)
+        return lat.reshape(clipped_data.shape), lon.reshape(clipped_data.shape)
 
-    def clip_land_cover(self, lat_lon_array, land_cover_file):
+    def clip_land_cover(self, lat, lon, land_cover_file, reader=None):
         """Clip the domain land cover data to the bounding box of the mask
 
         Parameters
         ----------
-        lat_lon_array : numpy.ndarray
-            clipped lat/lon tuple data for the masked area
+        lat : numpy.ndarray
+            clipped latitudes for the masked area, as returned by `clip_latlon`
+        lon : numpy.ndarray
+            clipped longitudes for the masked area, as returned by `clip_latlon`
         land_cover_file : str
             land cover file for the domain
+        reader : callable, optional
+            reader(infile, window) for the file, None to read it directly (Default value = None)
 
         Returns
         -------
@@ -306,9 +538,7 @@ class ClmClipper:
         output : numpy.ndarray
             vegm formatted representation of the data (2d)
         """
-        lat_lon_proper = np.char.split(lat_lon_array.astype(str), ' ')
-        data = file_io_tools.read_file(land_cover_file)
-        clipped_data, _, clipped_mask, bbox = self.clipper.subset(data_array=data)
+        clipped_data, _, clipped_mask, bbox = self.clipper.subset_file(land_cover_file, reader=reader)
         #sa_formatted = np.flip(clipped_data, axis=1).flatten()
         sa_formatted = clipped_data.flatten()
         sand = 0.16
@@ -316,22 +546,22 @@ class ClmClipper:
         color = 2
         # get value of land cover for each coordinate
         npoints = sa_formatted.shape[0]
+        _, ny, nx = clipped_data.shape
         # make output matrix
         output = np.zeros((npoints, 25))
         output[:, 4] = sand
         output[:, 5] = clay
         output[:, 6] = color
         # assign x values, looping from 1 to x extent, holding y constant
-        output[:, 0] = list(range(1, clipped_data.shape[2] + 1)) * clipped_data.shape[1]
+        output[:, 0] = np.tile(np.arange(1, nx + 1), ny)
         # assign y values, repeating each y value from 1 to y extent for every x
-        output[:, 1] = np.repeat(range(1, clipped_data.shape[1] + 1), clipped_data.shape[2])
+        output[:, 1] = np.repeat(np.arange(1, ny + 1), nx)
         # assign lat values
-        output[:, 2] = [latlon[0] for latlon in lat_lon_proper]
+        output[:, 2] = np.ravel(lat)
         # assign lon values
-        output[:, 3] = [latlon[1] for latlon in lat_lon_proper]
-        cols = [int(i) + 6 for i in sa_formatted]
-        rows = list(range(npoints))
-        output[rows, cols] = 1
+        output[:, 3] = np.ravel(lon)
+        # one hot fractional coverage of the land cover class of each point, in columns 7 to 24
+        output[np.arange(npoints), sa_formatted.astype(np.int64) + 6] = 1
         return sa_formatted, output
 
     def write_land_cover(self, land_cover_data, out_file):
@@ -357,13 +587,17 @@ class ClmClipper:
         file_io_tools.write_array_to_text_file(out_file=out_file, data=land_cover_data, header=header,
                                                fmt=['%d'] * 2 + ['%.6f'] * 2 + ['%.2f'] * 2 + ['%d'] * 19)
 
-    def write_lat_lon(self, lat_lon_data, out_file, x=0, y=0, z=0):
-        """Write the lat/lon data to a ParFlow simple ascii formatted file
+    def write_lat_lon(self, lat, lon, out_file, x=0, y=0, z=0):
+        """Write the lat/lon data to a ParFlow simple ascii formatted file, one "lat lon" pair per line
+
+        The two columns are written with LATLON_FMT, which gives the six decimal places of the CONUS lat/lon files.
 
         Parameters
         ----------
-        lat_lon_data : ndarray
-            lat/lon data in formatted 1d array
+        lat : ndarray
+            clipped latitudes, as returned by `clip_latlon`
+        lon : ndarray
+            clipped longitudes, as returned by `clip_latlon`
         out_file : str
             path and name for output file
         x : int
@@ -378,4 +612,38 @@ class ClmClipper:
         None
 
         """
-        file_io_tools.write_array_to_text_file(out_file=out_file, data=lat_lon_data, fmt='%s', header=f'{x} {y} {z}')
\ No newline at end of file
+        file_io_tools.write_array_to_text_file(out_file=out_file, data=np.column_stack((np.ravel(lat), np.ravel(lon))),
+                                               fmt=LATLON_FMT, header=f'{x} {y} {z}')
+
+
+def split_latlon(lat_lon_array):
+    """parse "lat lon" strings, such as the values of a CLM lat/lon .sa file, into numeric lat and lon arrays
+
+    Parameters
+    ----------
+    lat_lon_array : numpy.ndarray
+        array of "lat lon" strings, or a numeric array with lat and lon as the last axis
+
+    Returns
+    -------
+    lat : numpy.ndarray
+        1d float array of the latitudes
+    lon : numpy.ndarray
+        1d float array of the longitudes
+
+    Raises
+    ------
+    Exception
+        if the values are not all pairs of numbers
+    """
+    lat_lon_array = np.asarray(lat_lon_array)
+    if np.issubdtype(lat_lon_array.dtype, np.number):
+        pairs = lat_lon_array.reshape(-1, 2).astype(np.float64)
+    else:
+        # one join and parse for all of the values, rather than a split per value
+        values = lat_lon_array.ravel().tolist()
+        pairs = np.fromstring(' '.join(values), dtype=np.float64, sep=' ')
+        if pairs.shape[0] != 2 * len(values):
+            raise Exception(f'could not parse {len(values)} lat/lon pairs, got {pairs.shape[0]} values')
+        pairs = pairs.reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
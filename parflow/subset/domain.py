@@ -6,6 +6,9 @@ import yaml
 import errno
 import parflow.subset.data as data
 import parflow.subset.utils.io as file_io_tools
+from parflow.subset.utils.tiles import TileReader, write_tile_store, DEFAULT_TILE_SIZE
+
+TILE_DIR = 'tiles'
 
 
 class ParflowDomain:
@@ -37,6 +40,8 @@ class ParflowDomain:
             self._read_manifest(self.required_files, self.optional_files)
         self.check_inputs_exist()
         self.check_destination()
+        self.tile_path = os.path.join(self.local_path, TILE_DIR)
+        self.tile_reader = TileReader(self.tile_path)
         self.mask_tif = None
         self.mask_array = None
 
@@ -53,7 +58,49 @@ class ParflowDomain:
         """
         tif_filename = os.path.join(self.local_path, self.required_files.get(domain_mask_key))
         self.mask_tif = file_io_tools.read_geotiff(tif_filename)
-        self.mask_array = file_io_tools.read_file(tif_filename)
+        self.mask_array = self.tile_reader(tif_filename)
+
+    def read_file(self, file_name, window=None):
+        """read a domain input, from its tile store when one has been written by `write_tiles`
+
+        Parameters
+        ----------
+        file_name : str
+            file name of the input, relative to local_path
+        window : tuple, optional
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read (Default value = None)
+
+        Returns
+        -------
+        ndarray
+            a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+        """
+        return self.tile_reader(os.path.join(self.local_path, file_name), window=window)
+
+    def write_tiles(self, tile_size=DEFAULT_TILE_SIZE, compress=False):
+        """convert each domain input present in local_path to a tile store under tile_path
+
+        Parameters
+        ----------
+        tile_size : int, optional
+            x and y size of the tiles (Default value = DEFAULT_TILE_SIZE)
+        compress : bool, optional
+            write compressed tiles (Default value = False)
+
+        Returns
+        -------
+        converted : list
+            names of the inputs converted
+        """
+        converted = []
+        for name, file_name in {**self.required_files, **self.optional_files}.items():
+            file_path = os.path.join(self.local_path, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            write_tile_store(file_path, self.tile_reader.store_path(file_path), tile_size=tile_size,
+                             compress=compress)
+            converted.append(name)
+        return converted
 
     def get_domain_mask(self, domain_mask_key='DOMAIN_MASK'):
         """get the domain full_dim_mask array
@@ -10,15 +10,18 @@ from parflow.subset.bbox import BBox
 
 class SubsetMask:
     """A full-sized mask with a bounding box and irregular bordered mask inside
+
+    Only the bounding box area is held, as bit-packed planes of its valid (>= bbox_val) and inner (> bbox_val)
+    cells plus the values of the inner cells, so a mask costs kilobytes however large the domain is. The
+    full-domain arrays (`mask_array`, `inner_mask`, `bbox_mask`) are built from it when they are asked for.
     """
 
     def __repr__(self):
-        return f"{self.__class__.__name__}(mask_tif:{self.mask_tif!r}, mask_array:{self.mask_array!r}, " \
-               f"bbox_val:{self.bbox_val!r}, inner_mask:{self.inner_mask!r}, bbox_mask:{self.bbox_mask!r}, " \
-               f"no_data_value:{self.no_data_value!r}, inner_mask_edges:{self.inner_mask_edges!r}, " \
-               f"bbox_edges:{self.bbox_edges!r}"
+        return f"{self.__class__.__name__}(mask_tif:{self.mask_tif!r}, mask_shape:{self.mask_shape!r}, " \
+               f"offset:{self.offset!r}, bbox_val:{self.bbox_val!r}, no_data_value:{self.no_data_value!r}, " \
+               f"inner_mask_edges:{self.inner_mask_edges!r}, bbox_edges:{self.bbox_edges!r}, nbytes:{self.nbytes!r})"
 
-    def __init__(self, tif_file, bbox_val=0):
+    def __init__(self, tif_file, bbox_val=0, reference_dataset=None):
         """Create a new instance of SubsetMask
 
         Parameters
@@ -27,18 +30,261 @@ class SubsetMask:
             path to tiff file containing mask
         bbox_val : int, optional
             integer value specifying the data value for bounding box cells
+        reference_dataset : gdal.dataset, optional
+            the domain the mask belongs to, when tif_file only covers a window of it. The window's position
+            is found from the geotransforms and every cell outside of it is no_data (Default value = None)
         Returns
         -------
         SubsetMask
         """
         self.mask_tif = read_geotiff(tif_file)
-        self.mask_array = read_file(tif_file)
+        self.projection = self.mask_tif.GetProjection()
         self.bbox_val = bbox_val
-        self.inner_mask = self._find_inner_object()  # tight crop
-        self.bbox_mask = self._find_bbox()  # bbox crop
         self.no_data_value = self.mask_tif.GetRasterBand(1).GetNoDataValue()
-        self.inner_mask_edges = self.find_mask_edges(self.inner_mask)  # edges
-        self.bbox_edges = self.find_mask_edges(self.bbox_mask)  # edges
+        window_array = read_file(tif_file)
+        if reference_dataset is None:
+            self.geo_transform = self.mask_tif.GetGeoTransform()
+            shape = window_array.shape
+            self.offset = (0, 0)
+        else:
+            self.geo_transform = reference_dataset.GetGeoTransform()
+            shape = (1, reference_dataset.RasterYSize, reference_dataset.RasterXSize)
+            window_geom = self.mask_tif.GetGeoTransform()
+            row_offset = int(round((window_geom[3] - self.geo_transform[3]) / self.geo_transform[5]))
+            col_offset = int(round((window_geom[0] - self.geo_transform[0]) / self.geo_transform[1]))
+            # (y, x) offset in PFB orientation, the window's bottom row is counted from the bottom of the domain
+            self.offset = (shape[1] - window_array.shape[1] - row_offset, col_offset)
+        self._set_window(window_array, self.offset, shape)
+        self.inner_mask_edges = self._inner_edges()  # edges
+
+    @classmethod
+    def from_window(cls, window_array, window_edges, shape, geo_transform, projection, no_data_value=None,
+                    outer_value=None, bbox_val=0, bbox_edges=None, inner_mask_edges=None):
+        """Create a SubsetMask from the values of a window of the domain, without a tif file
+
+        Parameters
+        ----------
+        window_array : ndarray
+            (1, ny, nx) mask values of the window, every cell >= bbox_val must be inside it
+        window_edges : tuple
+            (min_y, max_y, min_x, max_x) inclusive position of the window in the domain
+        shape : tuple
+            (1, ny, nx) shape of the full domain
+        geo_transform : tuple
+            gdal geotransform of the full domain
+        projection : str
+            projection of the full domain
+        no_data_value : float, optional
+            no_data value of the mask (Default value = None)
+        outer_value : scalar or ndarray, optional
+            value of the cells < bbox_val (Default value = None, no_data_value)
+        bbox_val : int, optional
+            integer value specifying the data value for bounding box cells (Default value = 0)
+        bbox_edges : tuple, optional
+            inclusive edges of the cells >= bbox_val in the domain, when known they are not searched for
+            (Default value = None)
+        inner_mask_edges : tuple, optional
+            inclusive edges of the cells > bbox_val in the domain, when known they are not searched for
+            (Default value = None)
+
+        Returns
+        -------
+        SubsetMask
+        """
+        subset_mask = cls.__new__(cls)
+        subset_mask.mask_tif = None
+        subset_mask.projection = projection
+        subset_mask.bbox_val = bbox_val
+        subset_mask.no_data_value = no_data_value
+        subset_mask.geo_transform = tuple(geo_transform)
+        subset_mask.offset = (window_edges[0], window_edges[2])
+        subset_mask._encode(window_array, window_edges, no_data_value if outer_value is None else outer_value,
+                            shape, bbox_edges=bbox_edges)
+        if inner_mask_edges is None:
+            inner_mask_edges = subset_mask._inner_edges()
+        subset_mask.inner_mask_edges = tuple(inner_mask_edges)
+        return subset_mask
+
+    @property
+    def mask_array(self):
+        """the full-domain mask, no_data outside the bbox, bbox_val in the bbox and the mask values inside the mask
+
+        The first access after the mask changes builds a read-only (1, ny, nx) array of the whole domain, which is
+        kept until the mask changes again. Use `crop_bbox_mask` to get a window of the mask without it.
+        """
+        if self._dense.get('mask_array') is None:
+            mask_array = self._full_values()
+            mask_array.setflags(write=False)
+            self._dense['mask_array'] = mask_array
+        return self._dense['mask_array']
+
+    def _full_values(self):
+        """the full-domain mask values, from `mask_array` when it is kept, otherwise built without keeping them"""
+        if self._dense.get('mask_array') is not None:
+            return self._dense['mask_array']
+        return self._window_values(0, self.mask_shape[1] - 1, 0, self.mask_shape[2] - 1)
+
+    @mask_array.setter
+    def mask_array(self, mask_array):
+        """store a full-domain mask array in the compact form"""
+        self._set_window(mask_array, (0, 0), mask_array.shape)
+
+    def _set_window(self, window_array, offset, shape):
+        """store the mask from the values of a window of the domain, the cells outside of the window are no_data
+
+        Parameters
+        ----------
+        window_array : ndarray
+            (1, ny, nx) mask values of the window
+        offset : tuple
+            (y, x) position of the window in the domain
+        shape : tuple
+            (1, ny, nx) shape of the full domain
+
+        Returns
+        -------
+        None
+        """
+        valid = ~(window_array < self.bbox_val)
+        if window_array.shape == tuple(shape) and not valid.all():
+            outer_value = window_array.flat[np.argmin(valid)]
+        else:
+            outer_value = self.no_data_value
+        y_0, x_0 = offset
+        if not np.all((window_array == outer_value) | valid):
+            # cells outside the bbox hold more than one value, only then is the whole array kept
+            logging.info(f'SubsetMask keeping full mask array, no data cells are not a single value')
+            full_array = np.full(shape, outer_value if outer_value is not None else 0, dtype=window_array.dtype)
+            full_array[:, y_0:y_0 + window_array.shape[1], x_0:x_0 + window_array.shape[2]] = window_array
+            outer_value = full_array
+        self._encode(window_array, (y_0, y_0 + window_array.shape[1] - 1, x_0, x_0 + window_array.shape[2] - 1),
+                     outer_value, shape)
+
+    def _encode(self, window_array, window_edges, outer_value, shape, bbox_edges=None):
+        """store the values of a window of the mask compactly
+
+        Parameters
+        ----------
+        window_array : ndarray
+            3d mask values of the window, every cell >= bbox_val must be inside it
+        window_edges : tuple
+            (min_y, max_y, min_x, max_x) inclusive position of the window in the domain
+        outer_value : scalar or ndarray
+            value of the cells < bbox_val, or the full-domain array of them if they are not a single value, None
+            (a mask without a no_data value) is stored as 0, as `_set_window` fills them
+        shape : tuple
+            (1, ny, nx) shape of the full domain
+        bbox_edges : tuple, optional
+            inclusive edges of the cells >= bbox_val in the domain, searched for when not given
+            (Default value = None)
+
+        Returns
+        -------
+        None
+        """
+        self.shape = tuple(shape)
+        self.dtype = window_array.dtype
+        self._outer_value = outer_value if outer_value is not None else 0
+        # full-domain arrays built from the compact form, dropped when it changes
+        self._dense = {}
+        valid = ~(window_array < self.bbox_val)
+        window_y, window_x = window_edges[0], window_edges[2]
+        # the bbox is the extent of the valid cells, only it is stored
+        if bbox_edges is None:
+            min_y, max_y, min_x, max_x = _find_edges(valid)
+        else:
+            min_y, max_y = bbox_edges[0] - window_y, bbox_edges[1] - window_y
+            min_x, max_x = bbox_edges[2] - window_x, bbox_edges[3] - window_x
+        window_array = window_array[:, min_y:max_y + 1, min_x:max_x + 1]
+        valid = valid[:, min_y:max_y + 1, min_x:max_x + 1]
+        self.bbox_edges = (min_y + window_y, max_y + window_y, min_x + window_x, max_x + window_x)
+        inner = ~(window_array <= self.bbox_val)
+        self._valid_bits = np.packbits(valid)
+        self._inner_bits = np.packbits(inner)
+        inner_values = window_array[inner]
+        if inner_values.size and np.all(inner_values == inner_values[0]):
+            self._inner_values = inner_values[0]
+        else:
+            self._inner_values = inner_values
+        logging.info(f'SubsetMask located outer bbox in full_dim_mask array')
+
+    def _unpack(self, bits):
+        """unpack a bit-packed plane of the stored bbox to a (1, bbox ny, bbox nx) bool array"""
+        ny, nx = self.bbox_shape
+        return np.unpackbits(bits, count=ny * nx).reshape(1, ny, nx).astype(bool)
+
+    def _inner_edges(self):
+        """locate the edges of the inner, irregular shaped object
+
+        Returns
+        -------
+        tuple
+            (min_y, max_y, min_x, max_x) inclusive edges of the inner cells in the domain
+        """
+        min_y, max_y, min_x, max_x = _find_edges(self._unpack(self._inner_bits))
+        logging.info(f'SubsetMask located inner full_dim_mask in full_dim_mask array')
+        return (min_y + self.bbox_edges[0], max_y + self.bbox_edges[0], min_x + self.bbox_edges[2],
+                max_x + self.bbox_edges[2])
+
+    def _window_values(self, min_y, max_y, min_x, max_x):
+        """build the dense mask values of a window of the domain
+
+        Parameters
+        ----------
+        min_y, max_y, min_x, max_x : int
+            inclusive edges of the window
+
+        Returns
+        -------
+        ndarray
+            (1, ny, nx) mask values of the window
+        """
+        if np.ndim(self._outer_value):
+            values = self._outer_value[:, min_y:max_y + 1, min_x:max_x + 1].copy()
+        else:
+            values = np.full((1, max_y - min_y + 1, max_x - min_x + 1), self._outer_value, dtype=self.dtype)
+        # overlap of the window and the stored bbox, in domain coordinates
+        b_min_y, b_max_y, b_min_x, b_max_x = self.bbox_edges
+        y_0, y_end = max(min_y, b_min_y), min(max_y, b_max_y) + 1
+        x_0, x_end = max(min_x, b_min_x), min(max_x, b_max_x) + 1
+        if y_0 >= y_end or x_0 >= x_end:
+            return values
+        if np.ndim(self._outer_value):
+            bbox_values = self._outer_value[:, b_min_y:b_max_y + 1, b_min_x:b_max_x + 1].copy()
+        else:
+            bbox_values = np.full((1,) + self.bbox_shape, self._outer_value, dtype=self.dtype)
+        bbox_values[self._unpack(self._valid_bits)] = self.bbox_val
+        bbox_values[self._unpack(self._inner_bits)] = self._inner_values
+        values[:, y_0 - min_y:y_end - min_y, x_0 - min_x:x_end - min_x] = \
+            bbox_values[:, y_0 - b_min_y:y_end - b_min_y, x_0 - b_min_x:x_end - b_min_x]
+        return values
+
+    @property
+    def nbytes(self):
+        """bytes held by the compact mask"""
+        return self._valid_bits.nbytes + self._inner_bits.nbytes + np.asarray(self._inner_values).nbytes + \
+            np.asarray(self._outer_value).nbytes
+
+    @property
+    def bbox_mask(self):
+        """masked full-domain array, with the cells outside of the bbox masked
+
+        Shares the data of `mask_array` and adds a full-domain bool mask, both kept until the mask changes. Use
+        `crop_bbox_mask` to get a window of it without building the full domain.
+        """
+        if self._dense.get('bbox_mask') is None:
+            self._dense['bbox_mask'] = self._find_bbox()
+        return self._dense['bbox_mask']
+
+    @property
+    def inner_mask(self):
+        """masked full-domain array, with the cells outside of the irregular mask masked
+
+        Shares the data of `mask_array` and adds a full-domain bool mask, both kept until the mask changes.
+        """
+        if self._dense.get('inner_mask') is None:
+            self._dense['inner_mask'] = self._find_inner_object()
+        return self._dense['inner_mask']
 
     def _find_bbox(self):
         """locate the outer bbox area and return the masked array
@@ -49,8 +295,8 @@ class SubsetMask:
             masked numpy array with full_dim_mask edges at outer area
 
         """
-        mx = ma.masked_where(self.mask_array < self.bbox_val, self.mask_array)
-        logging.info(f'SubsetMask located outer bbox in full_dim_mask array')
+        mask_array = self.mask_array
+        mx = ma.masked_where(mask_array < self.bbox_val, mask_array, copy=False)
         return mx
 
     def _find_inner_object(self):
@@ -62,10 +308,28 @@ class SubsetMask:
             masked numpy array with tight full_dim_mask along shape border
 
         """
-        mx = ma.masked_where(self.mask_array <= self.bbox_val, self.mask_array)
-        logging.info(f'SubsetMask located inner full_dim_mask in full_dim_mask array')
+        mask_array = self.mask_array
+        mx = ma.masked_where(mask_array <= self.bbox_val, mask_array, copy=False)
         return mx
 
+    def crop_bbox_mask(self, edges=None):
+        """get a window of `bbox_mask` without building the full-domain array
+
+        Parameters
+        ----------
+        edges : tuple, optional
+            (min_y, max_y, min_x, max_x) inclusive edges of the window (Default value = None, the bbox edges)
+
+        Returns
+        -------
+        mx : numpy.ma.MaskedArray
+            the same values as bbox_mask[:, min_y:max_y + 1, min_x:max_x + 1]
+        """
+        if edges is None:
+            edges = self.bbox_edges
+        values = self._window_values(*edges)
+        return ma.masked_where(values < self.bbox_val, values)
+
     @property
     def bbox_shape(self):
         """ """
@@ -80,7 +344,7 @@ class SubsetMask:
     @property
     def mask_shape(self):
         """ """
-        return self.mask_array.shape
+        return self.shape
 
     def add_bbox_to_mask(self, padding=(0, 0, 0, 0)):
         """add the inner bounding box of 0's to the reprojected full_dim_mask. This will expand the bounding box of the
@@ -95,8 +359,9 @@ class SubsetMask:
 
         Returns
         -------
-        new_mask : ndarray
-            3d array with no data outside the bbox, 0 inside bbox, and 1 in full_dim_mask area, bounding box values
+        new_mask : numpy.ma.MaskedArray
+            the new bbox window of the mask, 0 in the bbox and 1 in the full_dim_mask area, as `crop_bbox_mask`
+            gives it, the full-domain array is not built
 
         new_edges : list
             the bounds of the new bbox, including padding
@@ -104,23 +369,21 @@ class SubsetMask:
 
         min_y, max_y, min_x, max_x = self.inner_mask_edges
 
-        new_mask = self.inner_mask.filled(fill_value=self.no_data_value)
-
-        new_edges = [max(min_y - padding[2], 0), min(max_y + padding[0] + 1, self.mask_array.shape[1]),
-                     max(min_x - padding[3], 0), min(max_x + padding[1] + 1, self.mask_array.shape[2])]
+        new_edges = [max(min_y - padding[2], 0), min(max_y + padding[0] + 1, self.mask_shape[1]),
+                     max(min_x - padding[3], 0), min(max_x + padding[1] + 1, self.mask_shape[2])]
         bottom_edge, top_edge, left_edge, right_edge = new_edges
-        new_mask[:, bottom_edge: top_edge, left_edge: right_edge] = \
-            self.inner_mask[:, bottom_edge: top_edge, left_edge: right_edge].filled(fill_value=0.0)
+        # only the new bbox is built, every cell outside of it becomes no_data
+        window = self._window_values(bottom_edge, top_edge - 1, left_edge, right_edge - 1)
+        window = np.where(window <= self.bbox_val, 0, window).astype(self.dtype)
+        outer_value = self.no_data_value if self.no_data_value is not None else ma.default_fill_value(window)
+        self._encode(window, (bottom_edge, top_edge - 1, left_edge, right_edge - 1), outer_value, self.shape)
         # Check if shape bbox aligns with any of our reference dataset edges
         # if 0 in new_edges or new_mask.shape[1] - 1 == [bottom_edge] or new_mask.shape[2] - 1 == right_edge:
         #     logging.warning(f'edge of bounding box aligns with edge of reference dataset! Check extents!')
         # # logging.info(f'added bbox to mask: mask_va=1, bbox_val=0, no_data_val={self.no_data_value}, '
         # #              f'slice_data(top,bot,left,right)='
         # #              f'{",".join([str(i) for i in get_human_bbox(new_edges, new_mask.shape)])}')
-        self.mask_array = new_mask
-        self.bbox_mask = self._find_bbox()
-        self.bbox_edges = self.find_mask_edges(self.bbox_mask)
-        return new_mask, new_edges
+        return self.crop_bbox_mask(), new_edges
 
     def find_mask_edges(self, full_dim_mask, mask_val=1):
         """Identify the edges of the mask
@@ -143,15 +406,7 @@ class SubsetMask:
         max_x : int
             maximum x location of data value in mask
         """
-        _, yy, xx = np.where(~full_dim_mask.mask == mask_val)
-        min_x = min(xx)
-        min_y = min(yy)
-        max_x = max(xx)
-        max_y = max(yy)
-        # logging.info(
-        #     f'located full_dim_mask edges at (top,bot,left,right)='
-        #     f'{",".join([str(i) for i in self.get_human_bbox([min_y, max_y, min_x, max_x], full_dim_mask.shape)])}')
-        return min_y, max_y, min_x, max_x
+        return _find_edges(~ma.getmaskarray(full_dim_mask) == mask_val)
 
     def get_bbox(self):
         """get a BBox object describing the data location in the domain
@@ -214,8 +469,8 @@ class SubsetMask:
         -------
         None
         """
-        write_array_to_geotiff(filename, self.mask_array, self.mask_tif.GetGeoTransform(),
-                               self.mask_tif.GetProjection(), no_data=self.no_data_value)
+        write_array_to_geotiff(filename, self._full_values(), self.geo_transform,
+                               self.projection, no_data=self.no_data_value)
 
     def write_mask_to_pfb(self, filename):
         """write the mask to a pfb file on disk
@@ -230,7 +485,7 @@ class SubsetMask:
         None
         """
 
-        write_pfb(data=self.mask_array, outfile=filename)
+        write_pfb(data=self._full_values(), outfile=filename)
 
     def write_bbox(self, filename):
         """write the bbox to a txt file on disk
@@ -245,3 +500,12 @@ class SubsetMask:
         None
         """
         write_bbox(self.get_human_bbox(), filename)
+
+
+def _find_edges(cells):
+    """(min_y, max_y, min_x, max_x) inclusive edges of the True cells of a (z,y,x) boolean array"""
+    rows = np.flatnonzero(cells.any(axis=(0, 2)))
+    cols = np.flatnonzero(cells.any(axis=(0, 1)))
+    if len(rows) == 0:
+        raise ValueError('mask has no cells inside of it')
+    return rows[0], rows[-1], cols[0], cols[-1]
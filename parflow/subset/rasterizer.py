@@ -1,9 +1,13 @@
 """Classes for converting inputs to gridded masks"""
 import gdal
 import ogr
+import osr
 import os
+import math
 import logging
+import numpy as np
 from parflow.subset import TIF_NO_DATA_VALUE_OUT as NO_DATA
+from parflow.subset.utils.io import read_file
 from parflow.subset.mask import SubsetMask
 
 
@@ -41,12 +45,13 @@ class ShapefileRasterizer:
         self.full_shapefile_path = os.path.join(self.shapefile_path, '.'.join((self.shapefile_name, 'shp')))
         self.check_shapefile_parts()
         self.subset_mask = None
+        self.subset_masks = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}(shapefile_path:{self.shapefile_path!r}, " \
                f"shapefile_name:{self.shapefile_name!r}, output_path:{self.output_path!r}, ds_ref:{self.ds_ref!r}, " \
                f"no_data:{self.no_data!r}, full_shapefile_path:{self.full_shapefile_path!r}, " \
-               f"subset_mask:{self.subset_mask!r}"
+               f"subset_mask:{self.subset_mask!r}, subset_masks:{self.subset_masks!r}"
 
     def check_shapefile_parts(self):
         """verify the required parts of a shapefile are present in the same folder
@@ -77,42 +82,199 @@ class ShapefileRasterizer:
         Returns
         -------
         str
-            path (virtual mem) to the reprojected full_dim_mask
+            path (virtual mem) to the reprojected mask, covering only the window of the reference dataset
+            around the selected shapes
 
         """
         if attribute_ids is None:
             attribute_ids = [1]
         if no_data is None:
             no_data = self.no_data
-        geom_ref = self.ds_ref.GetGeoTransform()
+        # shapefile
+        shp_source = ogr.Open(self.full_shapefile_path)
+        shp_layer = shp_source.GetLayer()
+        # Filter by the shapefile attribute IDs we want
+        shp_layer.SetAttributeFilter(f'{attribute_name} in ({",".join([str(i) for i in attribute_ids])})')
         tif_path = f'/vsimem/{self.shapefile_name}.tif'
+        self._rasterize_window(tif_path, shp_layer, dtype, no_data, burn_values=[1])
+        self.subset_mask = SubsetMask(tif_path, reference_dataset=self.ds_ref)
+        return tif_path
+
+    def reproject_and_label(self, attribute_name='OBJECTID', attribute_ids=None, no_data=None):
+        """rasterize many shapes at once, burning each shape's attribute value into a single label raster,
+        then split it into one mask per attribute value
+
+        Each cell gets the value of a single shape, where shapes overlap or share a border the last one drawn wins.
+
+        Parameters
+        ----------
+        attribute_name : str
+            numeric field in the shapefile to burn and select on (Default value = 'OBJECTID')
+        attribute_ids : list
+            list of attribute ID values to select, None for every shape in the shapefile (Default value = None)
+        no_data : int
+            no_data value to use (Default value = None)
+
+        Returns
+        -------
+        dict
+            SubsetMask for each attribute ID found in the reference dataset, keyed by attribute ID
+
+        """
+        if no_data is None:
+            no_data = self.no_data
+        shp_source = ogr.Open(self.full_shapefile_path)
+        shp_layer = shp_source.GetLayer()
+        if attribute_ids is not None:
+            shp_layer.SetAttributeFilter(f'{attribute_name} in ({",".join([str(i) for i in attribute_ids])})')
+        label_path = f'/vsimem/{self.shapefile_name}_{attribute_name}.tif'
+        window_geom = self._rasterize_window(label_path, shp_layer, gdal.GDT_Float64, no_data,
+                                             options=[f'ATTRIBUTE={attribute_name}'])
+        labels = read_file(label_path)[0]
+        gdal.Unlink(label_path)
+        # position of the label window in the domain, its bottom row counted from the bottom of the domain
+        geom_ref = self.ds_ref.GetGeoTransform()
+        shape = (1, self.ds_ref.RasterYSize, self.ds_ref.RasterXSize)
+        row_0 = int(round((window_geom[3] - geom_ref[3]) / geom_ref[5]))
+        col_0 = int(round((window_geom[0] - geom_ref[0]) / geom_ref[1]))
+        window_y = shape[1] - labels.shape[0] - row_0
+        # one pass over the labeled cells finds the bbox of every label, cells are grouped by label then reduced
+        labeled_y, labeled_x = np.nonzero(labels != no_data)
+        values, label_index = np.unique(labels[labeled_y, labeled_x], return_inverse=True)
+        order = np.argsort(label_index, kind='stable')
+        starts = np.searchsorted(label_index[order], np.arange(values.size))
+        min_y = np.minimum.reduceat(labeled_y[order], starts)
+        max_y = np.maximum.reduceat(labeled_y[order], starts)
+        min_x = np.minimum.reduceat(labeled_x[order], starts)
+        max_x = np.maximum.reduceat(labeled_x[order], starts)
+        if attribute_ids is None:
+            keys = {value: int(value) if float(value).is_integer() else value for value in values}
+        else:
+            keys = {float(attribute_id): attribute_id for attribute_id in attribute_ids}
+        self.subset_masks = {}
+        for i, value in enumerate(values):
+            key = keys.get(value, value)
+            label_mask = labels[np.newaxis, min_y[i]:max_y[i] + 1, min_x[i]:max_x[i] + 1] == value
+            # the label's bbox is the window, no cells of it need to be searched for
+            edges = (int(min_y[i]) + window_y, int(max_y[i]) + window_y, int(min_x[i]) + col_0,
+                     int(max_x[i]) + col_0)
+            self.subset_masks[key] = SubsetMask.from_window(np.where(label_mask, 1, no_data).astype(np.int32),
+                                                            edges, shape, geom_ref, self.ds_ref.GetProjection(),
+                                                            no_data_value=float(no_data), outer_value=no_data,
+                                                            bbox_edges=edges, inner_mask_edges=edges)
+        missing = [attribute_id for attribute_id in (attribute_ids or []) if attribute_id not in self.subset_masks]
+        if missing:
+            logging.warning(f'no cells of the reference dataset are in {attribute_name} {missing}')
+        logging.info(f'split label raster {label_path} into {len(self.subset_masks)} masks')
+        return self.subset_masks
+
+    def _rasterize_window(self, tif_path, shp_layer, dtype, no_data, **kwargs):
+        """rasterize a layer into a new raster covering only the window of the reference dataset around its features
+
+        Parameters
+        ----------
+        tif_path : str
+            path to write the raster to
+        shp_layer : ogr.Layer
+            the layer to rasterize, with any attribute filter already set
+        dtype : gdal.datatype
+            the datatype to write
+        no_data : int
+            value of the cells outside of the shapes
+        kwargs
+            options passed on to gdal.RasterizeLayer
+
+        Returns
+        -------
+        tuple
+            geotransform of the written window
+        """
+        # only the window of the reference grid the selected shapes fall in is rasterized
+        col_0, col_end, row_0, row_end = self.layer_window(shp_layer)
+        geom_ref = self.ds_ref.GetGeoTransform()
+        window_geom = (geom_ref[0] + col_0 * geom_ref[1], geom_ref[1], geom_ref[2],
+                       geom_ref[3] + row_0 * geom_ref[5], geom_ref[4], geom_ref[5])
         target_ds = gdal.GetDriverByName('GTiff').Create(tif_path,
-                                                         self.ds_ref.RasterXSize,
-                                                         self.ds_ref.RasterYSize,
+                                                         col_end - col_0,
+                                                         row_end - row_0,
                                                          1, dtype)
         target_ds.SetProjection(self.ds_ref.GetProjection())
-        target_ds.SetGeoTransform(geom_ref)
+        target_ds.SetGeoTransform(window_geom)
         target_ds.GetRasterBand(1).SetNoDataValue(no_data)
         target_ds.GetRasterBand(1).Fill(no_data)
-        # shapefile
-        shp_source = ogr.Open(self.full_shapefile_path)
-        shp_layer = shp_source.GetLayer()
-        # TODO: How to detect if the shape geometries extend beyond our reference bounds?
-        # Filter by the shapefile attribute IDs we want
-        shp_layer.SetAttributeFilter(f'{attribute_name} in ({",".join([str(i) for i in attribute_ids])})')
         # Rasterize layer
-        rtn_code = gdal.RasterizeLayer(target_ds, [1], shp_layer, burn_values=[1])
+        rtn_code = gdal.RasterizeLayer(target_ds, [1], shp_layer, **kwargs)
         if rtn_code == 0:
             target_ds.FlushCache()
             logging.info(f'reprojected shapefile from {str(shp_layer.GetSpatialRef()).replace(chr(10), "")} '
                          f'with extents {shp_layer.GetExtent()} '
-                         f'to {self.ds_ref.GetProjectionRef()} with transform {self.ds_ref.GetGeoTransform()}')
+                         f'to {self.ds_ref.GetProjectionRef()} with transform {self.ds_ref.GetGeoTransform()} '
+                         f'in window (col_0,col_end,row_0,row_end)={(col_0, col_end, row_0, row_end)}')
         else:
             msg = f'error rasterizing layer: {shp_layer}, gdal returned non-zero value: {rtn_code}'
             logging.exception(msg)
             raise Exception(msg)
-        self.subset_mask = SubsetMask(tif_path)
-        return tif_path
+        return window_geom
+
+    def layer_window(self, shp_layer):
+        """find the window of the reference dataset covering the (filtered) features of a layer
+
+        Parameters
+        ----------
+        shp_layer : ogr.Layer
+            the layer to rasterize, with any attribute filter already set
+
+        Returns
+        -------
+        tuple
+            (col_0, col_end, row_0, row_end) 0-based, end-exclusive window in the reference dataset's raster
+            orientation, with one cell of margin around the features. The whole dataset if the features
+            can not be located in it.
+        """
+        nx, ny = self.ds_ref.RasterXSize, self.ds_ref.RasterYSize
+        full_window = (0, nx, 0, ny)
+        geom_ref = self.ds_ref.GetGeoTransform()
+        if geom_ref[2] != 0 or geom_ref[4] != 0:
+            logging.warning(f'rotated reference geotransform {geom_ref}, rasterizing the whole domain')
+            return full_window
+        transform = None
+        layer_srs = shp_layer.GetSpatialRef()
+        ref_srs = osr.SpatialReference(wkt=self.ds_ref.GetProjection())
+        if layer_srs is not None and not layer_srs.IsSame(ref_srs):
+            layer_srs = layer_srs.Clone()
+            if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                # keep x,y axis order for geographic systems with GDAL 3+
+                layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                ref_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            transform = osr.CoordinateTransformation(layer_srs, ref_srs)
+        min_x = min_y = math.inf
+        max_x = max_y = -math.inf
+        shp_layer.ResetReading()
+        for feature in shp_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            if transform is not None:
+                geometry = geometry.Clone()
+                geometry.Transform(transform)
+            feature_min_x, feature_max_x, feature_min_y, feature_max_y = geometry.GetEnvelope()
+            min_x, max_x = min(min_x, feature_min_x), max(max_x, feature_max_x)
+            min_y, max_y = min(min_y, feature_min_y), max(max_y, feature_max_y)
+        shp_layer.ResetReading()
+        if not math.isfinite(min_x):
+            logging.warning(f'no features selected in {self.full_shapefile_path}, rasterizing the whole domain')
+            return full_window
+        # rows count down from the top edge when the pixel height is negative
+        row_a, row_b = (min_y - geom_ref[3]) / geom_ref[5], (max_y - geom_ref[3]) / geom_ref[5]
+        col_0 = max(math.floor((min_x - geom_ref[0]) / geom_ref[1]) - 1, 0)
+        col_end = min(math.ceil((max_x - geom_ref[0]) / geom_ref[1]) + 1, nx)
+        row_0 = max(math.floor(min(row_a, row_b)) - 1, 0)
+        row_end = min(math.ceil(max(row_a, row_b)) + 1, ny)
+        if col_0 >= col_end or row_0 >= row_end:
+            logging.warning(f'features of {self.full_shapefile_path} are outside of the reference dataset, '
+                            f'rasterizing the whole domain')
+            return full_window
+        return col_0, col_end, row_0, row_end
 
     def rasterize_shapefile_to_disk(self, out_dir=None, out_name=None, padding=(0, 0, 0, 0), attribute_name='OBJECTID',
                                     attribute_ids=None):
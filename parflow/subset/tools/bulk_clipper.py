@@ -8,9 +8,14 @@ import argparse
 import os
 from pathlib import Path
 import logging
+import queue
+import threading
+import time
 from datetime import datetime
-from parflow.subset.clipper import MaskClipper, BoxClipper
-from parflow.subset.utils.arguments import is_valid_file, is_valid_path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from parflow.subset.clipper import MaskClipper, BoxClipper, MultiClipper
+from parflow.subset.utils.arguments import is_valid_file, is_valid_path, is_positive_integer, \
+    is_nonzero_positive_integer
 from parflow.subset import TIF_NO_DATA_VALUE_OUT as NO_DATA
 from parflow.subset.mask import SubsetMask
 import parflow.subset.utils.io as file_io_tools
@@ -33,9 +38,11 @@ def parse_args(args) -> argparse.Namespace:
 
     exclusive_group = parser.add_mutually_exclusive_group(required=True)
 
-    exclusive_group.add_argument("--maskfile", "-m", dest="mask_file", required=False,
+    exclusive_group.add_argument("--maskfile", "-m", dest="mask_file", required=False, action='append',
                         type=lambda x: is_valid_file(parser, x),
-                        help="gridded full_dim_mask file to full extent of files to be clipped")
+                        help="gridded full_dim_mask file to full extent of files to be clipped, repeat to clip "
+                             "with many masks from one read of each file, writing the outputs of each mask to a "
+                             "folder of out_dir named after it")
 
     exclusive_group.add_argument("--bboxfile", "-b", dest="bbox_file", required=False,
                         type=lambda x: is_valid_file(parser, x),
@@ -73,10 +80,40 @@ def parse_args(args) -> argparse.Namespace:
     parser.add_argument("--tif_outs", "-t", dest="write_tifs", required=False,
                         action='store_true', help="write tif output files")
 
+    parser.add_argument("--workers", "-w", dest="workers", required=False, default=1,
+                        type=lambda x: is_nonzero_positive_integer(parser, x),
+                        help="number of processes to clip files with in parallel")
+
+    parser.add_argument("--read_ahead", "-k", dest="read_ahead", required=False, default=0,
+                        type=lambda x: is_positive_integer(parser, x),
+                        help="number of files to read ahead while clipping and writing in a single process, "
+                             "0 to clip one file at a time")
+
+    parser.add_argument("--topology", dest="topology", nargs=3, metavar=('P', 'Q', 'R'), required=False,
+                        default=(1, 1, 1), type=int,
+                        help="subgrid layout of pfb outputs, matching the ParFlow Process.Topology")
+
+    parser.add_argument("--dist", dest="write_dist", required=False, action='store_true',
+                        help="write a .pfb.dist file for each pfb output so ParFlow can skip pfdist")
+
+    parser.add_argument("--tif-dtype", dest="tif_dtype", required=False, default=None,
+                        choices=['uint8', 'uint16', 'int16', 'uint32', 'int32', 'float32', 'float64'],
+                        help="data type of tif outputs, default keeps the data type of each input")
+
+    parser.add_argument("--slab_size", "-s", dest="slab_size", required=False, default=0,
+                        type=lambda x: is_nonzero_positive_integer(parser, x),
+                        help="number of z layers to read, clip and write at a time, each file is clipped whole "
+                             "when not given")
+
+    parser.add_argument("--writers", dest="writers", required=False, default=2,
+                        type=lambda x: is_nonzero_positive_integer(parser, x),
+                        help="number of writer threads when reading ahead")
+
     return parser.parse_args(args)
 
 
-def mask_clip(mask_file, data_files, out_dir='.', pfb_outs=1, tif_outs=0) -> None:
+def mask_clip(mask_file, data_files, out_dir='.', pfb_outs=1, tif_outs=0, workers=1, read_ahead=0,
+              writers=2, topology=(1, 1, 1), dist=False, tif_dtype=None, slab_size=0) -> None:
     """clip a list of files using a full_dim_mask and a domain reference tif
 
     Parameters
@@ -91,6 +128,21 @@ def mask_clip(mask_file, data_files, out_dir='.', pfb_outs=1, tif_outs=0) -> Non
         write pfb files as outputs (optional) (Default value = 1)
     tif_outs : int, optional
         write tif files as outputs (optional) (Default value = 0)
+    workers : int, optional
+        number of processes to spread the files across (optional) (Default value = 1)
+    read_ahead : int, optional
+        number of files to read ahead of the clip stage in a single process, 0 to clip one file at a time
+        (optional) (Default value = 0)
+    writers : int, optional
+        number of writer threads when reading ahead (optional) (Default value = 2)
+    topology : tuple, optional
+        (p, q, r) subgrid layout of pfb outputs, matching the ParFlow Process.Topology (Default value = (1, 1, 1))
+    dist : bool, optional
+        write a .pfb.dist file next to each pfb output so ParFlow can skip pfdist (Default value = False)
+    tif_dtype : str, optional
+        numpy dtype name for tif outputs, None to keep the dtype of each clipped file (Default value = None)
+    slab_size : int, optional
+        number of z layers to read, clip and write at a time, 0 to clip each file whole (Default value = 0)
 
     Returns
     -------
@@ -103,10 +155,12 @@ def mask_clip(mask_file, data_files, out_dir='.', pfb_outs=1, tif_outs=0) -> Non
     clipper = MaskClipper(subset_mask=mask, no_data_threshold=-1)
     # clip all inputs and write outputs
     clip_inputs(clipper, input_list=data_files, out_dir=out_dir, pfb_outs=pfb_outs,
-                tif_outs=tif_outs)
+                tif_outs=tif_outs, workers=workers, read_ahead=read_ahead, writers=writers,
+                topology=topology, dist=dist, tif_dtype=tif_dtype, slab_size=slab_size)
 
 
-def box_clip(bbox, data_files, out_dir='.', pfb_outs=1, tif_outs=0) -> None:
+def box_clip(bbox, data_files, out_dir='.', pfb_outs=1, tif_outs=0, workers=1, read_ahead=0,
+             writers=2, topology=(1, 1, 1), dist=False, tif_dtype=None, slab_size=0) -> None:
     """clip a list of files using a bounding box
 
     Parameters
@@ -121,18 +175,39 @@ def box_clip(bbox, data_files, out_dir='.', pfb_outs=1, tif_outs=0) -> None:
         write pfb files as outputs (optional) (Default value = 1)
     tif_outs : int, optional
         write tif files as outputs (optional) (Default value = 0)
+    workers : int, optional
+        number of processes to spread the files across (optional) (Default value = 1)
+    read_ahead : int, optional
+        number of files to read ahead of the clip stage in a single process, 0 to clip one file at a time
+        (optional) (Default value = 0)
+    writers : int, optional
+        number of writer threads when reading ahead (optional) (Default value = 2)
+    topology : tuple, optional
+        (p, q, r) subgrid layout of pfb outputs, matching the ParFlow Process.Topology (Default value = (1, 1, 1))
+    dist : bool, optional
+        write a .pfb.dist file next to each pfb output so ParFlow can skip pfdist (Default value = False)
+    tif_dtype : str, optional
+        numpy dtype name for tif outputs, None to keep the dtype of each clipped file (Default value = None)
+    slab_size : int, optional
+        number of z layers to read, clip and write at a time, 0 to clip each file whole (Default value = 0)
 
     Returns
     -------
     None
-    
+
+    Raises
+    ------
+    Exception
+        if the inputs do not all have the same number of z layers, as the box spans every layer of the inputs
     """
 
-    # create clipper with bbox
-    clipper = BoxClipper(ref_array=file_io_tools.read_file(data_files[0]), x=bbox[0], y=bbox[1], nx=bbox[2], ny=bbox[3])
+    # create clipper with bbox, spanning the z layers of the deepest input so that none are dropped
+    nz = max(file_io_tools.probe_file(data_file).shape[0] for data_file in data_files)
+    clipper = BoxClipper(ref_array=None, x=bbox[0], y=bbox[1], nx=bbox[2], ny=bbox[3], nz=nz)
     # clip all inputs and write outputs
     clip_inputs(clipper, input_list=data_files, out_dir=out_dir, pfb_outs=pfb_outs,
-                tif_outs=tif_outs)
+                tif_outs=tif_outs, workers=workers, read_ahead=read_ahead, writers=writers,
+                topology=topology, dist=dist, tif_dtype=tif_dtype, slab_size=slab_size)
 
 
 def locate_tifs(file_list) -> list:
@@ -152,9 +227,21 @@ def locate_tifs(file_list) -> list:
     return list([s for s in file_list if '.tif' in s.lower()])
 
 
-def clip_inputs(clipper, input_list, out_dir='.', pfb_outs=1, tif_outs=0, no_data=NO_DATA) -> None:
+def clip_inputs(clipper, input_list, out_dir='.', pfb_outs=1, tif_outs=0, no_data=NO_DATA, workers=1, read_ahead=0,
+                writers=2, topology=(1, 1, 1), dist=False, tif_dtype=None, reader=None, slab_size=0) -> None:
     """clip a list of files using a clipper object
 
+    Files that fail to clip are logged and skipped, and an exception listing every failure is raised
+    once the whole batch has been processed.
+
+    With read_ahead > 0 (and a single worker) reading, clipping and writing overlap: a reader thread
+    prefetches up to read_ahead files, and clipped arrays are handed to a pool of writer threads, with at most
+    read_ahead outputs waiting to be written. Memory use is bounded by the queue depth rather than the
+    number of files.
+
+    With slab_size > 0 each file is read, clipped and written slab_size z layers at a time instead, so memory
+    use is bounded by the size of a slab rather than the size of a file (reading ahead is not used).
+
     Parameters
     ----------
     clipper : Clipper
@@ -169,25 +256,521 @@ def clip_inputs(clipper, input_list, out_dir='.', pfb_outs=1, tif_outs=0, no_dat
         write tif files as outputs (optional) (Default value = 0)
     no_data : int, optional
         no_data value for tifs (optional) (Default value = NO_DATA)
+    workers : int, optional
+        number of processes to spread the files across (optional) (Default value = 1)
+    read_ahead : int, optional
+        number of files to read ahead of the clip stage in a single process, 0 to clip one file at a time
+        (optional) (Default value = 0)
+    writers : int, optional
+        number of writer threads when reading ahead (optional) (Default value = 2)
+    topology : tuple, optional
+        (p, q, r) subgrid layout of pfb outputs, matching the ParFlow Process.Topology (Default value = (1, 1, 1))
+    dist : bool, optional
+        write a .pfb.dist file next to each pfb output so ParFlow can skip pfdist (Default value = False)
+    tif_dtype : str, optional
+        numpy dtype name for tif outputs, None to keep the dtype of each clipped file (Default value = None)
+    reader : callable, optional
+        reader(infile, window) used to read the inputs, such as `ParflowDomain.tile_reader`, None to read the
+        files directly; must be picklable when workers > 1 (Default value = None)
+    slab_size : int, optional
+        number of z layers to read, clip and write at a time, 0 to clip each file whole (Default value = 0)
 
     Returns
     -------
     None
+
+    Raises
+    ------
+    Exception
+        if the inputs are not on the same grid or do not cover the clipper z window, or if any of the files could
+        not be clipped
     """
+    check_same_grid(input_list, clipper)
     ref_proj = None
     if tif_outs:
         # identify projection
-        ref_proj = clipper.subset_mask.mask_tif.GetProjection()
+        ref_proj = clipper.subset_mask.projection
+    options = dict(out_dir=out_dir, pfb_outs=pfb_outs, tif_outs=tif_outs, ref_proj=ref_proj, no_data=no_data,
+                   topology=topology, dist=dist, tif_dtype=tif_dtype, reader=reader, slab_size=slab_size)
+
+    failures = []
+    if workers > 1 and len(input_list) > 1:
+        # the clipper and output options are sent to each worker once, only filenames are sent per file
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(clipper, options)) as executor:
+            futures = {executor.submit(_clip_file_in_worker, data_file): data_file for data_file in input_list}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failures.append((futures[future], future.exception()))
+    elif read_ahead > 0 and not slab_size:
+        options.pop('slab_size')
+        failures = _clip_inputs_pipelined(clipper, input_list, read_ahead=read_ahead, writers=writers, **options)
+    else:
+        # loop over and clip, mask clips of same sized files reuse the previous output array once it is written
+        out = None
+        for data_file in input_list:
+            try:
+                out = _clip_file(clipper, data_file, out=out, **options)
+            except Exception as err:
+                failures.append((data_file, err))
+
+    _report_failures(failures, input_list)
+
+
+def _report_failures(failures, input_list) -> None:
+    """log each file which failed to clip, in input order, then raise an exception listing all of them
+
+    Parameters
+    ----------
+    failures : list
+        (data_file, exception) tuples for the files which could not be clipped
+    input_list : list
+        the list of data files clipped
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    Exception
+        if there are any failures
+    """
+    failures.sort(key=lambda failure: input_list.index(failure[0]))
+    for data_file, err in failures:
+        logging.error(f'failed to clip {data_file}: {err!r}')
+    if failures:
+        failed_files = list(dict.fromkeys(os.fspath(data_file) for data_file, _ in failures))
+        raise Exception(f'failed to clip {len(failed_files)} of {len(input_list)} files: {", ".join(failed_files)}')
+
+
+def check_same_grid(input_list, clipper=None) -> None:
+    """check that all of the files share the x and y extents of the first, from their headers only
+
+    The number of z layers may differ between files, e.g. 2D slopes clipped alongside a 3D indicator file,
+    since a clipper without a z window clips every layer of each file. When the clipper window does bound
+    z, every file must have at least z_end layers, otherwise the window would be silently cut short.
+    Files which can not be probed are left for the clip to report.
+
+    Parameters
+    ----------
+    input_list : list
+        list of data files (tif, pfb, sa) to check
+    clipper : Clipper, optional
+        clipper whose z window every file must cover, None to check only x and y (Default value = None)
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    Exception
+        if any file has different x or y extents than the first file, or fewer z layers than the clipper window
+    """
+    shapes = {}
+    for data_file in input_list:
+        try:
+            shapes[data_file] = file_io_tools.probe_file(data_file).shape
+        except (OSError, ValueError) as err:
+            logging.warning(f'could not probe {data_file}: {err!r}')
+    if not shapes:
+        return
+    ref_file, ref_shape = next(iter(shapes.items()))
+    mismatched = [f'{os.fspath(data_file)} (ny, nx)={shape[1:]}' for data_file, shape in shapes.items()
+                  if shape[1:] != ref_shape[1:]]
+    if mismatched:
+        raise Exception(f'inputs are not on the same grid as {os.fspath(ref_file)} (ny, nx)={ref_shape[1:]}: '
+                        f'{", ".join(mismatched)}')
+    z_end = None if clipper is None else clipper.get_window()[1]
+    if z_end is not None:
+        too_shallow = [f'{os.fspath(data_file)} nz={shape[0]}' for data_file, shape in shapes.items()
+                       if shape[0] < z_end]
+        if too_shallow:
+            raise Exception(f'inputs have fewer z layers than the clipper window z_end={z_end}: '
+                            f'{", ".join(too_shallow)}')
+
+
+def _clip_file(clipper, data_file, out_dir, pfb_outs, tif_outs, ref_proj, no_data, topology, dist, tif_dtype,
+               reader=None, slab_size=0, out=None):
+    """clip a single file and write its outputs
+
+    Parameters
+    ----------
+    clipper : Clipper
+        clipper object prepared with full_dim_mask and reference dataset
+    data_file : str
+        data file (tif, pfb) to clip from
+    out_dir : str
+        output directory
+    pfb_outs : int
+        write pfb files as outputs
+    tif_outs : int
+        write tif files as outputs
+    ref_proj : str
+        srs wkt projection for tif outputs
+    no_data : int
+        no_data value for tifs
+    topology : tuple
+        (p, q, r) subgrid layout of pfb outputs
+    dist : bool
+        write a .pfb.dist file next to each pfb output
+    tif_dtype : str
+        numpy dtype name for tif outputs, None to keep the dtype of the clipped data
+    reader : callable, optional
+        reader(infile, window) for the input, None to read the file directly (Default value = None)
+    slab_size : int, optional
+        number of z layers to read, clip and write at a time, 0 to clip the file whole (Default value = 0)
+    out : ndarray, optional
+        array a MaskClipper may reuse for the clipped data, its contents are overwritten (Default value = None)
+
+    Returns
+    -------
+    ndarray
+        the array holding the clipped data once it has been written, to pass as out for the next file,
+        None if nothing can be reused
+    """
+    if slab_size:
+        _clip_file_slabs(clipper, data_file, out_dir, pfb_outs, tif_outs, ref_proj, no_data, topology, dist,
+                         tif_dtype, reader, slab_size)
+        return None
+    subset_kwargs = {'out': out} if isinstance(clipper, MaskClipper) else {}
+    return_arr, new_geom, _, _ = clipper.subset_file(data_file, reader=reader, **subset_kwargs)
+    _write_outputs(data_file, return_arr, new_geom, out_dir, pfb_outs, tif_outs, ref_proj, no_data, topology, dist,
+                   tif_dtype)
+    return return_arr if subset_kwargs else None
+
+
+def _clip_file_slabs(clipper, data_file, out_dir, pfb_outs, tif_outs, ref_proj, no_data, topology, dist, tif_dtype,
+                     reader, slab_size):
+    """clip a single file slab_size z layers at a time, appending each clipped slab to the outputs
+
+    The outputs are the same as `_write_outputs` of the whole clipped file.
+
+    Parameters
+    ----------
+    clipper : Clipper
+        clipper object prepared with full_dim_mask and reference dataset
+    data_file : str
+        data file (tif, pfb) to clip from
+    out_dir : str
+        output directory
+    pfb_outs : int
+        write pfb files as outputs
+    tif_outs : int
+        write tif files as outputs
+    ref_proj : str
+        srs wkt projection for tif outputs
+    no_data : int
+        no_data value for tifs
+    topology : tuple
+        (p, q, r) subgrid layout of pfb outputs
+    dist : bool
+        write a .pfb.dist file next to each pfb output
+    tif_dtype : str
+        numpy dtype name for tif outputs, None to keep the dtype of the first clipped slab
+    reader : callable
+        reader(infile, window) for the input, None to read the file directly
+    slab_size : int
+        number of z layers to read, clip and write at a time
+
+    Returns
+    -------
+    None
+    """
+    filename = Path(data_file).stem
+    windows = clipper.get_slab_windows(file_io_tools.probe_file(data_file).shape[0], slab_size)
+    nz = sum(window[1] - window[0] for window in windows)
+    writers = None
+    for window, (return_arr, new_geom, _, _) in zip(windows, clipper.subset_file_slabs(data_file, slab_size,
+                                                                                         reader=reader)):
+        if writers is None:
+            # the outputs are created once the y and x size (and dtype) of the clipped data is known
+            shape = (nz,) + return_arr.shape[1:]
+            writers = []
+            if pfb_outs:
+                p, q, r = topology
+                writers.append(file_io_tools.PFBWriter(os.path.join(out_dir, f'{filename}_clip.pfb'), shape,
+                                                       p=p, q=q, r=r, dist=dist))
+            if tif_outs and new_geom is not None and ref_proj is not None:
+                gdal_dtype = file_io_tools.gdal_type_code(return_arr.dtype if tif_dtype is None else tif_dtype)
+                writers.append(file_io_tools.GeotiffWriter(os.path.join(out_dir, f'{filename}_clip.tif'), shape,
+                                                           new_geom, ref_proj, dtype=gdal_dtype, no_data=no_data))
+        for writer in writers:
+            writer.write_layers(return_arr)
+        logging.info(f'clipped {data_file} layers {window[0]} to {window[1]} of {nz}')
+    for writer in writers or []:
+        writer.close()
+
+
+def _write_outputs(data_file, return_arr, new_geom, out_dir, pfb_outs, tif_outs, ref_proj, no_data, topology,
+                   dist, tif_dtype):
+    """write the clipped data from data_file to out_dir
+
+    Parameters
+    ----------
+    data_file : str
+        data file (tif, pfb) the data was clipped from
+    return_arr : ndarray
+        the clipped data
+    new_geom : list
+        gdal geometry of the clipped data, None if no geometry is known
+    out_dir : str
+        output directory
+    pfb_outs : int
+        write pfb files as outputs
+    tif_outs : int
+        write tif files as outputs
+    ref_proj : str
+        srs wkt projection for tif outputs
+    no_data : int
+        no_data value for tifs
+    topology : tuple
+        (p, q, r) subgrid layout of pfb outputs
+    dist : bool
+        write a .pfb.dist file next to each pfb output
+    tif_dtype : str
+        numpy dtype name for tif outputs, None to keep the dtype of the clipped data
+
+    Returns
+    -------
+    None
+    """
+    filename = Path(data_file).stem
+    if pfb_outs:
+        p, q, r = topology
+        file_io_tools.write_pfb(return_arr, os.path.join(out_dir, f'{filename}_clip.pfb'), p=p, q=q, r=r,
+                                dist=dist)
+    if tif_outs and new_geom is not None and ref_proj is not None:
+        gdal_dtype = None if tif_dtype is None else file_io_tools.gdal_type_code(tif_dtype)
+        file_io_tools.write_array_to_geotiff(os.path.join(out_dir, f'{filename}_clip.tif'),
+                                             return_arr, new_geom, ref_proj, dtype=gdal_dtype, no_data=no_data)
+
+
+def _clip_inputs_pipelined(clipper, input_list, read_ahead, writers, out_dir, pfb_outs, tif_outs, ref_proj, no_data,
+                           topology, dist, tif_dtype, reader=None):
+    """clip a list of files with overlapping read, clip and write stages
+
+    Parameters
+    ----------
+    clipper : Clipper
+        clipper object prepared with full_dim_mask and reference dataset
+    input_list : list
+        list of data files (tif, pfb) to clip from
+    read_ahead : int
+        maximum number of read files waiting to be clipped, and of clipped files waiting to be written
+    writers : int
+        number of writer threads
+    out_dir : str
+        output directory
+    pfb_outs : int
+        write pfb files as outputs
+    tif_outs : int
+        write tif files as outputs
+    ref_proj : str
+        srs wkt projection for tif outputs
+    no_data : int
+        no_data value for tifs
+    topology : tuple
+        (p, q, r) subgrid layout of pfb outputs
+    dist : bool
+        write a .pfb.dist file next to each pfb output
+    tif_dtype : str
+        numpy dtype name for tif outputs, None to keep the dtype of the clipped data
+    reader : callable, optional
+        reader(infile, window) for the inputs, None to read the files directly (Default value = None)
+
+    Returns
+    -------
+    failures : list
+        (data_file, exception) tuples for the files which could not be clipped
+    """
+    stats = {stage: {'busy': 0.0, 'wait': 0.0} for stage in ('read', 'clip', 'write')}
+    failures = []
+    lock = threading.Lock()
+    read_queue = queue.Queue(maxsize=read_ahead)
+    write_slots = threading.BoundedSemaphore(read_ahead)
+    window = clipper.get_window()
+    if reader is None:
+        reader = file_io_tools.read_file
+
+    def read_stage():
+        for data_file in input_list:
+            start = time.perf_counter()
+            try:
+                item = (data_file, reader(data_file, window=window), None)
+            except Exception as err:
+                item = (data_file, None, err)
+            ready = time.perf_counter()
+            # blocks while read_ahead files are already waiting to be clipped
+            read_queue.put(item)
+            stats['read']['busy'] += ready - start
+            stats['read']['wait'] += time.perf_counter() - ready
+
+    def write_stage(data_file, return_arr, new_geom):
+        start = time.perf_counter()
+        try:
+            _write_outputs(data_file, return_arr, new_geom, out_dir, pfb_outs, tif_outs, ref_proj, no_data,
+                           topology, dist, tif_dtype)
+        except Exception as err:
+            with lock:
+                failures.append((data_file, err))
+        finally:
+            with lock:
+                stats['write']['busy'] += time.perf_counter() - start
+            write_slots.release()
+
+    pipeline_start = time.perf_counter()
+    read_thread = threading.Thread(target=read_stage, name='clip_inputs_reader', daemon=True)
+    read_thread.start()
+    with ThreadPoolExecutor(max_workers=max(writers, 1), thread_name_prefix='clip_inputs_writer') as executor:
+        for _ in input_list:
+            start = time.perf_counter()
+            data_file, data_array, err = read_queue.get()
+            ready = time.perf_counter()
+            stats['clip']['wait'] += ready - start
+            if err is not None:
+                with lock:
+                    failures.append((data_file, err))
+                continue
+            try:
+                return_arr, new_geom, _, _ = clipper.subset(data_array, windowed=True)
+            except Exception as err:
+                with lock:
+                    failures.append((data_file, err))
+                continue
+            finally:
+                del data_array
+                stats['clip']['busy'] += time.perf_counter() - ready
+            start = time.perf_counter()
+            # blocks while read_ahead clipped files are already waiting to be written
+            write_slots.acquire()
+            stats['clip']['wait'] += time.perf_counter() - start
+            executor.submit(write_stage, data_file, return_arr, new_geom)
+    read_thread.join()
+    elapsed = time.perf_counter() - pipeline_start
+    stats['write']['wait'] = max(max(writers, 1) * elapsed - stats['write']['busy'], 0.0)
+    logging.info(f'clip_inputs pipeline: {len(input_list)} files in {elapsed:.2f}s, read_ahead={read_ahead}, '
+                 f'writers={writers}')
+    for stage, times in stats.items():
+        logging.info(f'clip_inputs pipeline: {stage} stage busy {times["busy"]:.2f}s, waiting {times["wait"]:.2f}s')
+    return failures
+
+
+# clipper and output options of a clip_inputs worker process, set once by _init_worker
+_worker_state = {}
+
+
+def _init_worker(clipper, options):
+    """store the clipper and output options in a newly started worker process"""
+    _worker_state['clipper'] = clipper
+    _worker_state['options'] = options
+
+
+def _clip_file_in_worker(data_file):
+    """clip a single file in a worker process with the clipper sent by _init_worker"""
+    _worker_state['out'] = _clip_file(_worker_state['clipper'], data_file, out=_worker_state.get('out'),
+                                      **_worker_state['options'])
+
+
+def multi_mask_clip(mask_files, data_files, out_dirs, pfb_outs=1, tif_outs=0, topology=(1, 1, 1), dist=False,
+                    tif_dtype=None) -> None:
+    """clip a list of files with many full_dim_masks, reading each data file only once
+
+    Parameters
+    ----------
+    mask_files : list
+        full_dim_mask files generated from shapefile to mask utility no_data,0's=bbox,1's=mask
+    data_files : list
+        list of data files (tif, pfb) to clip from
+    out_dirs : list
+        output directory for each mask file
+    pfb_outs : int, optional
+        write pfb files as outputs (optional) (Default value = 1)
+    tif_outs : int, optional
+        write tif files as outputs (optional) (Default value = 0)
+    topology : tuple, optional
+        (p, q, r) subgrid layout of pfb outputs, matching the ParFlow Process.Topology (Default value = (1, 1, 1))
+    dist : bool, optional
+        write a .pfb.dist file next to each pfb output so ParFlow can skip pfdist (Default value = False)
+    tif_dtype : str, optional
+        numpy dtype name for tif outputs, None to keep the dtype of each clipped file (Default value = None)
+
+    Returns
+    -------
+    None
+    """
+    clippers = [MaskClipper(subset_mask=SubsetMask(mask_file), no_data_threshold=-1) for mask_file in mask_files]
+    clip_inputs_multi(clippers, input_list=data_files, out_dirs=out_dirs, pfb_outs=pfb_outs, tif_outs=tif_outs,
+                      topology=topology, dist=dist, tif_dtype=tif_dtype)
+
+
+def clip_inputs_multi(clippers, input_list, out_dirs, pfb_outs=1, tif_outs=0, no_data=NO_DATA, topology=(1, 1, 1),
+                      dist=False, tif_dtype=None, reader=None) -> None:
+    """clip a list of files with many clipper objects, reading each file once for all of the clippers
+
+    Each file is read once through the window covering every clipper's bounding box and all of the
+    clipped outputs are written from that one read. Files that fail to clip are logged and skipped, and an
+    exception listing every failure is raised once the whole batch has been processed, as `clip_inputs` does.
+
+    Parameters
+    ----------
+    clippers : list
+        clipper objects (or SubsetMasks) prepared with full_dim_mask and reference dataset
+    input_list : list
+        list of data files (tif, pfb) to clip from
+    out_dirs : list
+        output directory for each clipper, outputs keep the same names as `clip_inputs` writes
+    pfb_outs : int, optional
+        write pfb files as outputs (optional) (Default value = 1)
+    tif_outs : int, optional
+        write tif files as outputs (optional) (Default value = 0)
+    no_data : int, optional
+        no_data value for tifs (optional) (Default value = NO_DATA)
+    topology : tuple, optional
+        (p, q, r) subgrid layout of pfb outputs, matching the ParFlow Process.Topology (Default value = (1, 1, 1))
+    dist : bool, optional
+        write a .pfb.dist file next to each pfb output so ParFlow can skip pfdist (Default value = False)
+    tif_dtype : str, optional
+        numpy dtype name for tif outputs, None to keep the dtype of each clipped file (Default value = None)
+    reader : callable, optional
+        reader(infile, window) used to read the inputs, None to read the files directly (Default value = None)
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    Exception
+        if the inputs are not on the same grid or do not cover the clipper z window, or if any of the files could
+        not be clipped
+    """
+    if len(out_dirs) != len(clippers):
+        raise Exception(f'one output directory is required per clipper, got {len(out_dirs)} for {len(clippers)}')
+    multi_clipper = MultiClipper(clippers, no_data_threshold=-1)
+    check_same_grid(input_list, multi_clipper)
+    ref_projs = [None] * len(clippers)
+    if tif_outs:
+        # identify projection of each mask
+        ref_projs = [clipper.subset_mask.projection if isinstance(clipper, MaskClipper) else None
+                     for clipper in multi_clipper.clippers]
 
-    # loop over and clip
+    # loop over, read once, and clip with every clipper
+    failures = []
     for data_file in input_list:
-        filename = Path(data_file).stem
-        return_arr, new_geom, _, _ = clipper.subset(file_io_tools.read_file(data_file))
-        if pfb_outs:
-            file_io_tools.write_pfb(return_arr, os.path.join(out_dir, f'{filename}_clip.pfb'))
-        if tif_outs and new_geom is not None and ref_proj is not None:
-            file_io_tools.write_array_to_geotiff(os.path.join(out_dir, f'{filename}_clip.tif'),
-                                                 return_arr, new_geom, ref_proj, no_data=no_data)
+        try:
+            results = multi_clipper.subset_file(data_file, reader=reader)
+        except Exception as err:
+            failures.append((data_file, err))
+            continue
+        for (return_arr, new_geom, _, _), out_dir, ref_proj in zip(results, out_dirs, ref_projs):
+            try:
+                _write_outputs(data_file, return_arr, new_geom, out_dir, pfb_outs, tif_outs, ref_proj, no_data,
+                               topology, dist, tif_dtype)
+            except Exception as err:
+                failures.append((data_file, err))
+    _report_failures(failures, input_list)
 
 
 def get_file_list(input_dir, glob_pattern=None, files=None) -> list:
@@ -225,17 +808,27 @@ def main():
     data_files = get_file_list(input_dir=input_path, files=args.data_files, glob_pattern=args.glob_pattern)
     # If tif out specified, look for a reference tif
     if args.write_tifs and not args.ref_file:
-        if 'tif' not in args.mask_file.lower():
+        if not args.mask_file or 'tif' not in args.mask_file[0].lower():
             input_tifs = locate_tifs(data_files)
             if len(input_tifs) < 1:
                 raise Exception('Must include at least one geotif input or a ref_file when tif_outs is selected')
-    if args.mask_file:
-        mask_clip(args.mask_file, data_files, args.out_dir, args.write_pfbs, args.write_tifs)
+    if args.mask_file and len(args.mask_file) > 1:
+        # the outputs of each mask go in a folder named after it
+        out_dirs = [os.path.join(args.out_dir, Path(mask_file).stem) for mask_file in args.mask_file]
+        for out_dir in out_dirs:
+            os.makedirs(out_dir, exist_ok=True)
+        multi_mask_clip(args.mask_file, data_files, out_dirs, args.write_pfbs, args.write_tifs, args.topology,
+                        args.write_dist, args.tif_dtype)
+    elif args.mask_file:
+        mask_clip(args.mask_file[0], data_files, args.out_dir, args.write_pfbs, args.write_tifs, args.workers,
+                  args.read_ahead, args.writers, args.topology, args.write_dist, args.tif_dtype, args.slab_size)
     elif args.bbox_file:
         box_clip(file_io_tools.read_bbox(args.bbox_file), data_files, args.out_dir, args.write_pfbs,
-                 args.write_tifs)
+                 args.write_tifs, args.workers, args.read_ahead, args.writers, args.topology, args.write_dist,
+                 args.tif_dtype, args.slab_size)
     elif args.bbox_def:
-        box_clip(args.bbox_def, data_files, args.out_dir, args.write_pfbs, args.write_tifs)
+        box_clip(args.bbox_def, data_files, args.out_dir, args.write_pfbs, args.write_tifs, args.workers,
+                 args.read_ahead, args.writers, args.topology, args.write_dist, args.tif_dtype, args.slab_size)
     end_date = datetime.utcnow()
     logging.info(f'completed process at {end_date} for a runtime of {end_date-start_date}')
 
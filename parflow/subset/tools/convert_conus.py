@@ -0,0 +1,108 @@
+"""Convert the CONUS inputs to tile stores, so subsets read only the tiles around their mask
+
+Run once per local copy of the CONUS inputs, subset_conus picks the tiles up automatically.
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from parflow.subset.utils.arguments import is_valid_path, is_nonzero_positive_integer, is_valid_file
+from parflow.subset.utils.tiles import DEFAULT_TILE_SIZE
+from parflow.subset.domain import ParflowDomain
+from parflow.subset.data import conus_manifest
+
+
+def parse_args(args):
+    """Parse the command line arguments
+
+    Parameters
+    ----------
+    args : list
+        list of arguments from sys.argv
+
+    Returns
+    -------
+    Namespace
+        populated Namespace object from the parsed command line options
+
+    """
+    parser = argparse.ArgumentParser('Convert ParFlow CONUS inputs to tile stores')
+
+    """
+    Required Arguments
+    """
+    parser.add_argument("--conus_files", "-f", dest="conus_files", required=True,
+                        help="local path to the CONUS inputs to convert",
+                        type=lambda x: is_valid_path(parser, x))
+    """
+    Optional Arguments
+    """
+    parser.add_argument("--manifest", "-m", dest="manifest_file", required=False,
+                        default=conus_manifest,
+                        type=lambda x: is_valid_file(parser, x),
+                        help="the manifest of CONUS filenames to convert")
+
+    parser.add_argument("--version", "-v", dest="conus_version", required=False,
+                        default=1, choices=[1, 2], type=int,
+                        help="the version of CONUS to convert")
+
+    parser.add_argument("--tile_size", "-s", dest="tile_size", required=False,
+                        default=DEFAULT_TILE_SIZE,
+                        type=lambda x: is_nonzero_positive_integer(parser, x),
+                        help="x and y size of the tiles")
+
+    parser.add_argument("--compress", "-z", dest="compress", required=False,
+                        action='store_true',
+                        help="write compressed tiles, smaller on disk but slower to read")
+
+    return parser.parse_args(args)
+
+
+def convert_conus(conus_files, conus_version=1, manifest_file=conus_manifest, tile_size=DEFAULT_TILE_SIZE,
+                  compress=False):
+    """write a tile store for each CONUS input in the manifest, under <conus_files>/tiles
+
+    Parameters
+    ----------
+    conus_files : str
+        local path to the CONUS inputs
+    conus_version : int, optional
+        version of CONUS in conus_files (Default value = 1)
+    manifest_file : str, optional
+        manifest of CONUS filenames (Default value = conus_manifest)
+    tile_size : int, optional
+        x and y size of the tiles (Default value = DEFAULT_TILE_SIZE)
+    compress : bool, optional
+        write compressed tiles (Default value = False)
+
+    Returns
+    -------
+    converted : list
+        names of the inputs converted
+    """
+    conus = ParflowDomain('conus', local_path=conus_files, manifest_file=manifest_file, version=conus_version)
+    converted = conus.write_tiles(tile_size=tile_size, compress=compress)
+    logging.info(f'converted {len(converted)} CONUS{conus_version} inputs to tiles in {conus.tile_path}: '
+                 f'{", ".join(converted)}')
+    return converted
+
+
+def main():
+    # setup logging
+    start_date = datetime.utcnow()
+    # parse the command line arguments
+    cmd_line_args = sys.argv
+    args = parse_args(cmd_line_args[1:])
+    logging.basicConfig(filename=os.path.join(args.conus_files, 'convert_conus.log'), filemode='w',
+                        level=logging.INFO)
+    logging.info(f'start process at {start_date} from command {" ".join(cmd_line_args[:])}')
+    convert_conus(conus_files=args.conus_files, conus_version=args.conus_version, manifest_file=args.manifest_file,
+                  tile_size=args.tile_size, compress=args.compress)
+
+    end_date = datetime.utcnow()
+    logging.info(f'completed process at {end_date} for a runtime of {end_date - start_date}')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,12 @@ import logging
 import os
 import sys
 from pathlib import Path
-from parflow.subset.utils.arguments import is_valid_path, is_positive_integer, is_valid_file
+from parflow.subset.utils.arguments import is_valid_path, is_positive_integer, is_valid_file, \
+    is_nonzero_positive_integer
 from parflow.subset.clipper import MaskClipper
 from parflow.subset.domain import Conus
 from parflow.subset.rasterizer import ShapefileRasterizer
+from parflow.subset.cache import MaskCache, DEFAULT_CACHE_SIZE
 from datetime import datetime
 import parflow.subset.tools.bulk_clipper as bulk_clipper
 import parflow.subset.builders.solidfile as solidfile_generator
@@ -97,12 +99,31 @@ def parse_args(args):
     parser.add_argument("--tif_outs", "-t", dest="write_tifs", required=False,
                         action='store_true', help="write tif output files")
 
+    parser.add_argument("--cache_dir", "-k", dest="cache_dir", required=False,
+                        default=None,
+                        help="folder to cache rasterized masks in, reruns with the same inputs skip rasterizing",
+                        type=lambda x: is_valid_path(parser, x))
+
+    parser.add_argument("--cache_size", "-z", dest="cache_size", required=False,
+                        default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="size of the mask cache in megabytes, least recently used masks are removed past it",
+                        type=lambda x: is_positive_integer(parser, x))
+
+    parser.add_argument("--special_patches", "-x", dest="special_patches", required=False,
+                        action='store_true',
+                        help="make solid file patches for lakes, sinks, streams, reservoirs and ocean borders (CONUS2)")
+
+    parser.add_argument("--topology", dest="topology", nargs=3, metavar=('P', 'Q', 'R'), required=False,
+                        default=(2, 1, 1), type=lambda x: is_nonzero_positive_integer(parser, x),
+                        help="subgrid layout of the pfb outputs and the ParFlow Process.Topology of the .tcl script")
+
     return parser.parse_args(args)
 
 
 def subset_conus(input_path, shapefile, conus_version=1, conus_files='.', out_dir='.', out_name=None, clip_clm=False,
                  write_tcl=False, padding=(0, 0, 0, 0), attribute_name='OBJECTID', attribute_ids=None, write_tifs=False,
-                 manifest_file=conus_manifest):
+                 manifest_file=conus_manifest, topology=(2, 1, 1), cache_dir=None, cache_size=DEFAULT_CACHE_SIZE,
+                 special_patches=False):
     """subset a conus domain inputs for running a regional model
 
     Parameters
@@ -131,6 +152,17 @@ def subset_conus(input_path, shapefile, conus_version=1, conus_files='.', out_di
         list of attribute ID's defined in shapefile to use as mask input. default [1]
     write_tifs : int, optional
         whether or not to write outputs as TIF's in addition to PFB's. (default no)
+    topology : tuple, optional
+        (p, q, r) Process.Topology written to the TCL file, clipped PFB's are split into the same subgrids
+        and written with .pfb.dist files, so the TCL file does not run pfdist (default (2, 1, 1))
+    cache_dir : str, optional
+        folder to cache the rasterized mask and clipper in, keyed by the shapefile, attributes, padding and domain
+        (default None, no cache)
+    cache_size : int, optional
+        size in bytes of the mask cache (default DEFAULT_CACHE_SIZE)
+    special_patches : bool, optional
+        give lakes, sinks, streams, reservoirs and ocean borders their own patches in the solid file, from the
+        domain inputs marking them (CONUS2 only) (default no)
 
     Returns
     -------
@@ -143,20 +175,39 @@ def subset_conus(input_path, shapefile, conus_version=1, conus_files='.', out_di
     if attribute_ids is None:
         attribute_ids = [1]
     # Step 1, rasterize shapefile
-
-    rasterizer = ShapefileRasterizer(input_path, shapefile, reference_dataset=conus.get_domain_tif(),
-                                     no_data=-999, output_path=out_dir, )
-    rasterizer.rasterize_shapefile_to_disk(out_name=f'{out_name}_raster_from_shapefile.tif',
-                                           padding=padding,
-                                           attribute_name=attribute_name,
-                                           attribute_ids=attribute_ids)
-
-    subset_mask = rasterizer.subset_mask
+    mask_cache = MaskCache(cache_dir, max_bytes=cache_size) if cache_dir is not None else None
+    cached = None
+    if mask_cache is not None:
+        cache_key = mask_cache.key(input_path, shapefile, conus.get_domain_tif(), attribute_name=attribute_name,
+                                   attribute_ids=attribute_ids, padding=padding, no_data=-999, no_data_threshold=-1)
+        cached = mask_cache.get(cache_key, conus.get_domain_tif(), no_data_threshold=-1)
+    if cached is None:
+        rasterizer = ShapefileRasterizer(input_path, shapefile, reference_dataset=conus.get_domain_tif(),
+                                         no_data=-999, output_path=out_dir, )
+        rasterizer.rasterize_shapefile_to_disk(out_name=f'{out_name}_raster_from_shapefile.tif',
+                                               padding=padding,
+                                               attribute_name=attribute_name,
+                                               attribute_ids=attribute_ids)
+        subset_mask = rasterizer.subset_mask
+        clip = MaskClipper(subset_mask, no_data_threshold=-1)
+        if mask_cache is not None:
+            mask_cache.put(cache_key, subset_mask, clip)
+    else:
+        # write the same outputs rasterizing would have
+        subset_mask, clip = cached
+        subset_mask.write_mask_to_tif(filename=os.path.join(out_dir, f'{out_name}_raster_from_shapefile.tif'))
+        subset_mask.write_bbox(os.path.join(out_dir, 'bbox.txt'))
 
     # Step 2, Generate solid file
-    clip = MaskClipper(subset_mask, no_data_threshold=-1)
+    special_layers = None
+    if special_patches:
+        # CONUS2 marks lakes, sinks, streams, reservoirs and ocean borders with inputs of their own
+        special_layers = {key: clip.subset_file(os.path.join(conus.local_path, conus.required_files.get(key)),
+                                                reader=conus.tile_reader)[0]
+                          for key in solidfile_generator.SPECIAL_LAYERS if key in conus.required_files}
     batches = solidfile_generator.make_solid_file(clipped_mask=clip.clipped_mask,
-                                                  out_name=os.path.join(out_dir, out_name))
+                                                  out_name=os.path.join(out_dir, out_name),
+                                                  special_layers=special_layers)
     if len(batches) == 0:
         raise Exception("Did not make solid file correctly")
 
@@ -164,21 +215,23 @@ def subset_conus(input_path, shapefile, conus_version=1, conus_files='.', out_di
     bulk_clipper.clip_inputs(clip,
                              [os.path.join(conus.local_path, value) for key, value in conus.required_files.items()
                               if key not in ['DOMAIN_MASK', 'CHANNELS']],
-                             out_dir=out_dir, tif_outs=write_tifs)
+                             out_dir=out_dir, tif_outs=write_tifs, topology=topology, dist=True,
+                             reader=conus.tile_reader)
 
     # Step 4. Clip CLM inputs
     if clip_clm == 1:
         clm_clipper = ClmClipper(subset_mask)
-        latlon_formatted, latlon_data = clm_clipper.clip_latlon(os.path.join(conus.local_path,
-                                                                             conus.optional_files.get('LAT_LON')))
+        lat, lon = clm_clipper.clip_latlon(os.path.join(conus.local_path, conus.optional_files.get('LAT_LON')),
+                                           reader=conus.tile_reader)
 
-        clm_clipper.write_lat_lon(latlon_formatted, os.path.join(out_dir, f'{out_name}_latlon.sa'),
-                                  x=latlon_data.shape[2], y=latlon_data.shape[1], z=latlon_data.shape[0])
+        clm_clipper.write_lat_lon(lat, lon, os.path.join(out_dir, f'{out_name}_latlon.sa'),
+                                  x=lat.shape[2], y=lat.shape[1], z=lat.shape[0])
 
-        land_cover_data, vegm_data = clm_clipper.clip_land_cover(lat_lon_array=latlon_formatted,
+        land_cover_data, vegm_data = clm_clipper.clip_land_cover(lat=lat, lon=lon,
                                                                  land_cover_file=os.path.join(conus.local_path,
                                                                                               conus.optional_files.get(
-                                                                                                  'LAND_COVER')))
+                                                                                                  'LAND_COVER')),
+                                                                 reader=conus.tile_reader)
 
         clm_clipper.write_land_cover(vegm_data, os.path.join(out_dir, f'{out_name}_vegm.dat'))
 
@@ -190,7 +243,7 @@ def subset_conus(input_path, shapefile, conus_version=1, conus_files='.', out_di
                   os.path.join(out_dir, f'{Path(conus.required_files.get("SLOPE_X")).stem}_clip.pfb'),
                   os.path.join(out_dir, f'{out_name}.pfsol'),
                   os.path.join(out_dir, 'pme.pfb'), end_time=10, batches=batches,
-                  p=2, q=1, r=1, timestep=1, constant=1)
+                  p=topology[0], q=topology[1], r=topology[2], timestep=1, constant=1, pfdist=False)
 
 
 def main():
@@ -204,7 +257,9 @@ def main():
     subset_conus(input_path=args.input_path, shapefile=args.shapefile, conus_version=args.conus_version,
                  conus_files=args.conus_files, out_dir=args.out_dir, out_name=args.out_name, clip_clm=args.clip_clm,
                  write_tcl=args.write_tcl, padding=args.padding, attribute_ids=args.attribute_ids,
-                 attribute_name=args.attribute_name, write_tifs=args.write_tifs, manifest_file=args.manifest_file)
+                 attribute_name=args.attribute_name, write_tifs=args.write_tifs, manifest_file=args.manifest_file,
+                 cache_dir=args.cache_dir, cache_size=args.cache_size * 1024 * 1024,
+                 special_patches=args.special_patches, topology=tuple(args.topology))
 
     end_date = datetime.utcnow()
     logging.info(f'completed process at {end_date} for a runtime of {end_date - start_date}')
@@ -46,6 +46,28 @@ def is_positive_integer(parser, arg):
         return ivalue
 
 
+def is_nonzero_positive_integer(parser, arg):
+    """checks that an argument is an int of at least 1
+
+    Parameters
+    ----------
+    parser : ArgParse.ArgumentParser
+        the argument parser object
+    arg : str
+        value to check
+
+    Returns
+    -------
+    ivalue : int
+        integer representation of `arg`
+    """
+    ivalue = int(arg)
+    if ivalue < 1:
+        parser.error("%s is an invalid value, it must be at least 1" % arg)
+    else:
+        return ivalue
+
+
 def is_valid_path(parser, arg):
     """checks that folder path is valid
 
@@ -2,23 +2,51 @@
 
 import os
 import sys
+import struct
+import re
 import logging
 from pathlib import Path
-import pandas as pd
 import numpy as np
 import gdal
 from parflow.subset import TIF_NO_DATA_VALUE_OUT as NO_DATA
 from parflowio.pyParflowio import PFData
 from parflow.subset.bbox import BBox
 
+# pfb file header: x, y, z, nx, ny, nz, dx, dy, dz, num_subgrids
+PFB_HEADER = struct.Struct('>3d3i3di')
+# pfb subgrid header: ix, iy, iz, nx, ny, nz, rx, ry, rz
+PFB_SUBGRID_HEADER = struct.Struct('>9i')
+PFB_DTYPE = np.dtype('>f8')
+# bytes of a .sa file parsed at a time
+SA_CHUNK_SIZE = 1 << 24
+# rows of text output formatted at a time
+TEXT_CHUNK_ROWS = 1 << 16
+# numpy dtypes of the gdal raster band data types
+GDAL_DTYPES = {'Byte': np.uint8, 'Int8': np.int8, 'UInt16': np.uint16, 'Int16': np.int16, 'UInt32': np.uint32,
+               'Int32': np.int32, 'UInt64': np.uint64, 'Int64': np.int64, 'Float32': np.float32,
+               'Float64': np.float64}
+# gdal raster band data types of the numpy dtypes geotifs can hold
+GDAL_TYPE_CODES = {np.dtype(np.uint8): gdal.GDT_Byte, np.dtype(np.uint16): gdal.GDT_UInt16,
+                   np.dtype(np.int16): gdal.GDT_Int16, np.dtype(np.uint32): gdal.GDT_UInt32,
+                   np.dtype(np.int32): gdal.GDT_Int32, np.dtype(np.float32): gdal.GDT_Float32,
+                   np.dtype(np.float64): gdal.GDT_Float64}
+# Int64 and UInt64 were added in gdal 3.5, Int8 in 3.7
+GDAL_TYPE_CODES.update({np.dtype(GDAL_DTYPES[name]): getattr(gdal, f'GDT_{name}')
+                        for name in ('Int8', 'UInt64', 'Int64') if hasattr(gdal, f'GDT_{name}')})
 
-def read_file(infile):
+
+def read_file(infile, window=None):
     """read an input file and return a 3d numpy array
 
     Parameters
     ----------
     infile : str
         file to open (.pfb, .sa, .tif, .tiff)
+    window : tuple, optional
+        (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region of the file to read, in
+        (z,y,x) format with y axis 0 at bottom. None for any value uses the full extent of that axis.
+        For .pfb and .tif files only the data intersecting the window is read from disk, for .sa files only the
+        lines inside the window are parsed (Default value = None)
 
     Returns
     -------
@@ -31,18 +59,13 @@ def read_file(infile):
     ext = infile_path.suffix
     file_string_path = os.fspath(infile_path)
     if ext in ['.tif', '.tiff']:
-        res_arr = gdal.Open(file_string_path).ReadAsArray()
-        if len(res_arr.shape) == 2:
-            res_arr = res_arr[np.newaxis, ...]
-        # flip y axis so tiff aligns with PFB native alignment
-        res_arr = np.flip(res_arr, axis=1)
+        # read band by band, flipping the y axis so tiff aligns with PFB native alignment
+        return read_geotiff_window(file_string_path, window)
     elif ext == '.sa':  # parflow ascii file
-        with open(file_string_path, 'r') as fi:
-            header = fi.readline()
-        nx, ny, nz = [int(x) for x in header.strip().split(' ')]
-        arr = pd.read_csv(file_string_path, skiprows=1, header=None).values
-        res_arr = np.reshape(arr, (nz, ny, nx))[:, :, :]
+        return read_sa(file_string_path, window)
     elif ext == '.pfb':  # parflow binary file
+        if window is not None:
+            return read_pfb_window(file_string_path, window)
         pfdata = PFData(file_string_path)
         pfdata.loadHeader()
         pfdata.loadData()
@@ -50,6 +73,414 @@ def read_file(infile):
     else:
         raise ValueError('can not read file type ' + ext)
 
+    if window is not None:
+        z_0, z_end, y_0, y_end, x_0, x_end = normalize_window(window, res_arr.shape)
+        res_arr = res_arr[z_0:z_end, y_0:y_end, x_0:x_end]
+    return res_arr
+
+
+def normalize_window(window, shape):
+    """resolve a read window against the (z,y,x) shape of the data it applies to
+
+    Parameters
+    ----------
+    window : tuple
+        (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive extents, None for the full extent of an axis
+    shape : tuple
+        (nz, ny, nx) shape of the full data
+
+    Returns
+    -------
+    tuple
+        (z_0, z_end, y_0, y_end, x_0, x_end) with every value set and clipped to `shape`
+    """
+    if window is None:
+        window = (None,) * 6
+    extents = []
+    for axis, size in enumerate(shape):
+        start, end = window[2 * axis], window[2 * axis + 1]
+        start = 0 if start is None else min(max(start, 0), size)
+        end = size if end is None else min(max(end, start), size)
+        extents.extend([start, end])
+    return tuple(extents)
+
+
+def read_pfb_header(infile):
+    """read the file header and the subgrid headers of a pfb file without reading the data
+
+    Parameters
+    ----------
+    infile : str
+        pfb file to open
+
+    Returns
+    -------
+    header : dict
+        file header values x, y, z, nx, ny, nz, dx, dy, dz, num_subgrids
+    subgrids : list of tuples
+        (ix, iy, iz, nx, ny, nz, offset) for each subgrid, where offset is the byte position of the subgrid data
+    """
+    keys = ['x', 'y', 'z', 'nx', 'ny', 'nz', 'dx', 'dy', 'dz', 'num_subgrids']
+    subgrids = []
+    with open(infile, 'rb') as fp:
+        header = dict(zip(keys, PFB_HEADER.unpack(fp.read(PFB_HEADER.size))))
+        offset = PFB_HEADER.size
+        for _ in range(header['num_subgrids']):
+            fp.seek(offset)
+            ix, iy, iz, nx, ny, nz, _, _, _ = PFB_SUBGRID_HEADER.unpack(fp.read(PFB_SUBGRID_HEADER.size))
+            offset += PFB_SUBGRID_HEADER.size
+            subgrids.append((ix, iy, iz, nx, ny, nz, offset))
+            offset += nx * ny * nz * PFB_DTYPE.itemsize
+    return header, subgrids
+
+
+def read_pfb_window(infile, window=None):
+    """read a region of a pfb file, decoding only the subgrids which intersect it
+
+    Parameters
+    ----------
+    infile : str
+        pfb file to open
+    window : tuple, optional
+        (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read (Default value = None)
+
+    Returns
+    -------
+    res_arr : ndarray
+        a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+    """
+    pfb_file = PFBFile(infile)
+    res_arr = pfb_file.read_window(window)
+    pfb_file.close()
+    return res_arr
+
+
+def read_sa(infile, window=None, chunk_size=SA_CHUNK_SIZE):
+    """read a parflow simple ascii file, parsing it in chunks straight into the output array
+
+    Files with one number per line are read as int64 if every value is an integer, float64 otherwise.
+    Any other lines (such as the "lat lon" pairs of CLM files) are returned as an object array of strings.
+
+    Parameters
+    ----------
+    infile : str
+        .sa file to open
+    window : tuple, optional
+        (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read, lines outside of it are
+        skipped without being parsed (Default value = None)
+    chunk_size : int, optional
+        number of bytes to read and parse at a time (Default value = SA_CHUNK_SIZE)
+
+    Returns
+    -------
+    res_arr : ndarray
+        a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+
+    Raises
+    ------
+    Exception
+        if the file does not have the number of values given by its header
+    """
+    with open(infile, 'rb') as fp:
+        nx, ny, nz = [int(x) for x in fp.readline().split()]
+        z_0, z_end, y_0, y_end, x_0, x_end = normalize_window(window, (nz, ny, nx))
+        out_shape = (z_end - z_0, y_end - y_0, x_end - x_0)
+        # the wanted lines are runs of x_end - x_0 lines, one for each y row of each z layer in the window,
+        # runs which follow each other in the file are merged
+        row_starts = ((np.arange(z_0, z_end)[:, np.newaxis] * ny + np.arange(y_0, y_end)) * nx + x_0).ravel()
+        run_length = x_end - x_0
+        if run_length and len(row_starts):
+            breaks = np.flatnonzero(np.diff(row_starts) != run_length) + 1
+            run_starts = row_starts[np.concatenate(([0], breaks))]
+            run_ends = np.append(row_starts[breaks - 1], row_starts[-1]) + run_length
+        else:
+            run_starts = run_ends = np.empty(0, dtype=np.int64)
+        res_arr = None
+        filled = 0
+        line_no = 0
+        run = 0
+        remainder = b''
+        while True:
+            chunk = fp.read(chunk_size)
+            data = remainder + chunk
+            if chunk:
+                # hold back the partial last line for the next chunk
+                cut = data.rfind(b'\n') + 1
+                data, remainder = data[:cut], data[cut:]
+            if data:
+                line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+                if len(data) and data[-1:] != b'\n':
+                    line_ends = np.append(line_ends, len(data))
+                line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+                # blank lines do not hold values
+                not_blank = line_ends > line_starts
+                line_starts, line_ends = line_starts[not_blank], line_ends[not_blank]
+                if res_arr is None and len(line_starts):
+                    res_arr = _allocate_sa_array(data[line_starts[0]:line_ends[0]], out_shape)
+                num_lines = len(line_starts)
+                # copy every run (or the part of it) which falls in this chunk
+                while run < len(run_starts) and run_starts[run] < line_no + num_lines:
+                    # lines before line_no were handled with the previous chunks
+                    first = max(run_starts[run], line_no)
+                    last = min(run_ends[run], line_no + num_lines)
+                    res_arr, filled = _parse_sa_lines(data, line_starts[first - line_no:last - line_no],
+                                                      line_ends[first - line_no:last - line_no], res_arr, filled)
+                    if last < run_ends[run]:
+                        break
+                    run += 1
+                line_no += num_lines
+            if not chunk or run >= len(run_starts):
+                break
+    if res_arr is None:
+        res_arr = np.empty(0, dtype=np.float64)
+    if filled != int(np.prod(out_shape)) or (window is None and line_no != nx * ny * nz):
+        raise Exception(f'{infile} does not have the (nx,ny,nz)={(nx, ny, nz)} values given in its header')
+    return res_arr.reshape(out_shape)
+
+
+def _allocate_sa_array(first_line, out_shape):
+    """allocate the flat output buffer of read_sa, typed by the first line of data in the file"""
+    try:
+        float(first_line)
+        is_number = len(first_line.split()) == 1
+    except ValueError:
+        is_number = False
+    if not is_number:
+        dtype = object
+    elif re.search(rb'[.eEnNiI]', first_line):
+        dtype = np.float64
+    else:
+        dtype = np.int64
+    return np.empty(int(np.prod(out_shape)), dtype=dtype)
+
+
+def _parse_sa_lines(data, line_starts, line_ends, res_arr, filled):
+    """parse the consecutive lines of data between line_starts[0] and line_ends[-1] into res_arr at filled
+
+    Parameters
+    ----------
+    data : bytes
+        chunk of the .sa file
+    line_starts : ndarray
+        byte position in data of the start of each line
+    line_ends : ndarray
+        byte position in data of the end of each line
+    res_arr : ndarray
+        flat output array
+    filled : int
+        number of values already in res_arr
+
+    Returns
+    -------
+    res_arr : ndarray
+        res_arr, converted to float64 if the lines hold the first non integer values of an int64 file
+    int
+        the new number of filled values in res_arr
+    """
+    count = len(line_starts)
+    if res_arr.dtype == object:
+        res_arr[filled:filled + count] = [data[start:end].decode().rstrip('\r')
+                                          for start, end in zip(line_starts, line_ends)]
+        return res_arr, filled + count
+    block = data[line_starts[0]:line_ends[-1]]
+    if res_arr.dtype == np.int64 and re.search(rb'[.eEnNiI]', block):
+        # a non integer value after integer lines, the whole file is float data
+        res_arr = res_arr.astype(np.float64)
+    values = np.fromstring(block, dtype=res_arr.dtype, sep=' ')
+    if len(values) != count:
+        raise Exception(f'could not parse {count} .sa values, got {len(values)}')
+    res_arr[filled:filled + count] = values
+    return res_arr, filled + count
+
+
+class PFBFile:
+    """Lazy, memory-mapped access to the subgrids of a pfb file"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(infile:{self.infile!r}, shape:{self.shape!r}, " \
+               f"num_subgrids:{len(self.subgrids)!r}, index_file:{self.index_file!r}"
+
+    def __init__(self, infile, save_index=False):
+        """Scan (or load) the subgrid offset table of a pfb file, the data is only mapped, never read up front
+
+        Parameters
+        ----------
+        infile : str
+            pfb file to open
+        save_index : bool, optional
+            write the subgrid offset table next to infile (`index_file`) so later opens skip the header scan
+
+        Returns
+        -------
+        PFBFile
+        """
+        self.infile = os.fspath(Path(infile))
+        self.index_file = f'{self.infile}.idx.npy'
+        with open(self.infile, 'rb') as fp:
+            keys = ['x', 'y', 'z', 'nx', 'ny', 'nz', 'dx', 'dy', 'dz', 'num_subgrids']
+            self.header = dict(zip(keys, PFB_HEADER.unpack(fp.read(PFB_HEADER.size))))
+        self.shape = (self.header['nz'], self.header['ny'], self.header['nx'])
+        self.subgrids = self._load_index()
+        if self.subgrids is None:
+            _, self.subgrids = read_pfb_header(self.infile)
+            if save_index:
+                self._save_index()
+        self._memmap = None
+
+    def _file_stamp(self):
+        """size and modification time used to check a saved index still matches the file"""
+        stat = os.stat(self.infile)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load_index(self):
+        """load the saved subgrid offset table, if there is one and it matches the file
+
+        Returns
+        -------
+        list of tuples
+            (ix, iy, iz, nx, ny, nz, offset) for each subgrid, or None if no valid index was found
+        """
+        if not os.path.isfile(self.index_file):
+            return None
+        try:
+            index = np.load(self.index_file)
+        except (OSError, ValueError):
+            logging.warning(f'could not read pfb index {self.index_file}, rescanning {self.infile}')
+            return None
+        if list(index[0, :2]) != self._file_stamp() or index.shape[0] - 1 != self.header['num_subgrids']:
+            logging.info(f'pfb index {self.index_file} is out of date, rescanning {self.infile}')
+            return None
+        return [tuple(int(i) for i in row) for row in index[1:]]
+
+    def _save_index(self):
+        """write the subgrid offset table next to the pfb file, stamped with the file size and mtime"""
+        index = np.zeros((len(self.subgrids) + 1, 7), dtype=np.int64)
+        index[0, :2] = self._file_stamp()
+        if self.subgrids:
+            index[1:] = self.subgrids
+        try:
+            np.save(self.index_file, index)
+            logging.info(f'wrote pfb index {self.index_file}')
+        except OSError as err:
+            logging.warning(f'could not write pfb index {self.index_file}: {err}')
+
+    def subgrid(self, index):
+        """get a memory-mapped view of one subgrid, nothing is read until the view is accessed
+
+        Parameters
+        ----------
+        index : int
+            the subgrid number
+
+        Returns
+        -------
+        ndarray
+            read-only big-endian (z,y,x) view of the subgrid data
+        """
+        if self._memmap is None:
+            self._memmap = np.memmap(self.infile, dtype=np.uint8, mode='r')
+        ix, iy, iz, nx, ny, nz, offset = self.subgrids[index]
+        return np.ndarray(shape=(nz, ny, nx), dtype=PFB_DTYPE, buffer=self._memmap, offset=offset)
+
+    def read_window(self, window=None):
+        """read a region of the file, touching only the pages of the subgrids which intersect it
+
+        Parameters
+        ----------
+        window : tuple, optional
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read (Default value = None)
+
+        Returns
+        -------
+        res_arr : ndarray
+            a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+        """
+        z_0, z_end, y_0, y_end, x_0, x_end = normalize_window(window, self.shape)
+        res_arr = np.empty((z_end - z_0, y_end - y_0, x_end - x_0), dtype=np.float64)
+        for index, (ix, iy, iz, nx, ny, nz, _) in enumerate(self.subgrids):
+            # intersection of the subgrid and the window, in domain coordinates
+            sub_z0, sub_z1 = max(z_0, iz), min(z_end, iz + nz)
+            sub_y0, sub_y1 = max(y_0, iy), min(y_end, iy + ny)
+            sub_x0, sub_x1 = max(x_0, ix), min(x_end, ix + nx)
+            if sub_z0 >= sub_z1 or sub_y0 >= sub_y1 or sub_x0 >= sub_x1:
+                continue
+            res_arr[sub_z0 - z_0:sub_z1 - z_0, sub_y0 - y_0:sub_y1 - y_0, sub_x0 - x_0:sub_x1 - x_0] = \
+                self.subgrid(index)[sub_z0 - iz:sub_z1 - iz, sub_y0 - iy:sub_y1 - iy, sub_x0 - ix:sub_x1 - ix]
+        logging.info(f'read pfb window {self.infile}, (z_0,z_end,y_0,y_end,x_0,x_end)='
+                     f'{(z_0, z_end, y_0, y_end, x_0, x_end)}')
+        return res_arr
+
+    def __getitem__(self, key):
+        """read a region of the file with numpy style slicing, e.g. pfb_file[:, 10:20, 30:40]
+
+        Parameters
+        ----------
+        key : tuple
+            up to three slices (step 1) or ints in (z,y,x) order
+
+        Returns
+        -------
+        ndarray
+            the selected data, axes indexed by an int are dropped
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise IndexError(f'too many indices for pfb file: {len(key)}')
+        key = key + (slice(None),) * (3 - len(key))
+        window = []
+        squeeze_axes = []
+        for axis, (item, size) in enumerate(zip(key, self.shape)):
+            if isinstance(item, slice):
+                start, stop, step = item.indices(size)
+                if step != 1:
+                    raise IndexError('pfb file slices must have a step of 1')
+                window.extend([start, max(start, stop)])
+            else:
+                item = int(item)
+                if item < -size or item >= size:
+                    raise IndexError(f'index {item} is out of bounds for axis {axis} with size {size}')
+                item = item % size
+                window.extend([item, item + 1])
+                squeeze_axes.append(axis)
+        res_arr = self.read_window(tuple(window))
+        return np.squeeze(res_arr, axis=tuple(squeeze_axes)) if squeeze_axes else res_arr
+
+    def close(self):
+        """release the memory map, views handed out by `subgrid` keep their own reference"""
+        self._memmap = None
+
+
+def read_geotiff_window(infile, window=None):
+    """read a region of a geotif band by band, without reading the rest of the raster
+
+    Parameters
+    ----------
+    infile : str
+        the geotif to open
+    window : tuple, optional
+        (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read in PFB orientation
+        (y axis 0 at bottom), z indexes the raster bands (Default value = None)
+
+    Returns
+    -------
+    res_arr : ndarray
+        a contiguous 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+    """
+    dataset = gdal.Open(os.fspath(Path(infile)))
+    z_0, z_end, y_0, y_end, x_0, x_end = normalize_window(window, (dataset.RasterCount, dataset.RasterYSize,
+                                                                   dataset.RasterXSize))
+    # tif rows start at the top of the raster, pfb rows at the bottom
+    x_off, y_off, x_size, y_size = x_0, dataset.RasterYSize - y_end, x_end - x_0, y_end - y_0
+    dtype = gdal_dtype(dataset.GetRasterBand(1).DataType)
+    res_arr = np.empty((z_end - z_0, y_size, x_size), dtype=dtype)
+    # each band is read into one reused buffer and copied into the output with its rows reversed
+    band_arr = np.empty((y_size, x_size), dtype=dtype)
+    for z in range(z_0, z_end):
+        dataset.GetRasterBand(z + 1).ReadAsArray(x_off, y_off, x_size, y_size, buf_obj=band_arr)
+        res_arr[z - z_0] = band_arr[::-1, :]
+    logging.info(f'read geotif window {infile}, (z_0,z_end,y_0,y_end,x_0,x_end)='
+                 f'{(z_0, z_end, y_0, y_end, x_0, x_end)}')
     return res_arr
 
 
@@ -72,13 +503,100 @@ def read_geotiff(infile):
     return gdal.Open(os.fspath(file_path))
 
 
-def write_pfb(data, outfile, x0=0, y0=0, z0=0, dx=1000, dz=1000):
+class FileMetadata:
+    """Grid description of a data file, read from its headers only"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path:{self.path!r}, file_type:{self.file_type!r}, shape:{self.shape!r}, " \
+               f"dtype:{self.dtype!r}, origin:{self.origin!r}, spacing:{self.spacing!r}, " \
+               f"subgrids:{self.subgrids!r}"
+
+    def __init__(self, path, file_type, shape, dtype, origin=None, spacing=None, subgrids=None):
+        """
+
+        Parameters
+        ----------
+        path : str
+            the probed file
+        file_type : str
+            file extension without the dot ('pfb', 'tif', 'sa')
+        shape : tuple
+            (nz, ny, nx) shape of the array `read_file` returns
+        dtype : numpy.dtype
+            data type of the values in the file, None where it is only known by reading all of them (.sa)
+        origin : tuple, optional
+            (x, y, z) location of the lower left corner, None where the file has no origin
+        spacing : tuple, optional
+            (dx, dy, dz) cell size, None where the file has no spacing
+        subgrids : list, optional
+            (ix, iy, iz, nx, ny, nz, offset) of each subgrid in a pfb file
+        """
+        self.path = path
+        self.file_type = file_type
+        self.shape = shape
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.origin = origin
+        self.spacing = spacing
+        self.subgrids = subgrids
+
+
+def probe_file(infile):
+    """get the shape, data type, origin, spacing and subgrid layout of a file without reading its data
+
+    Parameters
+    ----------
+    infile : str
+        file to probe (.pfb, .sa, .tif, .tiff)
+
+    Returns
+    -------
+    FileMetadata
+        description of the grid in `infile`
+
+    Raises
+    ------
+    ValueError
+        if the file type is not supported
+    """
+    infile_path = Path(infile)
+    ext = infile_path.suffix
+    file_string_path = os.fspath(infile_path)
+    if ext in ['.tif', '.tiff']:
+        dataset = gdal.Open(file_string_path)
+        if dataset is None:
+            raise FileNotFoundError(f'could not open geotif {file_string_path}')
+        ny, nx = dataset.RasterYSize, dataset.RasterXSize
+        geo_transform = dataset.GetGeoTransform()
+        dtype = gdal_dtype(dataset.GetRasterBand(1).DataType)
+        # origin at the bottom left, matching the flipped y axis of the arrays read_file returns
+        return FileMetadata(file_string_path, 'tif', (dataset.RasterCount, ny, nx), dtype,
+                            origin=(geo_transform[0], geo_transform[3] + ny * geo_transform[5], None),
+                            spacing=(geo_transform[1], abs(geo_transform[5]), None))
+    if ext == '.sa':
+        with open(file_string_path, 'r') as fi:
+            header = fi.readline()
+        nx, ny, nz = [int(x) for x in header.strip().split(' ')]
+        # read_sa types the values by parsing all of them (int64, float64 or strings), so it is not known here
+        return FileMetadata(file_string_path, 'sa', (nz, ny, nx), None)
+    if ext == '.pfb':
+        header, subgrids = read_pfb_header(file_string_path)
+        return FileMetadata(file_string_path, 'pfb', (header['nz'], header['ny'], header['nx']), np.float64,
+                            origin=(header['x'], header['y'], header['z']),
+                            spacing=(header['dx'], header['dy'], header['dz']), subgrids=subgrids)
+    raise ValueError('can not read file type ' + ext)
+
+
+def write_pfb(data, outfile, x0=0, y0=0, z0=0, dx=1000, dz=1000, p=1, q=1, r=1, dist=False):
     """Write a 3d numpy array to a PFB output file
 
+    The data is split into p * q * r subgrids the same way ParFlow distributes a grid over its
+    Process.Topology, so ParFlow can read each process' subgrid directly from the file. With dist=True the
+    `<outfile>.dist` offsets file pfdist would create is written too, so the file does not need a pfdist pass.
+
     Parameters
     ----------
     data : ndarray
-        3d numpy data array to write to pfb !(x,y,z)!
+        3d numpy data array to write to pfb in (z,y,x) format with y axis 0 at bottom
     outfile : str
         filename and path to write output
     x0 : int, optional
@@ -91,22 +609,191 @@ def write_pfb(data, outfile, x0=0, y0=0, z0=0, dx=1000, dz=1000):
         horizontal resolution (Default value = 1000)
     dz : int, optional
         vertical resolution (Default value = 1000)
+    p : int, optional
+        number of subgrids in the x direction, Process.Topology.P (Default value = 1)
+    q : int, optional
+        number of subgrids in the y direction, Process.Topology.Q (Default value = 1)
+    r : int, optional
+        number of subgrids in the z direction, Process.Topology.R (Default value = 1)
+    dist : bool, optional
+        write the `<outfile>.dist` file with the byte offset of each subgrid (Default value = False)
 
     Returns
     -------
     None
 
+    Raises
+    ------
+    Exception
+        if the topology splits an axis into more subgrids than it has cells
+    """
+    with PFBWriter(outfile, data.shape, x0=x0, y0=y0, z0=z0, dx=dx, dz=dz, p=p, q=q, r=r, dist=dist) as writer:
+        writer.write_layers(data)
+
+
+class PFBWriter:
+    """Write a pfb file incrementally, a block of z layers at a time
+
+    The file is laid out up front (header, subgrid headers and space for the data), and each block of layers
+    is written straight into the subgrids it belongs to, so only one block has to be in memory at a time.
+    The output is identical to `write_pfb` of the whole array.
+    """
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(outfile:{self.outfile!r}, shape:{self.shape!r}, " \
+               f"topology:{self.topology!r}, next_z:{self.next_z!r}, dist:{self.dist!r})"
+
+    def __init__(self, outfile, shape, x0=0, y0=0, z0=0, dx=1000, dz=1000, p=1, q=1, r=1, dist=False):
+        """Create the pfb file and write its headers
+
+        Parameters
+        ----------
+        outfile : str
+            filename and path to write output
+        shape : tuple
+            (nz, ny, nx) dimensions of the whole file
+        x0 : int, optional
+            initial x location (Default value = 0)
+        y0 : int, optional
+            initial y location (Default value = 0)
+        z0 : int, optional
+            initial z location (Default value = 0)
+        dx : int, optional
+            horizontal resolution (Default value = 1000)
+        dz : int, optional
+            vertical resolution (Default value = 1000)
+        p : int, optional
+            number of subgrids in the x direction, Process.Topology.P (Default value = 1)
+        q : int, optional
+            number of subgrids in the y direction, Process.Topology.Q (Default value = 1)
+        r : int, optional
+            number of subgrids in the z direction, Process.Topology.R (Default value = 1)
+        dist : bool, optional
+            write the `<outfile>.dist` file with the byte offset of each subgrid on close (Default value = False)
+
+        Returns
+        -------
+        PFBWriter
+
+        Raises
+        ------
+        Exception
+            if the topology splits an axis into more subgrids than it has cells
+        """
+        nz, ny, nx = shape
+        if not (0 < p <= nx and 0 < q <= ny and 0 < r <= nz):
+            raise Exception(f'invalid topology (p,q,r)=({p},{q},{r}) for pfb data with (z,y,x)={tuple(shape)}')
+        self.outfile = outfile
+        self.shape = tuple(shape)
+        self.topology = (p, q, r)
+        self.dist = dist
+        self.next_z = 0
+        self.x_extents, self.y_extents, self.z_extents = \
+            subgrid_extents(nx, p), subgrid_extents(ny, q), subgrid_extents(nz, r)
+        # byte offset of each subgrid header, in ParFlow process rank order (x varies fastest)
+        self.offsets = []
+        offset = PFB_HEADER.size
+        for iz, sz in self.z_extents:
+            for iy, sy in self.y_extents:
+                for ix, sx in self.x_extents:
+                    self.offsets.append(offset)
+                    offset += PFB_SUBGRID_HEADER.size + sz * sy * sx * PFB_DTYPE.itemsize
+        self._buffer = np.empty(0, dtype=PFB_DTYPE)
+        self._fp = open(outfile, 'wb')
+        self._fp.write(PFB_HEADER.pack(x0, y0, z0, nx, ny, nz, dx, dx, dz, p * q * r))
+        for (ix, iy, iz, sx, sy, sz), subgrid_offset in zip(self._subgrids(), self.offsets):
+            self._fp.seek(subgrid_offset)
+            self._fp.write(PFB_SUBGRID_HEADER.pack(ix, iy, iz, sx, sy, sz, 0, 0, 0))
+        # the data is filled in by write_layers
+        self._fp.truncate(offset)
+
+    def _subgrids(self):
+        """(ix, iy, iz, nx, ny, nz) of each subgrid, in the order of `offsets`"""
+        return [(ix, iy, iz, sx, sy, sz) for iz, sz in self.z_extents for iy, sy in self.y_extents
+                for ix, sx in self.x_extents]
+
+    def write_layers(self, data):
+        """write the next block of z layers
+
+        Parameters
+        ----------
+        data : ndarray
+            3d (z,y,x) block of layers following the ones already written, with the y and x size of the file
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        Exception
+            if the block does not match the file's y and x size, or runs past its last layer
+        """
+        nz, ny, nx = self.shape
+        num_layers = data.shape[0]
+        if data.shape[1:] != (ny, nx) or self.next_z + num_layers > nz:
+            raise Exception(f'can not write (z,y,x)={data.shape} at layer {self.next_z} of pfb file {self.outfile} '
+                            f'with (z,y,x)={self.shape}')
+        z_a, z_b = self.next_z, self.next_z + num_layers
+        # the first subgrid is the largest, so one scratch buffer holds the big-endian copy of any part of a block
+        needed = min(num_layers, self.z_extents[0][1]) * self.y_extents[0][1] * self.x_extents[0][1]
+        if self._buffer.size < needed:
+            self._buffer = np.empty(needed, dtype=PFB_DTYPE)
+        for (ix, iy, iz, sx, sy, sz), offset in zip(self._subgrids(), self.offsets):
+            lo, hi = max(z_a, iz), min(z_b, iz + sz)
+            if lo >= hi:
+                continue
+            # layers of a subgrid are contiguous, so the part of the block in this subgrid is a single write
+            block = self._buffer[:(hi - lo) * sy * sx].reshape(hi - lo, sy, sx)
+            np.copyto(block, data[lo - z_a:hi - z_a, iy:iy + sy, ix:ix + sx], casting='unsafe')
+            self._fp.seek(offset + PFB_SUBGRID_HEADER.size + (lo - iz) * sy * sx * PFB_DTYPE.itemsize)
+            block.tofile(self._fp)
+        self.next_z = z_b
+
+    def close(self):
+        """finish the file, and write the .dist file if requested
+
+        Raises
+        ------
+        Exception
+            if not all of the layers were written
+        """
+        self._fp.close()
+        if self.next_z != self.shape[0]:
+            raise Exception(f'pfb file {self.outfile} was closed after {self.next_z} of {self.shape[0]} layers')
+        if self.dist:
+            # one line per process rank, the position of its subgrid header in the pfb file
+            with open(f'{self.outfile}.dist', 'w') as fp:
+                fp.write(''.join(f'{offset}\n' for offset in self.offsets))
+        logging.info(f'wrote pfb file {self.outfile}, (z,y,x)={self.shape}, (p,q,r)={self.topology}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fp.close()
+
+
+def subgrid_extents(n, num_subgrids):
+    """split an axis of n cells into subgrids the way ParFlow distributes it over processes
+
+    Parameters
+    ----------
+    n : int
+        number of cells along the axis
+    num_subgrids : int
+        number of subgrids (processes) along the axis, the P, Q or R of Process.Topology
+
+    Returns
+    -------
+    list of tuples
+        (start, size) of each subgrid along the axis, the first n % num_subgrids subgrids get one extra cell
     """
-    logging.info(f'wrote pfb file {outfile}, (z,y,x)={data.shape}')
-    pf_data = PFData()
-    pf_data.setDataArray(data)
-    pf_data.setDX(dx)
-    pf_data.setDY(dx)
-    pf_data.setDZ(dz)
-    pf_data.setX(x0)
-    pf_data.setY(y0)
-    pf_data.setZ(z0)
-    pf_data.writeFile(outfile)
+    size, extra = divmod(n, num_subgrids)
+    return [(i * size + min(i, extra), size + (1 if i < extra else 0)) for i in range(num_subgrids)]
 
 
 def write_bbox(bbox, outfile):
@@ -151,7 +838,68 @@ def read_bbox(bbox_file):
         return bbox.get_human_bbox()
 
 
-def write_array_to_geotiff(out_raster_path, data, geo_transform, projection, dtype=gdal.GDT_Float64, no_data=NO_DATA):
+def output_dtype(dtype, no_data=NO_DATA):
+    """get the dtype for clipped data, the input dtype unless it is an integer type which can not hold no_data
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        data type of the input data
+    no_data : int, optional
+        no data value written into the output (Default value = NO_DATA)
+
+    Returns
+    -------
+    numpy.dtype
+        data type for the clipped output
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'fcO' or np.can_cast(np.min_scalar_type(no_data), dtype):
+        return dtype
+    return np.result_type(dtype, np.min_scalar_type(no_data))
+
+
+def gdal_dtype(data_type):
+    """get the numpy dtype to read a gdal raster band data type into
+
+    Parameters
+    ----------
+    data_type : int
+        gdal data type code of the raster band
+
+    Returns
+    -------
+    numpy.dtype
+        the matching numpy dtype
+
+    Raises
+    ------
+    Exception
+        if the data type has no numpy dtype in GDAL_DTYPES, such as the complex types
+    """
+    type_name = gdal.GetDataTypeName(data_type)
+    if type_name not in GDAL_DTYPES:
+        raise Exception(f'unsupported geotif data type {type_name}')
+    return np.dtype(GDAL_DTYPES[type_name])
+
+
+def gdal_type_code(dtype):
+    """get the gdal data type to store a numpy dtype in a geotif
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        data type of the array to write
+
+    Returns
+    -------
+    int
+        gdal data type code, gdal.GDT_Float64 for dtypes geotifs can not hold
+    """
+    return GDAL_TYPE_CODES.get(np.dtype(dtype), gdal.GDT_Float64)
+
+
+def write_array_to_geotiff(out_raster_path, data, geo_transform, projection, dtype=None, no_data=NO_DATA):
     """write a numpy array to a geotiff
 
     Parameters
@@ -165,7 +913,7 @@ def write_array_to_geotiff(out_raster_path, data, geo_transform, projection, dty
     projection : str
         srs wkt formatted Projection to use for the geoTif
     dtype : gdal.datatype, optional
-        gdal datatype to use for the geoTif (Default value = gdal.GDT_Float64)
+        gdal datatype to use for the geoTif, None for the type matching the dtype of `data` (Default value = None)
     no_data : int, optional
         no data value to encode in the geoTif (Default value = NO_DATA)
 
@@ -174,21 +922,89 @@ def write_array_to_geotiff(out_raster_path, data, geo_transform, projection, dty
     None
 
     """
-    # flip the tif y axis back to tif standard (Tif 0's start at top left, PFB 0's at bottom left)
-    data = np.flip(data, axis=1)
-    data = np.ascontiguousarray(data, dtype=np.float64)
-    driver = gdal.GetDriverByName('GTiff')
-    no_bands, rows, cols = data.shape
-    data_set = driver.Create(out_raster_path, xsize=cols, ysize=rows, bands=no_bands, eType=dtype,
-                             options=['COMPRESS=LZW', 'NUM_THREADS=ALL_CPUS'])
-    data_set.SetGeoTransform(geo_transform)
-    data_set.SetProjection(projection)
-    for i, image in enumerate(data, 1):
-        data_set.GetRasterBand(i).WriteArray(image)
-        data_set.GetRasterBand(i).SetNoDataValue(no_data)
-    logging.info(f'wrote geotif {out_raster_path}, (bands,rows,cols)=({no_bands}, {rows}, {cols})')
-    # noinspection PyUnusedLocal
-    data_set = None
+    if dtype is None:
+        dtype = gdal_type_code(data.dtype)
+    writer = GeotiffWriter(out_raster_path, data.shape, geo_transform, projection, dtype=dtype, no_data=no_data)
+    writer.write_layers(data)
+    writer.close()
+
+
+class GeotiffWriter:
+    """Write a geotiff incrementally, a block of bands at a time"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(out_raster_path:{self.out_raster_path!r}, shape:{self.shape!r}, " \
+               f"next_band:{self.next_band!r}, no_data:{self.no_data!r})"
+
+    def __init__(self, out_raster_path, shape, geo_transform, projection, dtype=gdal.GDT_Float64, no_data=NO_DATA):
+        """Create the geotiff
+
+        Parameters
+        ----------
+        out_raster_path : str
+            where to write the output file
+        shape : tuple
+            (bands, rows, cols) dimensions of the whole file
+        geo_transform : list of ints
+            gdal formatted geoTransform to use for the geoTif
+        projection : str
+            srs wkt formatted Projection to use for the geoTif
+        dtype : gdal.datatype, optional
+            gdal datatype to use for the geoTif (Default value = gdal.GDT_Float64)
+        no_data : int, optional
+            no data value to encode in the geoTif (Default value = NO_DATA)
+
+        Returns
+        -------
+        GeotiffWriter
+        """
+        self.out_raster_path = out_raster_path
+        self.shape = tuple(shape)
+        self.no_data = no_data
+        self.next_band = 0
+        no_bands, rows, cols = self.shape
+        driver = gdal.GetDriverByName('GTiff')
+        self._data_set = driver.Create(out_raster_path, xsize=cols, ysize=rows, bands=no_bands, eType=dtype,
+                                       options=['COMPRESS=LZW', 'NUM_THREADS=ALL_CPUS'])
+        self._data_set.SetGeoTransform(geo_transform)
+        self._data_set.SetProjection(projection)
+
+    def write_layers(self, data):
+        """write the next block of bands
+
+        Parameters
+        ----------
+        data : ndarray
+            3d (z,y,x) block of layers in PFB orientation following the bands already written
+
+        Returns
+        -------
+        None
+        """
+        if data.shape[1:] != self.shape[1:] or self.next_band + data.shape[0] > self.shape[0]:
+            raise Exception(f'can not write (z,y,x)={data.shape} at band {self.next_band} of geotif '
+                            f'{self.out_raster_path} with (bands,rows,cols)={self.shape}')
+        for image in data:
+            self.next_band += 1
+            # flip the tif y axis back to tif standard (Tif 0's start at top left, PFB 0's at bottom left),
+            # only one band at a time is copied to contiguous memory for gdal
+            band = self._data_set.GetRasterBand(self.next_band)
+            band.WriteArray(np.ascontiguousarray(image[::-1, :]))
+            band.SetNoDataValue(self.no_data)
+
+    def close(self):
+        """flush the geotiff to disk
+
+        Raises
+        ------
+        Exception
+            if not all of the bands were written
+        """
+        self._data_set = None
+        if self.next_band != self.shape[0]:
+            raise Exception(f'geotif {self.out_raster_path} was closed after {self.next_band} of {self.shape[0]} '
+                            f'bands')
+        logging.info(f'wrote geotif {self.out_raster_path}, (bands,rows,cols)={self.shape}')
 
 
 def write_array_to_simple_ascii(data, out_file):
@@ -206,31 +1022,79 @@ def write_array_to_simple_ascii(data, out_file):
     None
 
     """
-    write_array_to_text_file(out_file=out_file, data=data.flatten(), fmt='%s',
+    write_array_to_text_file(out_file=out_file, data=data.ravel(), fmt='%s',
                              header=f'{data.shape[2]} {data.shape[1]} {data.shape[0]}')
 
 
-def write_array_to_text_file(data, out_file, header, fmt, delimiter=' ', comments=''):
+def write_array_to_text_file(data, out_file, header, fmt, delimiter=' ', comments='', chunk_rows=TEXT_CHUNK_ROWS):
     """write a flattened array to text output file
 
+    The output is the same as np.savetxt, but each block of chunk_rows rows is formatted with a single
+    string format operation and written at once, so memory use is bounded by the block size. Values are formatted
+    from the array's own dtype, as np.savetxt does, so float32 data prints as 0.1 rather than 0.10000000149011612.
+
     Parameters
     ----------
     data : ndarray
-        the 1d numpy array of data to write
+        the 1d (one value per row) or 2d numpy array of data to write
     out_file : str
         where to write the data
     header : str
         the header to use in the file
-    fmt : str
-        the python string format to use for printing each element of the array
+    fmt : str or list
+        the python string format to use for printing each element of the array, or one format per column
     delimiter : str, optional
         the delimiter character to use when writing the elements (optional) (Default value = ' ')
     comments : str, optional
         the comment character to write for header (optional) (Default value = '')
+    chunk_rows : int, optional
+        number of rows formatted and written at a time (optional) (Default value = TEXT_CHUNK_ROWS)
 
     Returns
     -------
     None
 
     """
-    np.savetxt(fname=out_file, X=data, delimiter=delimiter, comments=comments, header=header, fmt=fmt)
+    with open(out_file, 'w') as fo:
+        if header:
+            fo.write(comments + header.replace('\n', '\n' + comments) + '\n')
+        write_text_rows(fo, data, fmt, delimiter=delimiter, chunk_rows=chunk_rows)
+
+
+def write_text_rows(fo, data, fmt, delimiter=' ', chunk_rows=TEXT_CHUNK_ROWS):
+    """write the rows of an array to an open text file, a block of chunk_rows rows at a time
+
+    Parameters
+    ----------
+    fo : file
+        text file open for writing
+    data : ndarray
+        the 1d (one value per row) or 2d numpy array of data to write
+    fmt : str or list
+        the python string format to use for printing each element of the array, or one format per column
+    delimiter : str, optional
+        the delimiter character to use when writing the elements (Default value = ' ')
+    chunk_rows : int, optional
+        number of rows formatted and written at a time (Default value = TEXT_CHUNK_ROWS)
+
+    Returns
+    -------
+    None
+    """
+    data = np.asarray(data)
+    rows = data.reshape(data.shape[0], -1) if data.ndim > 1 else data.reshape(-1, 1)
+    num_cols = rows.shape[1]
+    if isinstance(fmt, str):
+        row_fmt = delimiter.join([fmt] * num_cols) if fmt.count('%') == 1 else fmt
+    else:
+        if len(fmt) != num_cols:
+            raise ValueError(f'got {len(fmt)} formats for {num_cols} columns')
+        row_fmt = delimiter.join(fmt)
+    row_fmt += '\n'
+    # python ints and floats print the same as the numpy scalars they come from, except for floats which are not
+    # float64, those are kept as numpy scalars so '%s' prints them at their own precision
+    as_scalars = rows.dtype.kind in 'fc' and np.finfo(rows.dtype).bits != 64
+    for start in range(0, rows.shape[0], chunk_rows):
+        block = rows[start:start + chunk_rows]
+        values = tuple(block.ravel()) if as_scalars else tuple(block.ravel().tolist())
+        fo.write((row_fmt * block.shape[0]) % values)
@@ -0,0 +1,250 @@
+"""Chunked on-disk tile stores of gridded inputs, for fast windowed reads
+
+A tile store is a folder holding one .npy (or compressed .npz) block per fixed size xy tile of a data file, with
+every z layer, in the (z,y,x) PFB orientation `read_file` returns, plus an index.yaml describing the grid.
+"""
+import os
+import logging
+from pathlib import Path
+import numpy as np
+import yaml
+import parflow.subset.utils.io as file_io_tools
+
+TILE_INDEX = 'index.yaml'
+DEFAULT_TILE_SIZE = 256
+
+
+class TileStore:
+    """Windowed reads from a folder of xy tiles"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(store_path:{self.store_path!r}, shape:{self.shape!r}, " \
+               f"dtype:{self.dtype!r}, tile_size:{self.tile_size!r}, compressed:{self.compressed!r})"
+
+    def __init__(self, store_path):
+        """Open an existing tile store
+
+        Parameters
+        ----------
+        store_path : str
+            folder of the tile store, as written by `write_tile_store`
+
+        Returns
+        -------
+        TileStore
+        """
+        self.store_path = os.fspath(store_path)
+        with open(os.path.join(self.store_path, TILE_INDEX), 'r') as index_file:
+            self.index = yaml.safe_load(index_file)
+        self.shape = tuple(self.index['shape'])
+        self.dtype = np.dtype(self.index['dtype'])
+        self.tile_size = self.index['tile_size']
+        self.compressed = self.index['compressed']
+
+    def is_current(self, infile):
+        """check the store was converted from the current version of infile
+
+        Parameters
+        ----------
+        infile : str
+            the data file the store was converted from
+
+        Returns
+        -------
+        bool
+            True if infile exists and has the size and modification time recorded when the store was written
+        """
+        if not os.path.isfile(infile):
+            return False
+        return list(_file_stamp(infile)) == list(self.index['source_stamp'])
+
+    def tile_file(self, tile_y, tile_x):
+        """path of the tile in tile row tile_y, tile column tile_x"""
+        return os.path.join(self.store_path, f'tile_{tile_y}_{tile_x}.{"npz" if self.compressed else "npy"}')
+
+    def tile_shape(self, tile_y, tile_x):
+        """(nz, ny, nx) shape of the tile in tile row tile_y, tile column tile_x, edge tiles may be smaller"""
+        nz, ny, nx = self.shape
+        size = self.tile_size
+        return nz, min(size, ny - tile_y * size), min(size, nx - tile_x * size)
+
+    def read_tile(self, tile_y, tile_x):
+        """load a single tile, raw tiles are memory-mapped so only the rows used are read
+
+        Returns
+        -------
+        ndarray
+            (nz, tile ny, tile nx) data of the tile
+        """
+        tile_file = self.tile_file(tile_y, tile_x)
+        if self.compressed:
+            with np.load(tile_file) as tile_data:
+                tile = tile_data['data']
+        else:
+            tile = np.load(tile_file, mmap_mode='r')
+        # string tiles are saved at their own width, the index holds the widest
+        dtype_ok = tile.dtype == self.dtype or (self.index.get('object_strings') and tile.dtype.kind == self.dtype.kind)
+        if tuple(tile.shape) != self.tile_shape(tile_y, tile_x) or not dtype_ok:
+            raise Exception(f'tile {tile_file} has shape {tile.shape} and dtype {tile.dtype}, the index expects '
+                            f'{self.tile_shape(tile_y, tile_x)} and {self.dtype}, rewrite the tile store')
+        return tile
+
+    def read_window(self, window=None):
+        """read a region of the stored data, touching only the tiles which intersect it
+
+        Parameters
+        ----------
+        window : tuple, optional
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read (Default value = None)
+
+        Returns
+        -------
+        res_arr : ndarray
+            a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+        """
+        z_0, z_end, y_0, y_end, x_0, x_end = file_io_tools.normalize_window(window, self.shape)
+        res_arr = np.empty((z_end - z_0, y_end - y_0, x_end - x_0), dtype=self.dtype)
+        if res_arr.size == 0:
+            return res_arr
+        size = self.tile_size
+        for tile_y in range(y_0 // size, (y_end - 1) // size + 1):
+            for tile_x in range(x_0 // size, (x_end - 1) // size + 1):
+                tile = self.read_tile(tile_y, tile_x)
+                # overlap of the window and the tile, in full grid coordinates
+                ty_0, ty_end = max(y_0, tile_y * size), min(y_end, (tile_y + 1) * size)
+                tx_0, tx_end = max(x_0, tile_x * size), min(x_end, (tile_x + 1) * size)
+                res_arr[:, ty_0 - y_0:ty_end - y_0, tx_0 - x_0:tx_end - x_0] = \
+                    tile[z_0:z_end, ty_0 - tile_y * size:ty_end - tile_y * size,
+                         tx_0 - tile_x * size:tx_end - tile_x * size]
+        logging.info(f'read tile store window {self.store_path}, (z_0,z_end,y_0,y_end,x_0,x_end)='
+                     f'{(z_0, z_end, y_0, y_end, x_0, x_end)}')
+        if self.index.get('object_strings'):
+            # strings are stored fixed width so tiles can be memory-mapped, read_file returns them as objects
+            res_arr = res_arr.astype(object)
+        return res_arr
+
+
+class TileReader:
+    """Read data files through their tile stores in a folder when one is present, falling back to `read_file`"""
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(tile_path:{self.tile_path!r})"
+
+    def __init__(self, tile_path):
+        """
+
+        Parameters
+        ----------
+        tile_path : str
+            folder holding one tile store per data file, named after the data file
+
+        Returns
+        -------
+        TileReader
+        """
+        self.tile_path = os.fspath(tile_path)
+
+    def store_path(self, infile):
+        """folder of the tile store for infile"""
+        return os.path.join(self.tile_path, Path(infile).name)
+
+    def get_store(self, infile):
+        """get the tile store for infile
+
+        Parameters
+        ----------
+        infile : str
+            data file to look up
+
+        Returns
+        -------
+        TileStore
+            the store converted from the current infile, or None if there is none
+        """
+        store_path = self.store_path(infile)
+        if not os.path.isfile(os.path.join(store_path, TILE_INDEX)):
+            return None
+        store = TileStore(store_path)
+        if not store.is_current(infile):
+            logging.warning(f'tile store {store_path} is out of date with {infile}, reading the file instead')
+            return None
+        return store
+
+    def __call__(self, infile, window=None):
+        """read a window of infile, from its tile store if there is one
+
+        Parameters
+        ----------
+        infile : str
+            data file to read
+        window : tuple, optional
+            (z_0, z_end, y_0, y_end, x_0, x_end) 0-based, end-exclusive region to read (Default value = None)
+
+        Returns
+        -------
+        ndarray
+            a 3d numpy array with the window data in (z,y,x) format with y axis 0 at bottom
+        """
+        store = self.get_store(infile)
+        if store is None:
+            return file_io_tools.read_file(infile, window=window)
+        return store.read_window(window)
+
+
+def write_tile_store(infile, store_path, tile_size=DEFAULT_TILE_SIZE, compress=False):
+    """convert a data file to a tile store
+
+    Parameters
+    ----------
+    infile : str
+        data file to convert (.pfb, .tif, .sa)
+    store_path : str
+        folder to write the tiles and index to
+    tile_size : int, optional
+        x and y size of the tiles (Default value = DEFAULT_TILE_SIZE)
+    compress : bool, optional
+        write compressed .npz tiles instead of raw .npy tiles (Default value = False)
+
+    Returns
+    -------
+    TileStore
+        the written store
+    """
+    os.makedirs(store_path, exist_ok=True)
+    shape = file_io_tools.probe_file(infile).shape
+    nz, ny, nx = shape
+    # .sa files are text and can not be read by window without scanning, read them once
+    full_data = file_io_tools.read_file(infile) if Path(infile).suffix == '.sa' else None
+    dtype = None
+    object_strings = False
+    for tile_y in range((ny + tile_size - 1) // tile_size):
+        y_0, y_end = tile_y * tile_size, min((tile_y + 1) * tile_size, ny)
+        # one row of tiles is held in memory at a time
+        if full_data is None:
+            strip = file_io_tools.read_file(infile, window=(None, None, y_0, y_end, None, None))
+        else:
+            strip = full_data[:, y_0:y_end, :]
+        if strip.dtype == object:
+            strip = strip.astype(str)
+            object_strings = True
+        for tile_x in range((nx + tile_size - 1) // tile_size):
+            tile = np.ascontiguousarray(strip[:, :, tile_x * tile_size:(tile_x + 1) * tile_size])
+            tile_file = os.path.join(store_path, f'tile_{tile_y}_{tile_x}')
+            if compress:
+                np.savez_compressed(tile_file, data=tile)
+            else:
+                np.save(tile_file, tile)
+            dtype = tile.dtype if dtype is None else np.promote_types(dtype, tile.dtype)
+    index = {'source': Path(infile).name, 'source_stamp': list(_file_stamp(infile)), 'shape': list(shape),
+             'dtype': np.dtype(dtype).str, 'tile_size': tile_size, 'compressed': bool(compress),
+             'object_strings': object_strings}
+    with open(os.path.join(store_path, TILE_INDEX), 'w') as index_file:
+        yaml.safe_dump(index, index_file)
+    logging.info(f'wrote tile store {store_path} from {infile}, (z,y,x)={shape}, tile_size={tile_size}')
+    return TileStore(store_path)
+
+
+def _file_stamp(infile):
+    """size and modification time used to check a tile store still matches its source file"""
+    stat = os.stat(infile)
+    return stat.st_size, stat.st_mtime_ns
@@ -19,7 +19,7 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
-    install_requires=['pyyaml>=5.3.0', 'pandas>=1.0', 'parflowio'],
+    install_requires=['pyyaml>=5.3.0', 'parflowio'],
     namespace_packages=['parflow'],
     package_data={
         # Include any *.yaml, *.tcl files found in the "data" subdirectory
@@ -4,7 +4,7 @@ from pathlib import Path
 
 from parflow.subset.tools import bulk_clipper
 from tests import test_files
-from parflow.subset.utils.io import read_file
+from parflow.subset.utils.io import read_file, read_pfb_header, write_pfb
 import numpy as np
 import os
 
@@ -64,6 +64,34 @@ class BulkClipperArgParseTests(unittest.TestCase):
         self.assertFalse(args.ref_file)
         self.assertFalse(args.write_tifs)
         self.assertTrue(args.write_pfbs)
+        self.assertEqual(args.workers, 1)
+        self.assertEqual(args.read_ahead, 0)
+        self.assertEqual(args.writers, 2)
+        self.assertIsNone(args.tif_dtype)
+        self.assertEqual(args.slab_size, 0)
+
+    def test_cli_tif_dtype(self):
+        args = bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', self.good_input_file_list[0], '-t',
+                                        '--tif-dtype', 'float32'])
+        self.assertEqual('float32', args.tif_dtype)
+        with self.assertRaises(SystemExit):
+            bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', self.good_input_file_list[0],
+                                     '--tif-dtype', 'float16'])
+
+    def test_cli_workers(self):
+        args = bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', self.good_input_file_list[0], '-w', '4'])
+        self.assertEqual(args.workers, 4)
+
+    def test_cli_workers_at_least_one(self):
+        with self.assertRaises(SystemExit):
+            bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', test_files.forcings_pfb.as_posix(), '-w', '0'])
+        with self.assertRaises(SystemExit):
+            bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', test_files.forcings_pfb.as_posix(),
+                                     '--writers', '0'])
+        with self.assertRaises(SystemExit):
+            bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', test_files.forcings_pfb.as_posix(), '-s', '0'])
+        args = bulk_clipper.parse_args(['-m', self.good_mask_file, '-d', test_files.forcings_pfb.as_posix(), '-s', '1'])
+        self.assertEqual(1, args.slab_size)
 
     def test_cli_good_dims_and_input_defaults(self):
         args = bulk_clipper.parse_args(['-l', '10', '20', '30', '40', '-d', self.good_input_file_list[0]])
@@ -88,6 +116,11 @@ class BulkClipperArgParseTests(unittest.TestCase):
         self.assertFalse(args.write_tifs)
         self.assertTrue(args.write_pfbs)
 
+    def test_cli_many_masks(self):
+        argstring = f'-m {self.good_mask_file} -m {self.good_mask_file} -g input_pattern*.pfb'
+        args = bulk_clipper.parse_args(argstring.split(' '))
+        self.assertEqual([os.fspath(self.good_mask_file)] * 2, args.mask_file)
+
     def test_mutual_exclusive_file_pattern_glob(self):
         argstring = f'-m {self.good_mask_file} -d {self.good_input_file_list[0]} -g input_pattern*.pfb'
         with self.assertRaises(SystemExit):
@@ -96,7 +129,7 @@ class BulkClipperArgParseTests(unittest.TestCase):
     def test_file_pattern_glob(self):
         argstring = f'-m {self.good_mask_file} -g input_pattern*.pfb'
         args = bulk_clipper.parse_args(argstring.split(' '))
-        self.assertEqual(os.fspath(self.good_mask_file), args.mask_file)
+        self.assertEqual([os.fspath(self.good_mask_file)], args.mask_file)
         self.assertFalse(args.bbox_file)
         self.assertFalse(args.bbox_def)
         self.assertTrue(args.glob_pattern)
@@ -120,6 +153,29 @@ class BulkClipperUnitTests(unittest.TestCase):
         files = bulk_clipper.get_file_list(Path('.'))
         self.assertCountEqual([], list(files))
 
+    def test_check_same_grid(self):
+        self.assertIsNone(bulk_clipper.check_same_grid([test_files.forcings_pfb, test_files.forcings_sa,
+                                                        test_files.forcings_tif]))
+        with self.assertRaises(Exception):
+            bulk_clipper.check_same_grid([test_files.forcings_pfb, test_files.huc10190004.get('conus1_mask')])
+
+    def test_check_same_grid_nz(self):
+        shallow_file = './test_nz.pfb'
+        write_pfb(read_file(test_files.forcings_pfb)[:2], shallow_file)
+        # the number of layers may differ when the clipper clips every layer of each file
+        self.assertIsNone(bulk_clipper.check_same_grid([test_files.forcings_pfb, shallow_file]))
+        self.assertIsNone(bulk_clipper.check_same_grid(
+            [test_files.forcings_pfb, shallow_file], bulk_clipper.BoxClipper(ref_array=None, nx=20, ny=15, nz=2)))
+        with self.assertRaises(Exception) as context:
+            bulk_clipper.check_same_grid([test_files.forcings_pfb, shallow_file],
+                                         bulk_clipper.BoxClipper(ref_array=None, nx=20, ny=15, nz=24))
+        self.assertIn('nz=2', str(context.exception))
+        # a box clip spans every layer of its inputs
+        with self.assertRaises(Exception):
+            bulk_clipper.box_clip((5, 10, 20, 15), [shallow_file, test_files.forcings_pfb.as_posix()])
+        self.assertFalse(os.path.exists('./test_nz_clip.pfb'))
+        os.remove(shallow_file)
+
     def test_get_files_glob(self):
         test_dir = Path('./test_outputs')
         test_dir.mkdir(exist_ok=True)
@@ -186,6 +242,85 @@ class BulkClipperRegressionTests(unittest.TestCase):
         self.assertIsNone(np.testing.assert_array_equal(ref_data, written_data))
         os.remove('./CONUS2.0_RawDEM_CONUS1clip_clip.pfb')
 
+    def test_multi_mask_clip(self):
+        mask = test_files.huc10190004.get('conus1_mask').as_posix()
+        out_dirs = [Path('./test_outputs_multi_a'), Path('./test_outputs_multi_b')]
+        for out_dir in out_dirs:
+            out_dir.mkdir(exist_ok=True)
+        bulk_clipper.multi_mask_clip([mask, mask], self.good_input_file_list[:1], out_dirs)
+        ref_data = read_file(test_files.huc10190004.get('conus1_dem').as_posix())
+        for out_dir in out_dirs:
+            written_data = read_file(os.fspath(out_dir / 'CONUS2.0_RawDEM_CONUS1clip_clip.pfb'))
+            self.assertIsNone(np.testing.assert_array_equal(ref_data, written_data))
+            shutil.rmtree(out_dir)
+
+    def test_mask_clip_parallel(self):
+        mask = test_files.huc10190004.get('conus1_mask').as_posix()
+        out_dir = Path('./test_outputs_parallel')
+        out_dir.mkdir(exist_ok=True)
+        bulk_clipper.mask_clip(mask, self.good_input_file_list, out_dir.as_posix(), workers=2)
+        ref_data = read_file(test_files.huc10190004.get('conus1_dem').as_posix())
+        written_data = read_file(os.fspath(out_dir / 'CONUS2.0_RawDEM_CONUS1clip_clip.pfb'))
+        self.assertIsNone(np.testing.assert_array_equal(ref_data, written_data))
+        self.assertTrue((out_dir / 'Domain_Blank_Mask_clip.pfb').exists())
+        shutil.rmtree(out_dir)
+
+    def test_mask_clip_read_ahead(self):
+        mask = test_files.huc10190004.get('conus1_mask').as_posix()
+        out_dir = Path('./test_outputs_read_ahead')
+        out_dir.mkdir(exist_ok=True)
+        bulk_clipper.mask_clip(mask, self.good_input_file_list, out_dir.as_posix(), read_ahead=1, writers=2)
+        ref_data = read_file(test_files.huc10190004.get('conus1_dem').as_posix())
+        written_data = read_file(os.fspath(out_dir / 'CONUS2.0_RawDEM_CONUS1clip_clip.pfb'))
+        self.assertIsNone(np.testing.assert_array_equal(ref_data, written_data))
+        self.assertTrue((out_dir / 'Domain_Blank_Mask_clip.pfb').exists())
+        shutil.rmtree(out_dir)
+
+    def test_box_clip_slabs(self):
+        out_dir = Path('./test_outputs_slabs')
+        out_dir.mkdir(exist_ok=True)
+        bulk_clipper.box_clip((5, 10, 20, 15), [test_files.forcings_pfb.as_posix()])
+        bulk_clipper.box_clip((5, 10, 20, 15), [test_files.forcings_pfb.as_posix()], out_dir.as_posix(),
+                              slab_size=5)
+        ref_data = read_file('./NLDAS.Temp.000001_to_000024_clip.pfb')
+        written_data = read_file(os.fspath(out_dir / 'NLDAS.Temp.000001_to_000024_clip.pfb'))
+        self.assertIsNone(np.testing.assert_array_equal(ref_data, written_data))
+        os.remove('./NLDAS.Temp.000001_to_000024_clip.pfb')
+        shutil.rmtree(out_dir)
+
+    def test_clip_inputs_reports_failed_files(self):
+        out_dir = Path('./test_outputs_failures')
+        out_dir.mkdir(exist_ok=True)
+        clipper = bulk_clipper.BoxClipper(ref_array=read_file(self.good_input_file_list[0]), x=1040, y=717,
+                                          nx=85, ny=30)
+        with self.assertRaises(Exception) as context:
+            bulk_clipper.clip_inputs(clipper, self.good_input_file_list[:1] + [self.bad_input_file_list],
+                                     out_dir.as_posix())
+        self.assertIn(self.bad_input_file_list, str(context.exception))
+        # the good file is still clipped
+        self.assertTrue((out_dir / 'CONUS2.0_RawDEM_CONUS1clip_clip.pfb').exists())
+        shutil.rmtree(out_dir)
+
+    def test_clip_inputs_multi_options_and_failures(self):
+        out_dirs = [Path('./test_outputs_multi_options_a'), Path('./test_outputs_multi_options_b')]
+        for out_dir in out_dirs:
+            out_dir.mkdir(exist_ok=True)
+        clippers = [bulk_clipper.BoxClipper(ref_array=None, x=5, y=10, nx=20, ny=15, nz=24),
+                    bulk_clipper.BoxClipper(ref_array=None, x=1, y=1, nx=8, ny=6, nz=24)]
+        with self.assertRaises(Exception) as context:
+            bulk_clipper.clip_inputs_multi(clippers, [test_files.forcings_pfb.as_posix(), self.bad_input_file_list],
+                                           [out_dir.as_posix() for out_dir in out_dirs], topology=(2, 1, 1),
+                                           dist=True)
+        self.assertIn(self.bad_input_file_list, str(context.exception))
+        # the good file is still clipped by every clipper, with the pfb options
+        for out_dir, clipper in zip(out_dirs, clippers):
+            clip_file = out_dir / 'NLDAS.Temp.000001_to_000024_clip.pfb'
+            self.assertTrue(Path(f'{clip_file}.dist').exists())
+            self.assertEqual(2, read_pfb_header(clip_file.as_posix())[0]['num_subgrids'])
+            ref_data = clipper.subset_file(test_files.forcings_pfb.as_posix())[0]
+            self.assertIsNone(np.testing.assert_array_equal(ref_data, read_file(clip_file.as_posix())))
+            shutil.rmtree(out_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,6 @@
 import contextlib
 import unittest
-from parflow.subset.clipper import MaskClipper, BoxClipper
+from parflow.subset.clipper import MaskClipper, BoxClipper, MultiClipper
 import parflow.subset.utils.io as file_io_tools
 from parflow.subset.mask import SubsetMask
 import numpy as np
@@ -54,6 +54,83 @@ class RegressionClipTests(unittest.TestCase):
                                  'Subset writes correct bounding box file')
         os.remove('bbox_conus2_full.txt')
 
+    def test_subset_file_matches_full_read(self):
+        data_array = file_io_tools.read_file(test_files.conus1_dem.as_posix())
+        my_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        clipper = MaskClipper(subset_mask=my_mask, no_data_threshold=-1)
+        full_subset, full_geom, _, full_bbox = clipper.subset(data_array)
+        window_subset, window_geom, _, window_bbox = clipper.subset_file(test_files.conus1_dem.as_posix())
+        self.assertIsNone(np.testing.assert_array_equal(full_subset, window_subset))
+        self.assertSequenceEqual(full_geom, window_geom)
+        self.assertSequenceEqual(full_bbox, window_bbox)
+
+    def test_subset_reuses_out_array(self):
+        my_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        clipper = MaskClipper(subset_mask=my_mask, no_data_threshold=-1)
+        first_subset, _, _, _ = clipper.subset_file(test_files.conus1_dem.as_posix())
+        expected = first_subset.copy()
+        second_subset, _, _, _ = clipper.subset_file(test_files.conus1_dem.as_posix(), out=first_subset)
+        self.assertIs(first_subset, second_subset, 'a matching out array is filled in place')
+        self.assertIsNone(np.testing.assert_array_equal(expected, second_subset))
+        other_subset, _, _, _ = clipper.subset_file(test_files.conus1_dem.as_posix(), out=np.empty((1, 2, 2)))
+        self.assertIsNone(np.testing.assert_array_equal(expected, other_subset),
+                          'an out array of the wrong shape is replaced')
+
+    def test_box_subset_file_matches_full_read(self):
+        data_array = file_io_tools.read_file(test_files.forcings_pfb.as_posix())
+        box_clipper = BoxClipper(ref_array=data_array, x=5, y=10, z=2, nx=20, ny=15, nz=4, padding=(1, 2, 3, 4))
+        full_subset, _, _, _ = box_clipper.subset(data_array)
+        window_subset, _, _, _ = box_clipper.subset_file(test_files.forcings_pfb.as_posix())
+        self.assertEqual((4, 19, 26), window_subset.shape)
+        self.assertIsNone(np.testing.assert_array_equal(full_subset, window_subset))
+
+    def test_box_subset_file_slabs_matches_full_read(self):
+        data_array = file_io_tools.read_file(test_files.forcings_pfb.as_posix())
+        box_clipper = BoxClipper(ref_array=data_array, x=5, y=10, z=2, nx=20, ny=15, nz=7, padding=(1, 2, 3, 4))
+        full_subset, _, _, _ = box_clipper.subset(data_array)
+        self.assertEqual([(1, 4), (4, 7), (7, 8)],
+                         [window[:2] for window in box_clipper.get_slab_windows(data_array.shape[0], 3)])
+        slabs = [slab for slab, _, _, _ in box_clipper.subset_file_slabs(test_files.forcings_pfb.as_posix(), 3)]
+        self.assertEqual([3, 3, 1], [slab.shape[0] for slab in slabs])
+        self.assertIsNone(np.testing.assert_array_equal(full_subset, np.concatenate(slabs)))
+
+    def test_multi_clipper_matches_single_clips(self):
+        data_array = file_io_tools.read_file(test_files.forcings_pfb.as_posix())
+        clippers = [BoxClipper(ref_array=data_array, x=5, y=10, z=2, nx=20, ny=15, nz=4, padding=(1, 2, 3, 4)),
+                    BoxClipper(ref_array=data_array, x=30, y=1, nx=5, ny=3),
+                    BoxClipper(ref_array=data_array, x=1, y=1, z=24, nx=1, ny=1, nz=1)]
+        multi_clipper = MultiClipper(clippers)
+        self.assertSequenceEqual((0, 24, 0, 24, 0, 34), multi_clipper.get_window())
+        results = multi_clipper.subset_file(test_files.forcings_pfb.as_posix())
+        self.assertEqual(len(clippers), len(results))
+        for clipper, (multi_subset, _, _, _) in zip(clippers, results):
+            single_subset, _, _, _ = clipper.subset(data_array)
+            self.assertIsNone(np.testing.assert_array_equal(single_subset, multi_subset))
+
+    def test_multi_clipper_with_masks(self):
+        data_array = file_io_tools.read_file(test_files.conus1_dem.as_posix())
+        masks = [SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix()),
+                 SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())]
+        masks[1].add_bbox_to_mask(padding=(9, 9, 9, 9))
+        multi_clipper = MultiClipper(masks, no_data_threshold=-1)
+        results = multi_clipper.subset_file(test_files.conus1_dem.as_posix())
+        for clipper, (multi_subset, multi_geom, _, multi_bbox) in zip(multi_clipper.clippers, results):
+            single_subset, single_geom, _, single_bbox = clipper.subset(data_array)
+            self.assertIsNone(np.testing.assert_array_equal(single_subset, multi_subset))
+            self.assertSequenceEqual(single_geom, multi_geom)
+            self.assertSequenceEqual(single_bbox, multi_bbox)
+
+    def test_subset_multi_layer(self):
+        data_array = file_io_tools.read_file(test_files.conus1_dem.as_posix())
+        my_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        clipper = MaskClipper(subset_mask=my_mask, no_data_threshold=-1)
+        single_subset, _, clipped_mask, _ = clipper.subset(data_array)
+        multi_subset, _, _, _ = clipper.subset(np.concatenate([data_array, data_array * 2, data_array * 3]))
+        self.assertEqual((3,) + single_subset.shape[1:], multi_subset.shape)
+        for layer in range(3):
+            self.assertIsNone(np.testing.assert_array_equal(np.where(clipped_mask[0], single_subset[0] * (layer + 1),
+                                                                     -999), multi_subset[layer]))
+
     def test_compare_box_clips(self):
         data_array = file_io_tools.read_file(test_files.conus1_dem.as_posix())
         my_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
@@ -3,7 +3,7 @@ import unittest
 import numpy as np
 import parflow.subset.utils.io as file_io_tools
 import tests.test_files as test_files
-from parflow.subset.clipper import ClmClipper
+from parflow.subset.clipper import ClmClipper, split_latlon
 from parflow.subset.bbox import BBox
 
 
@@ -19,8 +19,8 @@ class ClmUtilsClipperRegressionTests(unittest.TestCase):
             bbox = BBox(bbox_list[0], bbox_list[1], bbox_list[2], bbox_list[3])
             clm_clipper = ClmClipper(bbox)
 
-            latlon_data, _ = clm_clipper.clip_latlon(test_files.conus1_latlon)
-            land_cover_data, vegm_data = clm_clipper.clip_land_cover(lat_lon_array=latlon_data,
+            lat, lon = clm_clipper.clip_latlon(test_files.conus1_latlon)
+            land_cover_data, vegm_data = clm_clipper.clip_land_cover(lat=lat, lon=lon,
                                                                      land_cover_file=test_files.conus1_landcover)
             clm_clipper.write_land_cover(vegm_data, 'WBDHU8_vegm_test.dat')
             with open('WBDHU8_vegm_test.dat', 'r') as test_file:
@@ -41,9 +41,9 @@ class ClmUtilsClipperRegressionTests(unittest.TestCase):
             bbox_list = test_files.huc10190004.get('conus1_bbox')
             bbox = BBox(bbox_list[0], bbox_list[1], bbox_list[2], bbox_list[3])
             clm_clipper = ClmClipper(bbox)
-            latlon_formatted, latlon_data = clm_clipper.clip_latlon(test_files.conus1_latlon)
-            clm_clipper.write_lat_lon(latlon_formatted, 'WBDHU8_latlon_test.sa', x=latlon_data.shape[2],
-                                      y=latlon_data.shape[1], z=latlon_data.shape[0])
+            lat, lon = clm_clipper.clip_latlon(test_files.conus1_latlon)
+            clm_clipper.write_lat_lon(lat, lon, 'WBDHU8_latlon_test.sa', x=lat.shape[2], y=lat.shape[1],
+                                      z=lat.shape[0])
             self.assertIsNone(np.testing.assert_array_equal(file_io_tools.read_file('WBDHU8_latlon_test.sa'),
                                                             file_io_tools.read_file(
                                                                 test_files.huc10190004.get('conus1_latlon').as_posix()
@@ -56,5 +56,31 @@ class ClmUtilsClipperRegressionTests(unittest.TestCase):
             pass
 
 
+class ClmUtilsUnitTests(unittest.TestCase):
+
+    def test_clip_write_latlon_numeric(self):
+        latlon_file = test_files.huc10190004.get('conus1_latlon').as_posix()
+        bbox_list = test_files.huc10190004.get('conus1_bbox')
+        clm_clipper = ClmClipper(BBox(1, 1, bbox_list[2], bbox_list[3]))
+        lat, lon = clm_clipper.clip_latlon(latlon_file)
+        self.assertEqual(np.float64, lat.dtype)
+        self.assertSequenceEqual((1, bbox_list[3], bbox_list[2]), lon.shape)
+        clm_clipper.write_lat_lon(lat, lon, 'WBDHU8_latlon_test.sa', x=lat.shape[2], y=lat.shape[1], z=lat.shape[0])
+        with open('WBDHU8_latlon_test.sa', 'r') as test_file:
+            with open(latlon_file, 'r') as ref_file:
+                self.assertEqual(ref_file.read().split(), test_file.read().split(),
+                                 'the numbers are written back as they were read')
+        os.remove('WBDHU8_latlon_test.sa')
+
+    def test_split_latlon(self):
+        lat, lon = split_latlon(np.array([[['39.5 -105.25', '40.0 -104.75']]], dtype=object))
+        self.assertIsNone(np.testing.assert_array_equal([39.5, 40.0], lat))
+        self.assertIsNone(np.testing.assert_array_equal([-105.25, -104.75], lon))
+        lat, lon = split_latlon(np.array([[39.5, -105.25], [40.0, -104.75]]))
+        self.assertIsNone(np.testing.assert_array_equal([39.5, 40.0], lat), 'numeric pairs are passed through')
+        with self.assertRaises(Exception):
+            split_latlon(np.array(['39.5 -105.25', '40.0'], dtype=object))
+
+
 if __name__ == '__main__':
     unittest.main()
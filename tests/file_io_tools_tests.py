@@ -1,5 +1,6 @@
 import unittest
 import os
+import shutil
 import numpy as np
 import gdal
 from osgeo import osr
@@ -15,17 +16,105 @@ class FileIOToolBasicTestCase(unittest.TestCase):
         self.assertEqual(290.4338, results[0, 0, 0])
         self.assertEqual(292.9594, results[-1, 40, 40])
 
+    def test_read_sa_window(self):
+        full_array = file_io_tools.read_file(test_files.forcings_sa)
+        results = file_io_tools.read_file(test_files.forcings_sa, window=(2, 5, 10, 20, 3, 30))
+        self.assertEqual((3, 10, 27), results.shape)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[2:5, 10:20, 3:30], results),
+                          'reading a sa window gives the same values as slicing the full array')
+        results = file_io_tools.read_sa(test_files.forcings_sa, window=(None, None, 40, None, None, 1), chunk_size=64)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[:, 40:, :1], results),
+                          'windows are read the same across chunk boundaries')
+
+    def test_read_sa_types(self):
+        latlon = file_io_tools.read_file(test_files.huc10190004.get('conus1_latlon'))
+        self.assertEqual(object, latlon.dtype, 'lat lon pairs are read as strings')
+        self.assertEqual(2, len(latlon[0, 0, 0].split(' ')))
+        with open('test_ints.sa', 'w') as ints_file:
+            ints_file.write('2 1 1\n11\n12\n')
+        land_cover = file_io_tools.read_file('test_ints.sa')
+        self.assertTrue(np.issubdtype(land_cover.dtype, np.integer), 'integer files are read as integers')
+        self.assertEqual([[[11, 12]]], land_cover.tolist())
+        os.remove('test_ints.sa')
+
     def test_read_pfb(self):
         results = file_io_tools.read_file(test_files.forcings_pfb)
         self.assertEqual((24, 41, 41), results.shape)
         self.assertEqual(290.4337549299417, results[0, 0, 0])
         self.assertEqual(292.95937295652664, results[-1, 40, 40])
 
+    def test_read_pfb_window(self):
+        full_array = file_io_tools.read_file(test_files.forcings_pfb)
+        results = file_io_tools.read_file(test_files.forcings_pfb, window=(2, 5, 10, 20, 3, 30))
+        self.assertEqual((3, 10, 27), results.shape)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[2:5, 10:20, 3:30], results),
+                          'reading a pfb window gives the same values as slicing the full array')
+        results = file_io_tools.read_file(test_files.forcings_pfb, window=(None, None, 40, None, None, 1))
+        self.assertIsNone(np.testing.assert_array_equal(full_array[:, 40:, :1], results),
+                          'None values in the window read the full extent of that axis')
+
+    def test_read_pfb_header(self):
+        header, subgrids = file_io_tools.read_pfb_header(test_files.forcings_pfb)
+        self.assertEqual((41, 41, 24), (header['nx'], header['ny'], header['nz']))
+        self.assertEqual(header['num_subgrids'], len(subgrids))
+        self.assertEqual(sum(s[3] * s[4] * s[5] for s in subgrids), 41 * 41 * 24)
+
+    def test_probe_file(self):
+        pfb_info = file_io_tools.probe_file(test_files.forcings_pfb)
+        self.assertEqual('pfb', pfb_info.file_type)
+        self.assertEqual((24, 41, 41), pfb_info.shape)
+        self.assertEqual(np.float64, pfb_info.dtype)
+        self.assertEqual(file_io_tools.read_pfb_header(test_files.forcings_pfb)[1], pfb_info.subgrids)
+        sa_info = file_io_tools.probe_file(test_files.forcings_sa)
+        self.assertEqual((24, 41, 41), sa_info.shape)
+        self.assertIsNone(sa_info.subgrids)
+        self.assertIsNone(sa_info.dtype, 'read_sa types .sa values by parsing them all')
+        tif_info = file_io_tools.probe_file(test_files.forcings_tif)
+        self.assertEqual((24, 41, 41), tif_info.shape)
+        self.assertEqual(file_io_tools.read_file(test_files.forcings_tif).dtype, tif_info.dtype)
+        with self.assertRaises(ValueError):
+            file_io_tools.probe_file('test_probe.txt')
+
     def test_read_tif(self):
         results = file_io_tools.read_file(test_files.regression_truth_tif)
         self.assertEqual(3, len(results.shape), 'read a 2d tiff always returns a 3d array')
         results3d = file_io_tools.read_file(test_files.forcings_tif)
         self.assertEqual(3, len(results3d.shape), 'read a 3d tiff always returns a 3d array')
+        self.assertTrue(results3d.flags['C_CONTIGUOUS'], 'the y axis is flipped while reading, not with a view')
+
+    def test_pfb_file_slices(self):
+        full_array = file_io_tools.read_file(test_files.forcings_pfb)
+        pfb_file = file_io_tools.PFBFile(test_files.forcings_pfb)
+        self.assertEqual((24, 41, 41), pfb_file.shape)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[3:7, 10:-5, :12], pfb_file[3:7, 10:-5, :12]))
+        self.assertIsNone(np.testing.assert_array_equal(full_array[-1], pfb_file[-1]))
+        self.assertIsNone(np.testing.assert_array_equal(full_array[:, 20, 5:9], pfb_file[:, 20, 5:9]))
+        self.assertEqual((24, 41, 41), pfb_file.subgrid(0).shape)
+        with self.assertRaises(IndexError):
+            pfb_file[::2]
+        pfb_file.close()
+
+    def test_pfb_file_saved_index(self):
+        shutil.copy(test_files.forcings_pfb, 'test_pfb_index.pfb')
+        pfb_file = file_io_tools.PFBFile('test_pfb_index.pfb', save_index=True)
+        self.assertTrue(os.path.isfile(pfb_file.index_file))
+        reopened = file_io_tools.PFBFile('test_pfb_index.pfb')
+        self.assertSequenceEqual(pfb_file.subgrids, reopened.subgrids)
+        self.assertIsNone(np.testing.assert_array_equal(pfb_file.read_window(), reopened.read_window()))
+        pfb_file.close()
+        reopened.close()
+        os.remove(pfb_file.index_file)
+        os.remove('test_pfb_index.pfb')
+
+    def test_read_tif_window(self):
+        full_array = file_io_tools.read_file(test_files.forcings_tif)
+        results = file_io_tools.read_file(test_files.forcings_tif, window=(2, 5, 10, 20, 3, 30))
+        self.assertEqual((3, 10, 27), results.shape)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[2:5, 10:20, 3:30], results),
+                          'reading a tif window gives the same values as slicing the full (flipped) array')
+        subsurface_array = file_io_tools.read_file(test_files.conus2_subsurface)
+        results = file_io_tools.read_file(test_files.conus2_subsurface, window=(None, 1, 0, 7, 5, 9))
+        self.assertIsNone(np.testing.assert_array_equal(subsurface_array[:1, :7, 5:9], results))
 
     def test_write_read_bbox(self):
         bbox = [10, 15, 20, 25]
@@ -44,6 +133,44 @@ class FileIOToolBasicTestCase(unittest.TestCase):
                                                         file_io_tools.read_file(
                                                             test_files.regression_truth_tif)),
                           'writing and reading a tif gives back the same array values')
+        self.assertEqual(file_io_tools.read_file(test_files.regression_truth_tif).dtype, data_array.dtype,
+                         'writing and reading a tif keeps the data type')
+        os.remove('test_write_tif_out.tif')
+
+    def test_write_tiff_dtype(self):
+        ds_ref = gdal.Open(os.fspath(test_files.regression_truth_tif))
+        file_io_tools.write_array_to_geotiff('test_write_tif_out.tif',
+                                             file_io_tools.read_file(test_files.forcings_pfb),
+                                             ds_ref.GetGeoTransform(), ds_ref.GetProjection(), dtype=gdal.GDT_Float32)
+        self.assertEqual(np.float32, file_io_tools.read_file('test_write_tif_out.tif').dtype)
+        os.remove('test_write_tif_out.tif')
+
+    def test_output_dtype(self):
+        self.assertEqual(np.float32, file_io_tools.output_dtype(np.float32, -999))
+        self.assertEqual(np.int16, file_io_tools.output_dtype(np.uint8, -999), 'no_data must fit in the output')
+        self.assertEqual(np.uint8, file_io_tools.output_dtype(np.uint8, 0))
+        self.assertEqual(gdal.GDT_Int16, file_io_tools.gdal_type_code(np.int16))
+
+    @unittest.skipUnless(hasattr(gdal, 'GDT_Int64'), 'gdal before 3.5 has no 64 bit integer rasters')
+    def test_read_write_tif_int64(self):
+        data = np.arange(-6, 6, dtype=np.int64).reshape((1, 3, 4)) * 2 ** 40
+        file_io_tools.write_array_to_geotiff('test_write_tif_out.tif', data, (0, 1, 0, 3, 0, -1), '')
+        read_data = file_io_tools.read_file('test_write_tif_out.tif')
+        self.assertEqual(np.int64, read_data.dtype)
+        self.assertIsNone(np.testing.assert_array_equal(data, read_data))
+        os.remove('test_write_tif_out.tif')
+
+    @unittest.skipUnless(hasattr(gdal, 'GDT_Int8'), 'gdal before 3.7 has no signed byte rasters')
+    def test_int8_type(self):
+        self.assertEqual(np.int8, file_io_tools.gdal_dtype(gdal.GDT_Int8))
+        self.assertEqual(gdal.GDT_Int8, file_io_tools.gdal_type_code(np.int8))
+
+    def test_read_tif_unsupported_type(self):
+        dataset = gdal.GetDriverByName('GTiff').Create('test_write_tif_out.tif', 4, 3, 1, gdal.GDT_CInt16)
+        dataset.FlushCache()
+        dataset = None
+        with self.assertRaises(Exception):
+            file_io_tools.read_file('test_write_tif_out.tif')
         os.remove('test_write_tif_out.tif')
 
     def test_write_read_pfb(self):
@@ -54,6 +181,74 @@ class FileIOToolBasicTestCase(unittest.TestCase):
                           'writing and reading a pfb gives back the same array values')
         os.remove('test_pfb_out.pfb')
 
+    def test_write_pfb_topology(self):
+        forcings_data = file_io_tools.read_file(test_files.forcings_pfb)
+        file_io_tools.write_pfb(forcings_data, 'test_pfb_out.pfb', p=3, q=2, r=2)
+        header, subgrids = file_io_tools.read_pfb_header('test_pfb_out.pfb')
+        self.assertEqual(12, header['num_subgrids'])
+        self.assertEqual([(0, 0, 0, 14, 21, 12), (14, 0, 0, 14, 21, 12), (28, 0, 0, 13, 21, 12)],
+                         [subgrid[:6] for subgrid in subgrids[:3]], 'subgrids are split like ParFlow, x fastest')
+        read_data = file_io_tools.read_file('test_pfb_out.pfb')
+        self.assertIsNone(np.testing.assert_array_equal(forcings_data, read_data),
+                          'writing and reading a distributed pfb gives back the same array values')
+        with self.assertRaises(Exception):
+            file_io_tools.write_pfb(forcings_data, 'test_pfb_out.pfb', p=42)
+        os.remove('test_pfb_out.pfb')
+
+    def test_pfb_writer_layers(self):
+        forcings_data = file_io_tools.read_file(test_files.forcings_pfb)
+        file_io_tools.write_pfb(forcings_data, 'test_pfb_whole.pfb', p=2, q=3, r=2)
+        with file_io_tools.PFBWriter('test_pfb_layers.pfb', forcings_data.shape, p=2, q=3, r=2) as writer:
+            for z in range(0, forcings_data.shape[0], 5):
+                writer.write_layers(forcings_data[z:z + 5])
+        with open('test_pfb_whole.pfb', 'rb') as whole, open('test_pfb_layers.pfb', 'rb') as layers:
+            self.assertEqual(whole.read(), layers.read(), 'writing layer blocks gives the same file as write_pfb')
+        writer = file_io_tools.PFBWriter('test_pfb_layers.pfb', forcings_data.shape)
+        writer.write_layers(forcings_data[:5])
+        with self.assertRaises(Exception):
+            writer.write_layers(forcings_data[:, :10, :])
+        with self.assertRaises(Exception):
+            writer.close()
+        os.remove('test_pfb_whole.pfb')
+        os.remove('test_pfb_layers.pfb')
+
+    def test_write_pfb_dist(self):
+        forcings_data = file_io_tools.read_file(test_files.forcings_pfb)
+        file_io_tools.write_pfb(forcings_data, 'test_pfb_out.pfb', p=2, q=2, r=1, dist=True)
+        _, subgrids = file_io_tools.read_pfb_header('test_pfb_out.pfb')
+        with open('test_pfb_out.pfb.dist', 'r') as dist_file:
+            offsets = [int(line) for line in dist_file.read().split()]
+        self.assertEqual([subgrid[6] - file_io_tools.PFB_SUBGRID_HEADER.size for subgrid in subgrids], offsets,
+                         'the .dist file has the position of each subgrid header')
+        os.remove('test_pfb_out.pfb')
+        os.remove('test_pfb_out.pfb.dist')
+
+    def test_subgrid_extents(self):
+        self.assertEqual([(0, 4), (4, 3), (7, 3)], file_io_tools.subgrid_extents(10, 3))
+        self.assertEqual([(0, 10)], file_io_tools.subgrid_extents(10, 1))
+
+    def test_write_text_file_matches_savetxt(self):
+        data = np.random.rand(50, 4) * 100
+        fmt = ['%d', '%.6f', '%.2f', '%s']
+        np.savetxt('test_savetxt.txt', data, fmt=fmt, header='first\nsecond', comments='# ', delimiter=' ')
+        file_io_tools.write_array_to_text_file(data, 'test_text_out.txt', header='first\nsecond', fmt=fmt,
+                                               comments='# ', chunk_rows=7)
+        with open('test_savetxt.txt', 'r') as ref_file, open('test_text_out.txt', 'r') as out_file:
+            self.assertEqual(ref_file.read(), out_file.read())
+        os.remove('test_savetxt.txt')
+        os.remove('test_text_out.txt')
+
+    def test_write_text_file_dtypes_match_savetxt(self):
+        for data in [np.linspace(0, 1, 11, dtype=np.float32).reshape(-1, 1) + np.float32(0.1),
+                     np.arange(-10, 10, dtype=np.int32).reshape(-1, 2),
+                     np.array([[0.1, 1 / 3]])]:
+            np.savetxt('test_savetxt.txt', data, fmt='%s', header='1 2 3', comments='', delimiter=' ')
+            file_io_tools.write_array_to_text_file(data, 'test_text_out.txt', header='1 2 3', fmt='%s', chunk_rows=3)
+            with open('test_savetxt.txt', 'r') as ref_file, open('test_text_out.txt', 'r') as out_file:
+                self.assertEqual(ref_file.read(), out_file.read(), f'values of {data.dtype} print as np.savetxt')
+        os.remove('test_savetxt.txt')
+        os.remove('test_text_out.txt')
+
     def test_read_pfb_sa_tif(self):
         sa_array = file_io_tools.read_file(test_files.forcings_sa)
         pfb_array = file_io_tools.read_file(test_files.forcings_pfb)
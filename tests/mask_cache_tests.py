@@ -0,0 +1,93 @@
+import unittest
+import os
+import shutil
+from pathlib import Path
+from unittest import mock
+import numpy as np
+import parflow.subset.utils.io as file_io_tools
+from parflow.subset.cache import MaskCache
+from parflow.subset.clipper import MaskClipper
+from parflow.subset.mask import SubsetMask
+import tests.test_files as test_files
+
+
+class MaskCacheTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.reference_dataset = file_io_tools.read_geotiff(test_files.huc10190004.get('conus1_mask').as_posix())
+        cls.shape_path = Path(test_files.huc10190004.get('shapefile')).parent
+        cls.shape_name = Path(test_files.huc10190004.get('shapefile')).stem
+
+    def setUp(self):
+        self.cache_path = 'test_mask_cache'
+        self.mask_cache = MaskCache(self.cache_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+
+    def test_key(self):
+        key = self.mask_cache.key(self.shape_path, self.shape_name, self.reference_dataset)
+        self.assertEqual(key, self.mask_cache.key(self.shape_path, self.shape_name, self.reference_dataset))
+        self.assertNotEqual(key, self.mask_cache.key(self.shape_path, self.shape_name, self.reference_dataset,
+                                                     padding=(1, 0, 0, 0)))
+        self.assertNotEqual(key, self.mask_cache.key(self.shape_path, self.shape_name, self.reference_dataset,
+                                                     attribute_ids=[2]))
+
+    def test_round_trip(self):
+        subset_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        subset_mask.add_bbox_to_mask(padding=(3, 2, 1, 4))
+        clipper = MaskClipper(subset_mask, no_data_threshold=-1)
+        key = self.mask_cache.key(self.shape_path, self.shape_name, self.reference_dataset, padding=(3, 2, 1, 4))
+        self.assertIsNone(self.mask_cache.get(key, self.reference_dataset), 'nothing cached yet')
+        self.mask_cache.put(key, subset_mask, clipper)
+        cached_mask, cached_clipper = self.mask_cache.get(key, self.reference_dataset)
+        self.assertSequenceEqual(subset_mask.bbox_edges, cached_mask.bbox_edges)
+        self.assertSequenceEqual(clipper.clipped_geom, cached_clipper.clipped_geom)
+        self.assertIsNone(np.testing.assert_array_equal(subset_mask.mask_array, cached_mask.mask_array))
+        self.assertIsNone(np.testing.assert_array_equal(clipper.clipped_mask, cached_clipper.clipped_mask))
+
+    def test_hit_skips_setup(self):
+        subset_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        subset_mask.add_bbox_to_mask(padding=(3, 2, 1, 4))
+        clipper = MaskClipper(subset_mask, no_data_threshold=-1)
+        self.mask_cache.put('hit', subset_mask, clipper)
+        with mock.patch('parflow.subset.mask._find_edges') as find_edges, \
+                mock.patch.object(MaskClipper, '__init__') as clipper_init, \
+                mock.patch('parflow.subset.utils.io.write_array_to_geotiff') as write_tif:
+            cached_mask, cached_clipper = self.mask_cache.get('hit', self.reference_dataset)
+        self.assertFalse(find_edges.called, 'the cached mask is not searched for its edges')
+        self.assertFalse(clipper_init.called, 'the cached clipper is not cropped from the mask again')
+        self.assertFalse(write_tif.called, 'the cached mask is not written to a tif')
+        self.assertSequenceEqual(subset_mask.inner_mask_edges, cached_mask.inner_mask_edges)
+        self.assertEqual(subset_mask.projection, cached_mask.projection)
+        self.assertIsNone(np.testing.assert_array_equal(clipper.bbox_valid, cached_clipper.bbox_valid))
+        self.assertIsNone(np.testing.assert_array_equal(clipper.inner_indices, cached_clipper.inner_indices))
+
+    def test_round_trip_without_no_data(self):
+        window = np.zeros((1, 3, 4), dtype=np.int32)
+        window[0, 1, 1:3] = 1
+        subset_mask = SubsetMask.from_window(window, (2, 4, 5, 8), (1, 10, 10), (0, 1, 0, 10, 0, -1), '',
+                                             outer_value=-1)
+        self.assertIsNone(subset_mask.no_data_value)
+        clipper = MaskClipper(subset_mask, no_data_threshold=-1)
+        self.mask_cache.put('no_data', subset_mask, clipper)
+        cached_mask, cached_clipper = self.mask_cache.get('no_data', self.reference_dataset)
+        self.assertIsNone(cached_mask.no_data_value)
+        self.assertSequenceEqual((3, 3, 6, 7), cached_mask.inner_mask_edges)
+        self.assertIsNone(np.testing.assert_array_equal(subset_mask.crop_bbox_mask(), cached_mask.crop_bbox_mask()))
+        self.assertIsNone(np.testing.assert_array_equal(clipper.clipped_mask, cached_clipper.clipped_mask))
+
+    def test_evict_least_recently_used(self):
+        subset_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
+        clipper = MaskClipper(subset_mask, no_data_threshold=-1)
+        first = self.mask_cache.put('first', subset_mask, clipper)
+        os.utime(first, ns=(0, 0))
+        self.mask_cache.max_bytes = os.path.getsize(first)
+        second = self.mask_cache.put('second', subset_mask, clipper)
+        self.assertFalse(os.path.isfile(first), 'the oldest entry is removed')
+        self.assertTrue(os.path.isfile(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
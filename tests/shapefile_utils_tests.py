@@ -2,6 +2,7 @@ import os
 import unittest
 from pathlib import Path
 import numpy as np
+import gdal
 import parflow.subset.utils.io as file_io_tools
 import tests.test_files as test_files
 from parflow.subset.rasterizer import ShapefileRasterizer
@@ -13,6 +14,8 @@ class ShapefileReprojectCase(unittest.TestCase):
     def setUpClass(cls) -> None:
         cls.conus1_mask_datset = file_io_tools.read_geotiff(test_files.conus1_mask.as_posix())
         cls.conus2_mask_dataset = file_io_tools.read_geotiff(test_files.conus2_mask.as_posix())
+        # the HUC mask covers the whole CONUS1 grid
+        cls.conus1_grid_dataset = file_io_tools.read_geotiff(test_files.huc10190004.get('conus1_mask').as_posix())
         cls.shape_path = Path(test_files.huc10190004.get('shapefile')).parent
         cls.shape_name = Path(test_files.huc10190004.get('shapefile')).stem
 
@@ -40,6 +43,35 @@ class ShapefileReprojectCase(unittest.TestCase):
             'Should create a mask from CONUS2 with 1/0s')
         os.remove('testout.tif')
 
+    def test_reproject_window(self):
+        rasterizer = ShapefileRasterizer(self.shape_path, self.shape_name, self.conus1_grid_dataset)
+        tif_path = rasterizer.reproject_and_mask()
+        _, window_y, window_x = file_io_tools.read_file(tif_path).shape
+        subset_mask = rasterizer.subset_mask
+        grid = self.conus1_grid_dataset
+        self.assertLess(window_y * window_x, grid.RasterXSize * grid.RasterYSize,
+                        'Should rasterize only the window around the shape')
+        self.assertSequenceEqual((1, grid.RasterYSize, grid.RasterXSize), subset_mask.mask_shape)
+        expected = file_io_tools.read_file(test_files.huc10190004.get('conus1_mask').as_posix()) == 1
+        y_0, x_0 = subset_mask.offset
+        self.assertEqual(np.count_nonzero(expected),
+                         np.count_nonzero(expected[:, y_0:y_0 + window_y, x_0:x_0 + window_x]),
+                         'Should record the offset of the window in the domain')
+
+    def test_reproject_and_label(self):
+        rasterizer = ShapefileRasterizer(self.shape_path, self.shape_name, self.conus1_grid_dataset)
+        subset_masks = rasterizer.reproject_and_label(attribute_ids=[1])
+        self.assertSequenceEqual([1], list(subset_masks))
+        self.assertIsNone(gdal.Open(f'/vsimem/{self.shape_name}_OBJECTID.tif'), 'Should remove the label raster')
+        self.assertIsNone(subset_masks[1].mask_tif, 'Should not write a raster for each mask')
+        rasterizer.reproject_and_mask(attribute_ids=[1])
+        self.assertSequenceEqual(rasterizer.subset_mask.bbox_edges, subset_masks[1].bbox_edges)
+        self.assertIsNone(np.testing.assert_array_equal(rasterizer.subset_mask.mask_array,
+                                                        subset_masks[1].mask_array),
+                          'Should split the label raster into the same mask as rasterizing the ID alone')
+        self.assertSequenceEqual(rasterizer.subset_mask.inner_mask_edges, subset_masks[1].inner_mask_edges)
+        self.assertEqual(rasterizer.subset_mask.no_data_value, subset_masks[1].no_data_value)
+
     def test_rasterize_no_data_values(self):
         rasterizer = ShapefileRasterizer(self.shape_path, shapefile_name=self.shape_name,
                                          reference_dataset=self.conus1_mask_datset, no_data=-9999999)
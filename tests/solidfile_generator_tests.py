@@ -1,43 +1,109 @@
 import os
 import unittest
+from unittest import mock
+import numpy as np
 import parflow.subset.builders.solidfile as solidfile_generator
 import tests.test_files as test_files
 from parflow.subset.clipper import MaskClipper
 from parflow.subset.mask import SubsetMask
 
 
+def read_pfsol(pfsol_file):
+    """read the points, triangles and patches of the single solid in a .pfsol file"""
+    with open(pfsol_file, 'r') as fi:
+        lines = fi.read().split('\n')
+    n_points = int(lines[1])
+    points = np.array([line.split() for line in lines[2:2 + n_points]], dtype=float)
+    n_triangles = int(lines[3 + n_points])
+    triangles = np.array([line.split() for line in lines[4 + n_points:4 + n_points + n_triangles]], dtype=int)
+    line_no = 4 + n_points + n_triangles
+    patches = []
+    for _ in range(int(lines[line_no])):
+        n_patch = int(lines[line_no + 1])
+        patches.append(np.array(lines[line_no + 2:line_no + 2 + n_patch], dtype=int))
+        line_no += 1 + n_patch
+    return points, triangles, patches
+
+
+def patch_areas(points, triangles, patches):
+    """total area of the triangles in each patch of a solid"""
+    corners = points[triangles]
+    areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1) / 2
+    return [areas[patch].sum() for patch in patches]
+
+
+def read_vtk(vtk_file):
+    """read the points, triangles and patches of a legacy .vtk file with a patch_index cell scalar"""
+    with open(vtk_file, 'r') as fi:
+        lines = fi.read().split('\n')
+    n_points = int(lines[4].split()[1])
+    points = np.array([line.split() for line in lines[5:5 + n_points]], dtype=float)
+    n_triangles = int(lines[5 + n_points].split()[1])
+    polygons = np.array([line.split() for line in lines[6 + n_points:6 + n_points + n_triangles]], dtype=int)
+    codes = np.array(lines[9 + n_points + n_triangles:9 + n_points + 2 * n_triangles], dtype=int)
+    assert np.all(polygons[:, 0] == 3), 'every polygon is a triangle'
+    return points, polygons[:, 1:], [np.flatnonzero(codes == code) for code in np.unique(codes)]
+
+
+def patch_footprint(points, triangles, patch, shape, dx=1000.):
+    """(ny, nx) cells whose center lies on a triangle of a flat patch, seen from above with y axis 0 at bottom"""
+    footprint = np.zeros(shape, dtype=bool)
+    corners = points[triangles[patch]][:, :, :2] / dx
+    lower = np.floor(corners.min(axis=1)).astype(int)
+    size = np.ceil(corners.max(axis=1)).astype(int) - lower
+    # the triangles with the same size of bounding box are checked together, against the cells in their boxes
+    for size_x, size_y in np.unique(size, axis=0):
+        group = np.all(size == (size_x, size_y), axis=1)
+        cell_y = lower[group, 1, np.newaxis, np.newaxis] + np.arange(size_y)[:, np.newaxis]
+        cell_x = lower[group, 0, np.newaxis, np.newaxis] + np.arange(size_x)
+        start = corners[group][:, :, np.newaxis, np.newaxis, :]
+        end = np.roll(corners[group], -1, axis=1)[:, :, np.newaxis, np.newaxis, :]
+        # the center is inside when it is on the same side of all three edges, or on an edge
+        sides = (end[..., 0] - start[..., 0]) * (cell_y[:, np.newaxis] + 0.5 - start[..., 1]) - \
+            (end[..., 1] - start[..., 1]) * (cell_x[:, np.newaxis] + 0.5 - start[..., 0])
+        inside = np.all(sides >= 0, axis=1) | np.all(sides <= 0, axis=1)
+        footprint[np.broadcast_to(cell_y, inside.shape)[inside], np.broadcast_to(cell_x, inside.shape)[inside]] = True
+    return footprint
+
+
 class RegressionSolidFileTests(unittest.TestCase):
     """
     Regression tests1 to verify solidfile_generator creates solid file correctly from mask
-    """
 
-    asc_filenames = ['Back_Border.asc', 'Bottom_Border.asc', 'Front_Border.asc',
-                     'Left_Border.asc', 'Right_Border.asc', 'Top_Border.asc']
+    The reference files were made by pfmask-to-pfsol, which merges the cell faces into larger triangles, so the
+    patches are compared by their area and by the cells under the top and bottom patches
+    """
 
-    def tearDown(self):
-        for f in self.asc_filenames:
-            try:
-                os.remove(f)
-            except OSError:
-                pass
+    def assert_matches_reference(self, solid, ref_solid, clipped_mask):
+        """compare the areas and the top and bottom footprints of two solids read from file"""
+        points, triangles, patches = solid
+        ref_points, ref_triangles, ref_patches = ref_solid
+        self.assertEqual(len(ref_patches), len(patches))
+        self.assertIsNone(np.testing.assert_allclose(patch_areas(ref_points, ref_triangles, ref_patches),
+                                                     patch_areas(points, triangles, patches)))
+        shape = clipped_mask.shape[1:]
+        inside = clipped_mask[0] == 1
+        self.assertFalse(np.array_equal(inside, np.flip(inside, axis=0)), 'the mask is not symmetric in y')
+        # patches are sorted by code, 0 side, 3 top, 6 bottom
+        for patch, ref_patch in zip(patches[1:], ref_patches[1:]):
+            footprint = patch_footprint(points, triangles, patch, shape)
+            self.assertIsNone(np.testing.assert_array_equal(patch_footprint(ref_points, ref_triangles, ref_patch,
+                                                                            shape), footprint))
+            self.assertIsNone(np.testing.assert_array_equal(inside, footprint), 'the solid has the mask orientation')
 
     def test_create_solid_file_conus1(self):
         my_mask = SubsetMask(test_files.huc10190004.get('conus1_mask').as_posix())
         clipper = MaskClipper(subset_mask=my_mask, no_data_threshold=-1)
         batches = solidfile_generator.make_solid_file(clipped_mask=clipper.clipped_mask, out_name='conus1_solid')
-        self.assertEqual(batches, '0 3 6 ')
-        with open('conus1_solid.pfsol', 'r') as test_file:
-            with open(test_files.huc10190004.get('conus1_sol'), 'r') as ref_file:
-                self.assertEqual(test_file.read(), ref_file.read(),
-                                 'Writing PFSOL file matches reference for conus1')
-        """
-        make sure the vtk files match as well. skip the first two lines as they contain a version and filename that
-        may vary
-        """
-        with open('conus1_solid.vtk', 'r') as test_file:
-            with open(test_files.huc10190004.get('conus1_vtk'), 'r') as ref_file:
-                self.assertEqual(test_file.read().split('\n')[2:], ref_file.read().split('\n')[2:],
-                                 'Writing vtk file matches reference for conus1')
+        self.assertSequenceEqual([0, 3, 6], batches)
+        self.assert_matches_reference(read_pfsol('conus1_solid.pfsol'),
+                                      read_pfsol(test_files.huc10190004.get('conus1_sol')), clipper.clipped_mask)
+        pfsol_solid = read_pfsol('conus1_solid.pfsol')
+        vtk_solid = read_vtk('conus1_solid.vtk')
+        for pfsol_part, vtk_part in zip(pfsol_solid, vtk_solid):
+            self.assertIsNone(np.testing.assert_equal(pfsol_part, vtk_part), 'the vtk file holds the same solid')
+        self.assert_matches_reference(vtk_solid, read_vtk(test_files.huc10190004.get('conus1_vtk')),
+                                      clipper.clipped_mask)
         os.remove('conus1_solid.vtk')
         os.remove('conus1_solid.pfsol')
 
@@ -45,24 +111,59 @@ class RegressionSolidFileTests(unittest.TestCase):
         my_mask = SubsetMask(test_files.huc10190004.get('conus2_mask').as_posix())
         clipper = MaskClipper(subset_mask=my_mask, no_data_threshold=-1)
         batches = solidfile_generator.make_solid_file(clipper.clipped_mask, 'conus2_solid')
-        self.assertEqual(batches, '0 3 6 ')
-        with open('conus2_solid.pfsol', 'r') as test_file:
-            with open(test_files.huc10190004.get('conus2_sol'), 'r') as ref_file:
-                self.assertEqual(test_file.read(), ref_file.read(),
-                                 'Writing PFSOL file matches reference for conus2')
-        """
-        make sure the vtk files match as well. skip the first two lines as they contain a version and filename that
-        may vary
-        """
-        with open('conus2_solid.vtk', 'r') as test_file:
-            with open(test_files.huc10190004.get('conus2_vtk').as_posix(), 'r') as ref_file:
-                self.assertEqual(test_file.read().split('\n')[2:], ref_file.read().split('\n')[2:],
-                                 'Writing vtk file matches reference for conus2')
-        for f in self.asc_filenames:
-            os.remove(f)
+        self.assertSequenceEqual([0, 3, 6], batches)
+        self.assert_matches_reference(read_pfsol('conus2_solid.pfsol'),
+                                      read_pfsol(test_files.huc10190004.get('conus2_sol')), clipper.clipped_mask)
+        pfsol_solid = read_pfsol('conus2_solid.pfsol')
+        vtk_solid = read_vtk('conus2_solid.vtk')
+        for pfsol_part, vtk_part in zip(pfsol_solid, vtk_solid):
+            self.assertIsNone(np.testing.assert_equal(pfsol_part, vtk_part), 'the vtk file holds the same solid')
+        self.assert_matches_reference(vtk_solid, read_vtk(test_files.huc10190004.get('conus2_vtk')),
+                                      clipper.clipped_mask)
         os.remove('conus2_solid.vtk')
         os.remove('conus2_solid.pfsol')
 
+    def test_build_solid_closed(self):
+        mask = np.zeros((1, 4, 5))
+        mask[0, 1:3, 1:4] = 1
+        mask[0, 3, 0] = 1
+        points, triangles, patches = solidfile_generator.build_solid(solidfile_generator.solid_patch_mats(mask),
+                                                                     dx=10, dz=2)
+        self.assertSequenceEqual([0, 3, 6], sorted(patches))
+        self.assertEqual(len(triangles), sum(len(patch) for patch in patches.values()))
+        # the divergence theorem gives the enclosed volume when every triangle faces out
+        corners = points[triangles]
+        volume = np.einsum('ij,ij->i', corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum() / 6
+        self.assertAlmostEqual(7 * 10 * 10 * 2, volume)
+
+    def test_special_patches(self):
+        mask = np.zeros((1, 3, 4))
+        mask[0, :, 1:] = 1
+        special_layers = {'SINKS': np.full((1, 3, 4), -999), 'LAKE_MASK': np.zeros((1, 3, 4)),
+                          'RESERVOIRS': np.zeros((1, 3, 4)), 'CELL_TYPES': np.zeros((1, 3, 4))}
+        special_layers['SINKS'][0, 0, 1] = 1
+        special_layers['LAKE_MASK'][0, 1:, 2] = 1
+        special_layers['RESERVOIRS'][0, 2, 2] = 1
+        special_layers['CELL_TYPES'][0, :, 3] = solidfile_generator.OCEAN_CELL_TYPE
+        patch_mats = solidfile_generator.solid_patch_mats(mask, special_layers=special_layers)
+        self.assertIsNone(np.testing.assert_array_equal([[-1, 5, 3, 3], [-1, 3, 4, 3], [-1, 3, 9, 3]],
+                                                        patch_mats['top']), 'reservoirs win over lakes')
+        self.assertIsNone(np.testing.assert_array_equal([[-1, -1, -1, 1]] * 3, patch_mats['right']))
+        self.assertIsNone(np.testing.assert_array_equal([[-1, 0, -1, -1]] * 3, patch_mats['left']))
+        self.assertIsNone(np.testing.assert_array_equal([[-1, 0, 0, 1], [-1] * 4, [-1] * 4], patch_mats['front']))
+        points, triangles, patches = solidfile_generator.build_solid(patch_mats)
+        self.assertSequenceEqual([0, 1, 3, 4, 5, 6, 9], sorted(patches))
+        self.assertEqual(2, len(patches[5]))
+
+    def test_ocean_cell_type(self):
+        mask = np.ones((1, 2, 2))
+        cell_types = np.full((1, 2, 2), 7)
+        cell_types[0, :, 0] = 1
+        with mock.patch.object(solidfile_generator, 'OCEAN_CELL_TYPE', 7):
+            patch_mats = solidfile_generator.solid_patch_mats(mask, special_layers={'CELL_TYPES': cell_types})
+        self.assertIsNone(np.testing.assert_array_equal([[0, 1], [-1, -1]], patch_mats['front']),
+                          'ocean borders are found by their cell type and get the ocean patch code')
+
 
 if __name__ == '__main__':
     unittest.main()
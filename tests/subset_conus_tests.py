@@ -36,6 +36,10 @@ class SubsetConusCLITests(unittest.TestCase):
         self.assertSequenceEqual([1], args.attribute_ids)
         self.assertEqual('OBJECTID', args.attribute_name)
         self.assertFalse(args.write_tifs)
+        self.assertIsNone(args.cache_dir)
+        self.assertEqual(256, args.cache_size)
+        self.assertFalse(args.special_patches)
+        self.assertSequenceEqual((2, 1, 1), args.topology)
 
     def test_cli_no_args(self):
         """should error without arguments"""
@@ -80,6 +84,12 @@ class SubsetConusCLITests(unittest.TestCase):
         self.assertSequenceEqual([2, 3], args.attribute_ids)
         self.assertEqual('ID', args.attribute_name)
 
+    def test_cli_topology(self):
+        argstring = f'-i {self.good_shape_file_path} -s {self.good_shape_file_name} -f . --topology 3 2 1'
+        self.assertSequenceEqual([3, 2, 1], subset_conus.parse_args(argstring.split(' ')).topology)
+        with self.assertRaises(SystemExit):
+            subset_conus.parse_args(argstring.replace('3 2 1', '3 0 1').split(' '))
+
     def test_cli_alt_manifest_file(self):
         argstring = f'-i {self.good_shape_file_path} -s {self.good_shape_file_name} -f . ' \
                     f'-m {test_files.test_domain_manifest}'
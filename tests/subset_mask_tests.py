@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from parflow.subset.mask import SubsetMask
 from test_files import huc10190004
 
@@ -24,6 +25,44 @@ class SubsetMaskClassTests(unittest.TestCase):
         self.assertEqual(-999, my_mask.no_data_value)
         self.assertEqual(0, my_mask.bbox_val)
 
+    def test_compact_mask(self):
+        my_mask = SubsetMask(huc10190004.get('conus1_mask').as_posix())
+        self.assertLess(my_mask.nbytes, 4096, 'only the bbox is held, bit-packed')
+        my_mask.add_bbox_to_mask(padding=(9, 9, 9, 9))
+        min_y, max_y, min_x, max_x = my_mask.bbox_edges
+        full_mask = my_mask.bbox_mask
+        self.assertEqual((1, 1888, 3342), full_mask.shape)
+        cropped_mask = my_mask.crop_bbox_mask()
+        self.assertIsNone(np.testing.assert_array_equal(full_mask[:, min_y:max_y + 1, min_x:max_x + 1].filled(-1),
+                                                        cropped_mask.filled(-1)))
+        self.assertEqual(np.count_nonzero(my_mask.mask_array == 1), np.count_nonzero(cropped_mask == 1))
+
+    def test_dense_arrays_cached(self):
+        my_mask = SubsetMask(huc10190004.get('conus1_mask').as_posix())
+        mask_array = my_mask.mask_array
+        self.assertIs(mask_array, my_mask.mask_array, 'the full-domain array is built once')
+        self.assertFalse(mask_array.flags.writeable)
+        self.assertIs(my_mask.bbox_mask, my_mask.bbox_mask)
+        self.assertIs(my_mask.inner_mask, my_mask.inner_mask)
+        self.assertTrue(np.shares_memory(mask_array, my_mask.inner_mask))
+        new_mask, new_edges = my_mask.add_bbox_to_mask(padding=(9, 9, 9, 9))
+        self.assertNotIn('mask_array', my_mask._dense, 'adding the bbox does not build the full-domain array')
+        self.assertEqual((1, new_edges[1] - new_edges[0], new_edges[3] - new_edges[2]), new_mask.shape)
+        self.assertTrue(new_mask.flags.writeable)
+        self.assertIsNot(mask_array, my_mask.mask_array, 'changing the mask drops the cached arrays')
+        self.assertEqual(np.count_nonzero(new_mask == 0), my_mask.bbox_mask.count() - my_mask.inner_mask.count())
+
+    def test_mask_without_no_data(self):
+        window = np.array([[[0, 1, 0], [1, 1, 0], [0, 0, 0]]], dtype=np.int32)
+        my_mask = SubsetMask.from_window(window, (2, 4, 3, 5), (1, 6, 8), (0, 1, 0, 6, 0, -1), '')
+        self.assertIsNone(my_mask.no_data_value)
+        expected = np.zeros((1, 6, 8), dtype=np.int32)
+        expected[:, 2:5, 3:6] = window
+        self.assertIsNone(np.testing.assert_array_equal(expected, my_mask.mask_array))
+        self.assertEqual(np.int32, my_mask.mask_array.dtype)
+        self.assertIsNone(np.testing.assert_array_equal(expected[:, 1:6, 2:7],
+                                                        my_mask.crop_bbox_mask((1, 5, 2, 6)).filled(-1)))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+from parflow.subset.builders import tcl
+from parflow.subset.data import parkinglot_template
+
+
+class TclTemplateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.template_file = 'test_template.tcl'
+        with open(self.template_file, 'w') as fo:
+            fo.write('set runname test\n'
+                     '# pfset Cell.1.dzScale.Value  1.0\n'
+                     'pfset Cell.1.dzScale.Value   0.5\n'
+                     'pfset Cell.10.dzScale.Value  0.25\n'
+                     'file copy -force ../slopex.pfb .\n'
+                     'pfrun $runname\n'
+                     'pfundist $runname\n')
+
+    def tearDown(self):
+        os.remove(self.template_file)
+
+    def test_index_whole_keys(self):
+        template = tcl.TclTemplate(self.template_file)
+        self.assertSequenceEqual([0], template.locate('runname'))
+        self.assertSequenceEqual([2], template.locate('Cell.1.dzScale.Value'))
+        self.assertSequenceEqual([4], template.locate('file copy -force'))
+        self.assertSequenceEqual([], template.locate('pfdist'))
+        results = template.results(['Cell.1.dzScale.Value', 'pfdist'])
+        self.assertSequenceEqual([['pfset', 'Cell.1.dzScale.Value', '0.5']], results['Cell.1.dzScale.Value']['vals'])
+        self.assertNotIn('pfdist', results)
+
+    def test_template_cache(self):
+        template = tcl.get_template(self.template_file)
+        self.assertIs(template, tcl.get_template(self.template_file), 'unchanged templates are parsed once')
+        results, content = tcl.read_infile(self.template_file)
+        results['runname']['vals'][0][-1] = 'changed'
+        content[0] = 'changed'
+        self.assertEqual('set runname test', template.lines[0], 'edits do not reach the cached template')
+        self.assertEqual('test', tcl.read_infile(self.template_file)[0]['runname']['vals'][0][-1])
+        with open(self.template_file, 'a') as fo:
+            fo.write('pfset Cell.2.dzScale.Value   0.5\n')
+        os.utime(self.template_file, ns=(0, 0))
+        self.assertIsNot(template, tcl.get_template(self.template_file), 'changed templates are parsed again')
+
+    def test_parkinglot_template(self):
+        results, content = tcl.read_infile(parkinglot_template)
+        self.assertSequenceEqual([], [key for key in tcl.CRITICAL_KEYS if key not in results])
+        self.assertEqual(4, len(results['file copy -force']['locs']))
+        self.assertEqual(3, len(results['pfdist']['locs']))
+
+    def test_special_patch_bcs(self):
+        content = tcl.read_infile(parkinglot_template)[1]
+        added = tcl.add_patch_bcs(content, ['land', 'ocean', 'top', 'lake', 'stream', 'bottom'])
+        self.assertEqual(len(content) + 5 + 2 * 8, len(added))
+        self.assertIn('pfset Patch.ocean.BCPressure.Type\t\t        FluxConst', added)
+        self.assertIn('pfset Patch.stream.BCPressure.Type                 OverlandFlow', added)
+        self.assertEqual(2, len([line for line in added if 'Patch.lake.BCPressure.Cycle' in line]))
+        self.assertNotIn('pfset Patch.sink.BCPressure.Type                 OverlandFlow', added)
+        self.assertSequenceEqual(content, tcl.add_patch_bcs(content, ['land', 'top', 'bottom']),
+                                 'templates without special patches are unchanged')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import shutil
+import numpy as np
+import parflow.subset.utils.io as file_io_tools
+from parflow.subset.utils.tiles import TileStore, TileReader, write_tile_store, DEFAULT_TILE_SIZE
+from parflow.subset.tools import convert_conus
+import tests.test_files as test_files
+
+
+class TileStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tile_path = 'test_tiles'
+        os.makedirs(self.tile_path, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tile_path)
+
+    def test_round_trip(self):
+        full_array = file_io_tools.read_file(test_files.forcings_pfb)
+        for compress in (False, True):
+            store = write_tile_store(test_files.forcings_pfb, os.path.join(self.tile_path, 'forcings'), tile_size=16,
+                                     compress=compress)
+            self.assertEqual((24, 41, 41), store.shape)
+            self.assertEqual(9, len([f for f in os.listdir(store.store_path) if f.startswith('tile_')]))
+            self.assertIsNone(np.testing.assert_array_equal(full_array, store.read_window()),
+                              'the whole store reads back the original data')
+            self.assertIsNone(np.testing.assert_array_equal(full_array[2:5, 10:37, 15:17],
+                                                            store.read_window((2, 5, 10, 37, 15, 17))),
+                              'windows across tile boundaries match slices of the original data')
+            shutil.rmtree(store.store_path)
+
+    def test_round_trip_sa(self):
+        full_array = file_io_tools.read_file(test_files.forcings_sa)
+        store = write_tile_store(test_files.forcings_sa, os.path.join(self.tile_path, 'forcings'), tile_size=32)
+        self.assertIsNone(np.testing.assert_array_equal(full_array[:, 30:, :33], store.read_window((None, None, 30,
+                                                                                                   None, None, 33))))
+        self.assertEqual(full_array.dtype, TileStore(store.store_path).dtype)
+
+    def test_tile_reader(self):
+        reader = TileReader(self.tile_path)
+        window = (0, 1, 5, 9, 20, 41)
+        expected = file_io_tools.read_file(test_files.forcings_pfb, window=window)
+        self.assertIsNone(reader.get_store(test_files.forcings_pfb), 'no store before conversion')
+        self.assertIsNone(np.testing.assert_array_equal(expected, reader(test_files.forcings_pfb, window=window)),
+                          'files without a store are read directly')
+        write_tile_store(test_files.forcings_pfb, reader.store_path(test_files.forcings_pfb), tile_size=8)
+        self.assertIsNotNone(reader.get_store(test_files.forcings_pfb))
+        self.assertIsNone(np.testing.assert_array_equal(expected, reader(test_files.forcings_pfb, window=window)),
+                          'files with a store are read from their tiles')
+
+    def test_missing_source_not_current(self):
+        os.makedirs(os.path.join(self.tile_path, 'source'))
+        source = os.path.join(self.tile_path, 'source', 'forcings.pfb')
+        shutil.copy(test_files.forcings_pfb, source)
+        reader = TileReader(self.tile_path)
+        store = write_tile_store(source, reader.store_path(source), tile_size=16)
+        self.assertTrue(store.is_current(source))
+        os.remove(source)
+        self.assertFalse(store.is_current(source), 'a store without its source file is not current')
+        self.assertIsNone(reader.get_store(source), 'the reader falls back to the raw file')
+
+    def test_tile_checked_against_index(self):
+        store = write_tile_store(test_files.forcings_pfb, os.path.join(self.tile_path, 'forcings'), tile_size=16)
+        np.save(store.tile_file(0, 1), np.zeros((24, 16, 16), dtype=np.float32))
+        with self.assertRaises(Exception):
+            store.read_window()
+        np.save(store.tile_file(0, 1), np.zeros((24, 16, 8)))
+        with self.assertRaises(Exception):
+            store.read_window()
+        self.assertEqual((24, 9, 9), store.tile_shape(2, 2))
+
+    def test_convert_conus_args(self):
+        args = convert_conus.parse_args(['-f', '.'])
+        self.assertEqual(1, args.conus_version)
+        self.assertEqual(DEFAULT_TILE_SIZE, args.tile_size)
+        self.assertEqual(2, convert_conus.parse_args(['-f', '.', '-v', '2']).conus_version)
+        for bad_args in (['-v', '3'], ['-s', '0']):
+            with self.assertRaises(SystemExit):
+                convert_conus.parse_args(['-f', '.'] + bad_args)
+
+
+if __name__ == '__main__':
+    unittest.main()